@@ -1,5 +1,25 @@
+import argparse
+import os
+import sys
+import threading
 import time
-import pandas as pd
+
+import bikeshare_defaults
+import bikeshare_instrument
+import bikeshare_lazy
+
+# The modules that analyse the data import pandas, which takes longer than everything else at startup, so they
+# are imported when they are first used, or in the background while the user answers the first question
+bikeshare_cache = bikeshare_lazy.LazyModule('bikeshare_cache')
+bikeshare_cube = bikeshare_lazy.LazyModule('bikeshare_cube')
+bikeshare_data = bikeshare_lazy.LazyModule('bikeshare_data')
+bikeshare_parallel = bikeshare_lazy.LazyModule('bikeshare_parallel')
+bikeshare_report = bikeshare_lazy.LazyModule('bikeshare_report')
+bikeshare_rollup = bikeshare_lazy.LazyModule('bikeshare_rollup')
+bikeshare_sketch = bikeshare_lazy.LazyModule('bikeshare_sketch')
+bikeshare_stats = bikeshare_lazy.LazyModule('bikeshare_stats')
+ENGINE_MODULES = [bikeshare_cache, bikeshare_cube, bikeshare_data, bikeshare_parallel, bikeshare_report,
+                  bikeshare_rollup, bikeshare_sketch, bikeshare_stats]
 
 # Value to use to indicate "all" for either the month or day of the week.
 # The other numbers will be used directly.
@@ -38,10 +58,57 @@ ALLOWED_DAY_SELECTION = {ALL: ('All', {'all'}),
                          6: ('Friday', {'friday', 'fri', '6'}),
                          7: ('Saturday', {'saturday', 'sat', '7'})}
 
+# City name to use to analyze every city in CITY_DATA
+ALL_CITIES = 'all'
+
+# Value that stands for every city, month or day in a batch selection
+EVERY_VALUE = '*'
+
+# CSV files larger than this number of megabytes are read in chunks instead of being loaded into memory
+DEFAULT_STREAM_THRESHOLD_MB = 2048
+
+# Largest error of the trip duration percentiles read from the sketch, in percent of the true value
+SKETCH_ACCURACY_PERCENT = round(bikeshare_defaults.SKETCH_RELATIVE_ACCURACY * 100)
+
 # Dictionary for yes/no questions
 YES_NO_SELECTION = {'Yes': ('yes', {'y', 'yes'}),
                     'No': ('no', {'n', 'no'})}
 
+# Number of stations and of start hours shown on each page of the ranked lists
+STATION_ROWS_PER_PAGE = 10
+HOUR_ROWS_PER_PAGE = 5
+
+
+class Pager:
+    """
+    Shows long lists a page at a time, asking the user before each page after the first.  With asking turned off
+    every page is written as soon as it is ready, so the lists can be streamed to a file or another program.
+    """
+
+    def __init__(self):
+        self.ask = True
+
+    def show_pages(self, row_count, rows_at_a_time, show_page):
+        """
+        Shows the rows of a list a page at a time until they are all shown or the user asks to stop
+
+        Args:
+            (int) row_count: number of rows in the list
+            (int) rows_at_a_time: number of rows on a page
+            (function) show_page: shows the rows from a start position up to a stop position
+        """
+        for start in range(0, row_count, rows_at_a_time):
+            # Ask before a page rather than after one, so the user is never asked and then shown nothing
+            if start > 0 and self.ask and not ask_should_show_more_data():
+                break
+            show_page(start, min(start + rows_at_a_time, row_count))
+            if not self.ask:
+                sys.stdout.flush()
+
+
+# The pager used for every ranked list
+PAGER = Pager()
+
 
 def get_answer_for_prompt(prompt):
     """
@@ -141,7 +208,7 @@ def get_filters():
     Asks the user to specify a city, month, and day to analyze.
 
     Returns:
-        (str) city - name of the city to analyze
+        (str) city - name of the city to analyze, or all for every city
         (int) month - the number of the month in the year, or 0 for all
         (int) day - the number of the day in the week, or 0 for all
     """
@@ -154,8 +221,8 @@ def get_filters():
     request_info = True
 
     # Set up the prompt for the user
-    prompt = 'Please enter a city (Chicago, New York City, or Washington), the month (January through June or ALL), ' \
-             'and the day of the week (or All) (using commas to separate the values: '
+    prompt = 'Please enter a city (Chicago, New York City, Washington, or ALL), the month (January through June ' \
+             'or ALL), and the day of the week (or All) (using commas to separate the values: '
 
     # While we should request the information for the analysis, prompt the user for the input and
     # determine which city, month, and day we should use, or show an error and ask the user again.
@@ -175,14 +242,14 @@ def get_filters():
             # to a city, the second value to a month (or ALL), and the third value
             # to a day (or ALL)
             if len(input_values) == 3:
-                if input_values[0].strip().lower() in CITY_DATA:
+                if input_values[0].strip().lower() in CITY_DATA or input_values[0].strip().lower() == ALL_CITIES:
                     city = input_values[0].strip()
 
                 # See if the month and the day are allowed values
                 month = get_key_for_value(input_values[1].strip().lower(), ALLOWED_MONTH_SELECTION)
                 day = get_key_for_value(input_values[2].strip().lower(), ALLOWED_DAY_SELECTION)
                 if city == '':
-                    print('Please enter a city from the list: Chicago, New York City, Washington')
+                    print('Please enter a city from the list: Chicago, New York City, Washington, or ALL')
                 if month == NOT_FOUND:
                     print('Please enter a month from January to June (or use a three letter abbreviation or the month '
                           'number) or specify ALL.')
@@ -203,7 +270,52 @@ def get_filters():
     return city, month, day
 
 
-def load_data(city, month, day):
+def get_weekday_number(day):
+    """
+    Converts a day of the week from ALLOWED_DAY_SELECTION (1 for Sunday) to the day numbers used by
+    the data (0 for Monday)
+
+    Args:
+        (int) day - the day of the week, 1 for Sunday through 7 for Saturday
+    Returns:
+        (int) the day of the week, 0 for Monday through 6 for Sunday
+    """
+    return (day - 2) % 7
+
+
+def get_city_data(city, cache_dir=bikeshare_defaults.DEFAULT_CACHE_DIR):
+    """
+    Returns the prepared data of a city with the index of its rows for each month and day of week
+
+    Args:
+        (str) city - name of the city to analyze
+        (str) cache_dir - directory for the parsed city data, or None to always parse the CSV file
+    Returns:
+        (CityData) the city data
+    """
+    # The parsed data, including the month, day of week and start hour columns, and the index of the rows for
+    # each month and day of week are kept in memory between selections.  The parsed data is reused from the
+    # disk cache unless the CSV file changed.
+    return bikeshare_cache.MEMORY_CACHE.get(
+        CITY_DATA[city.lower()],
+        lambda filename: bikeshare_cache.load_city_data(filename, cache_dir))
+
+
+def get_selection(month, day):
+    """
+    Converts the month and day of the week selected by the user to the values used by the city data
+
+    Args:
+        (int) month - key to the month to filter by, or ALL to apply no month filter
+        (int) day - the day of week to filter by, or ALL to apply no day filter
+    Returns:
+        (tuple) the month number and the day of the week (0 for Monday), None for either when it is not filtered
+    """
+    return None if month == ALL else month, None if day == ALL else get_weekday_number(day)
+
+
+@bikeshare_instrument.recorded
+def load_data(city, month, day, cache_dir=bikeshare_defaults.DEFAULT_CACHE_DIR):
     """
     Loads data for the specified city and filters by month and day if applicable.
 
@@ -211,321 +323,981 @@ def load_data(city, month, day):
         (str) city - name of the city to analyze
         (int) month - key to the month to filter by, or ALL to apply no month filter
         (int) day - the day of week to filter by, or ALL to apply no day filter
+        (str) cache_dir - directory for the parsed city data, or None to always parse the CSV file
     Returns:
         df - Pandas DataFrame containing city data filtered by month and day
     """
-    df = pd.read_csv(CITY_DATA[city.lower()])
+    city_data = get_city_data(city, cache_dir)
 
-    # Convert the start and end times to date time types
-    df['Start Time'] = pd.to_datetime(df['Start Time'])
-    df['End Time'] = pd.to_datetime(df['End Time'])
+    # Use the index to get the rows for the selected month and day of the week
+    df = city_data.select(*get_selection(month, day))
 
-    # Add the month and the day of week columns to the data frame because they could be used in filtering
-    # and displaying.  Added the month number to help in sorting.
-    df['month'] = df['Start Time'].dt.month_name()
-    df['month_no'] = df['Start Time'].dt.month
-    df['day_of_week'] = df['Start Time'].dt.day_name()
-    df['start_hour'] = df['Start Time'].dt.hour
+    # Callers may add columns, so never hand out the cached data frame itself.  A shallow copy does not copy
+    # the data.
+    if df is city_data.df:
+        df = df.copy(deep=False)
 
-    # Filter by the month if selected
-    if month != ALL:
-        df = df[df['month'] == ALLOWED_MONTH_SELECTION[month][NAME_IDX]]
+    return df
 
-    # Filter by the day of the week if selected
-    if day != ALL:
-        df = df[df['day_of_week'] == ALLOWED_DAY_SELECTION[day][NAME_IDX]]
 
-    return df
+def load_trip_stats(city, month, day, cache_dir=bikeshare_defaults.DEFAULT_CACHE_DIR, distributions=False):
+    """
+    Returns all the statistics for the specified city, month and day.  They are computed once for each
+    selection and kept with the city data.
+
+    Args:
+        (str) city - name of the city to analyze
+        (int) month - key to the month to filter by, or ALL to apply no month filter
+        (int) day - the day of week to filter by, or ALL to apply no day filter
+        (str) cache_dir - directory for the parsed city data, or None to always parse the CSV file
+        (bool) distributions - True to also compute the trip duration percentiles of each group
+    Returns:
+        (TripStats) the statistics for the selected trips
+    """
+    return get_city_data(city, cache_dir).get_trip_stats(*get_selection(month, day), distributions)
 
 
-def display_most_common_value(df, field_name, display_name):
+def stream_trip_stats(city, month, day, chunk_rows=bikeshare_defaults.DEFAULT_CHUNK_ROWS, quantile_sketch=False,
+                      distributions=False):
     """
-    Displays statistics on the most frequent values
+    Returns all the statistics for the specified city, month and day by reading the CSV file in chunks,
+    for cities too large to load into memory at once
+
+    Args:
+        (str) city - name of the city to analyze
+        (int) month - key to the month to filter by, or ALL to apply no month filter
+        (int) day - the day of week to filter by, or ALL to apply no day filter
+        (int) chunk_rows - number of rows to read at a time
+        (bool) quantile_sketch - True to keep only the sketch of the trip durations
+        (bool) distributions - True to also compute the trip duration percentiles of each group
+    Returns:
+        (TripStats) the statistics for the selected trips
+    """
+    aggregates = bikeshare_data.stream_trip_aggregates(CITY_DATA[city.lower()], *get_selection(month, day),
+                                                        chunk_rows=chunk_rows, quantile_sketch=quantile_sketch,
+                                                        distributions=distributions)
+    return bikeshare_stats.TripStats(aggregates)
+
+
+def get_aggregation_classes(options):
+    """
+    Returns the classes used to add up the chunks of a CSV file and to summarize them, exact or approximate
+
+    Args:
+        options - the parsed command line arguments
+    Returns:
+        (tuple) the TripAggregates class, the TripStats class and the arguments for the TripAggregates class
+    """
+    if options.approximate:
+        return (bikeshare_sketch.ApproximateTripAggregates, bikeshare_sketch.ApproximateTripStats,
+                {'counter_count': options.sketch_counters,
+                 'epsilon': options.sketch_epsilon,
+                 'delta': options.sketch_delta,
+                 'quantile_sketch': options.quantile_sketch,
+                 'distributions': options.distributions})
+    return (bikeshare_stats.TripAggregates, bikeshare_stats.TripStats,
+            {'quantile_sketch': options.quantile_sketch, 'distributions': options.distributions})
+
+
+def approximate_trip_stats(city, month, day, options):
+    """
+    Returns all the statistics for the specified city, month and day by reading the CSV file in chunks, with
+    the station statistics counted approximately in a fixed amount of memory
+
+    Args:
+        (str) city - name of the city to analyze
+        (int) month - key to the month to filter by, or ALL to apply no month filter
+        (int) day - the day of week to filter by, or ALL to apply no day filter
+        options - the parsed command line arguments
+    Returns:
+        (ApproximateTripStats) the statistics for the selected trips
+    """
+    aggregates_class, stats_class, aggregates_options = get_aggregation_classes(options)
+    selection = get_selection(month, day)
+    aggregates = bikeshare_data.stream_selection_aggregates(CITY_DATA[city.lower()], [selection], options.chunk_rows,
+                                                            aggregates_class, **aggregates_options)
+    return stats_class(aggregates[selection])
+
+
+def verify_approximate_stats(approximate_stats, exact_stats):
+    """
+    Displays how close the approximate station statistics are to the exact ones
+
+    Args:
+        (ApproximateTripStats) approximate_stats: the statistics with approximate station counts
+        (TripStats) exact_stats: the exact statistics for the same trips
+    """
+    print('\nApproximate station counts compared with the exact counts:')
+    for name, counts_name in (('start stations', 'start_station_counts'),
+                              ('end stations', 'end_station_counts'),
+                              ('round trips', 'round_trip_counts'),
+                              ('station pairs', 'top_station_pairs')):
+        found, compared, difference = bikeshare_sketch.compare_counts(getattr(exact_stats, counts_name),
+                                                                      getattr(approximate_stats, counts_name))
+        print(f'  {name}: {found} of the {compared} most common found, largest count difference {difference} '
+              f'(at most {approximate_stats.station_errors[name]:.1f})')
+    print('-' * 40)
+
+
+def should_stream(city, stream, stream_threshold_mb):
+    """
+    Decides if the CSV file of a city should be read in chunks instead of being loaded into memory
+
+    Args:
+        (str) city - name of the city to analyze
+        (bool) stream - whether reading in chunks was requested
+        (int) stream_threshold_mb - size of the CSV file in megabytes above which it is always read in chunks
+    Returns:
+        (bool) whether to read the file in chunks
+    """
+    return stream or os.path.getsize(CITY_DATA[city.lower()]) > stream_threshold_mb * 1024 * 1024
+
+
+def load_all_city_trip_stats(month, day, worker_count, cache_dir=bikeshare_defaults.DEFAULT_CACHE_DIR,
+                             quantile_sketch=False, distributions=False):
+    """
+    Returns all the statistics for every city for the specified month and day.  With more than one worker
+    the cities are parsed and aggregated at the same time by a pool of worker processes.
+
+    Args:
+        (int) month - key to the month to filter by, or ALL to apply no month filter
+        (int) day - the day of week to filter by, or ALL to apply no day filter
+        (int) worker_count - number of worker processes, 1 to load the cities one after another
+        (str) cache_dir - directory for the parsed city data, or None to always parse the CSV file
+        (bool) quantile_sketch - True for the worker processes to keep only the sketch of the trip durations
+        (bool) distributions - True to also compute the trip duration percentiles of each group
+    Returns:
+        (dict) the TripStats of each city, by city name
+    """
+    if worker_count == 1:
+        return {city: load_trip_stats(city, month, day, cache_dir, distributions) for city in CITY_DATA}
+
+    city_aggregates = bikeshare_parallel.aggregate_cities(CITY_DATA.values(), *get_selection(month, day),
+                                                          worker_count=worker_count, quantile_sketch=quantile_sketch,
+                                                          distributions=distributions)
+    return {city: bikeshare_stats.TripStats(city_aggregates[filename]) for city, filename in CITY_DATA.items()}
+
+
+def load_cube_stats(city, month, day, cache_dir=bikeshare_defaults.DEFAULT_CACHE_DIR,
+                    chunk_rows=bikeshare_defaults.DEFAULT_CHUNK_ROWS):
+    """
+    Returns the time, trip duration and user type statistics for the specified city, month and day from the
+    city's cube, building the cube first if needed
+
+    Args:
+        (str) city - name of the city to analyze
+        (int) month - key to the month to filter by, or ALL to apply no month filter
+        (int) day - the day of week to filter by, or ALL to apply no day filter
+        (str) cache_dir - directory the cube is stored in, or None to build the cube without storing it
+        (int) chunk_rows - number of rows to read at a time when the cube is built
+    Returns:
+        (CubeStats) the statistics for the selected trips
+    """
+    cube = bikeshare_cube.load_cube(CITY_DATA[city.lower()], cache_dir, chunk_rows)
+    return cube.get_trip_stats(*get_selection(month, day))
+
+
+def get_trip_stats(df, trip_stats, distributions=False):
+    """
+    Returns the statistics to display, computing them from the data frame when they were not given
 
     Args:
         (Pandas DataFrame) df: data frame of bike share data
+        (TripStats) trip_stats: the statistics for the data frame, or None
+        (bool) distributions: True when the trip duration percentiles of each group are needed
+    Returns:
+        (TripStats) the statistics for the data frame
+    """
+    if trip_stats is None or (distributions and trip_stats.duration_percentiles_by_month is None):
+        return bikeshare_stats.compute_trip_stats(df, distributions)
+    return trip_stats
+
+
+def display_most_common_value(trip_stats, field_name, display_name):
+    """
+    Displays statistics on the most frequent values
+
+    Args:
+        (TripStats) trip_stats: statistics of the bike share data
         (str) field_name: field name to use in analysis
         (str) display_name: name to include in output
     """
-    val = df[field_name].mode()[0]
+    val = trip_stats.get_most_common(field_name)
     print(f'The most common {display_name} is {val}')
 
 
-def time_stats(df):
+@bikeshare_instrument.recorded
+def time_stats(df, trip_stats=None):
     """
     Displays statistics on the most frequent times of travel.
 
     Args:
         (Pandas DataFrame) df: data frame of bike share data
+        (TripStats) trip_stats: statistics already computed for the data frame, or None to compute them
     """
     print('\nCalculating The Most Frequent Times of Travel...\n')
-    start_time = time.time()
+    start_time = time.perf_counter()
+    trip_stats = get_trip_stats(df, trip_stats)
 
     # display the most common month
-    display_most_common_value(df, 'month', 'month')
+    display_most_common_value(trip_stats, 'month', 'month')
 
     # display the most common day of week
-    display_most_common_value(df, 'day_of_week', 'day of the week')
+    display_most_common_value(trip_stats, 'day_of_week', 'day of the week')
 
     # display the most common start hour
-    display_most_common_value(df, 'start_hour', 'start hour')
+    display_most_common_value(trip_stats, 'start_hour', 'start hour')
 
-    print("\nThis took %s seconds." % (time.time() - start_time))
+    print("\nThis took %s seconds." % (time.perf_counter() - start_time))
     print('-' * 40)
 
 
-def station_stats(df):
+@bikeshare_instrument.recorded
+def station_stats(df, trip_stats=None):
     """
     Displays statistics on the most popular stations and trip.
 
     Args:
         (Pandas DataFrame) df: data frame of bike share data
+        (TripStats) trip_stats: statistics already computed for the data frame, or None to compute them
     """
     print('\nCalculating The Most Popular Stations and Trip...\n')
-    start_time = time.time()
+    start_time = time.perf_counter()
+    trip_stats = get_trip_stats(df, trip_stats)
 
     # display most commonly used start station
-    display_most_common_value(df, 'Start Station', 'start station')
+    display_most_common_value(trip_stats, 'Start Station', 'start station')
 
     # display most commonly used end station
-    display_most_common_value(df, 'End Station', 'end station')
+    display_most_common_value(trip_stats, 'End Station', 'end station')
 
     # display most frequent combination of start station and end station trip
-    df['start_end_dest'] = 'Start: ' + df['Start Station'] + '  End: ' + df['End Station']
-    display_most_common_value(df, 'start_end_dest', 'start and end station pair')
+    display_most_common_value(trip_stats, 'start_end_dest', 'start and end station pair')
 
-    print("\nThis took %s seconds." % (time.time() - start_time))
+    print("\nThis took %s seconds." % (time.perf_counter() - start_time))
     print('-' * 40)
 
 
-def trip_duration_stats(df):
+@bikeshare_instrument.recorded
+def trip_duration_stats(df, trip_stats=None):
     """
     Displays statistics on the total and average trip duration.
 
     Args:
         (Pandas DataFrame) df: data frame of bike share data
+        (TripStats) trip_stats: statistics already computed for the data frame, or None to compute them
     """
     print('\nCalculating Trip Duration...\n')
-    start_time = time.time()
+    start_time = time.perf_counter()
+    trip_stats = get_trip_stats(df, trip_stats)
 
     # display total travel time
-    total_travel_time = df['Trip Duration'].sum()
-    print(f'The total travel time is {total_travel_time}')
+    print(f'The total travel time is {trip_stats.total_duration}')
 
     # display mean travel time
-    mean_travel_time = df['Trip Duration'].mean()
-    print(f'The mean travel time is {mean_travel_time}')
+    print(f'The mean travel time is {trip_stats.mean_duration}')
 
-    print("\nThis took %s seconds." % (time.time() - start_time))
+    print("\nThis took %s seconds." % (time.perf_counter() - start_time))
     print('-' * 40)
 
 
-def user_stats(df):
+@bikeshare_instrument.recorded
+def user_stats(df, trip_stats=None):
     """
     Displays statistics on bikeshare users.
 
     Args:
         (Pandas DataFrame) df: data frame of bike share data
+        (TripStats) trip_stats: statistics already computed for the data frame, or None to compute them
     """
     print('\nCalculating User Stats...\n')
-    start_time = time.time()
+    start_time = time.perf_counter()
+    trip_stats = get_trip_stats(df, trip_stats)
 
     # Display counts of user types
-    user_types_counts = df['User Type'].value_counts()
     print('User types:')
-    print(user_types_counts)
+    print(trip_stats.user_type_counts)
     print()
 
     # Display counts of gender
-    if 'Gender' in df.columns:
+    if trip_stats.gender_counts is not None:
         print('Genders:')
-        gender_counts = df['Gender'].value_counts()
-        print(gender_counts)
+        print(trip_stats.gender_counts)
         print()
 
     # Display earliest, most recent, and most common year of birth
-    if 'Birth Year' in df.columns:
-        max_birth_year = df['Birth Year'].max()
-        min_birth_year = df['Birth Year'].min()
-        most_common_birth_year = df['Birth Year'].mode()[0]
+    if trip_stats.has_birth_years:
         print('Birth Years:')
-        print(f'Earliest = {min_birth_year}')
-        print(f'Latest = {max_birth_year}')
-        print(f'Most Common = {most_common_birth_year}')
+        print(f'Earliest = {trip_stats.earliest_birth_year}')
+        print(f'Latest = {trip_stats.latest_birth_year}')
+        print(f'Most Common = {trip_stats.most_common_birth_year}')
 
-    print("\nThis took %s seconds." % (time.time() - start_time))
+    print("\nThis took %s seconds." % (time.perf_counter() - start_time))
     print('-' * 40)
 
 
-def additional_time_stats(df):
+@bikeshare_instrument.recorded
+def additional_time_stats(df, trip_stats=None):
     """
     Displays additional information about the bikeshare trips -- like the number of trips
     per month, number of trips per day of the week, and the number of trips per start hour
 
     Args:
         (Pandas DataFrame) df: data frame of bike share data
+        (TripStats) trip_stats: statistics already computed for the data frame, or None to compute them
     """
     print('\nShow additional day and month information...\n')
+    trip_stats = get_trip_stats(df, trip_stats)
 
     # Display the number of trips per month
     print('Number of trips per month ordered by number of trips descending:')
-    num_trips_per_month = df['month'].value_counts()
-    print(num_trips_per_month)
+    print(trip_stats.month_counts)
 
     # Display the number of trips per month
     print('\nNumber of trips per month ordered by month:')
-    num_trips_per_month = df[['month_no', 'month']].value_counts().sort_index()
-    print(num_trips_per_month)
+    print(trip_stats.month_counts_by_number)
 
     # Display the number of trips per day of week
     print('\nNumber of trips per day of week sorted by number of trips descending:')
-    num_trips_per_day_of_week = df['day_of_week'].value_counts()
-    print(num_trips_per_day_of_week)
+    print(trip_stats.day_counts)
 
-    # Show the number of trips per start hour
+    # Show the number of trips per start hour, a page at a time
     print('\nNumber of trips per start hour by number of trips descending:')
-    num_trips_per_start_hour = df['start_hour'].value_counts()
     print(' Hour  Trips')
-    num_printed = 0
-    for index, row in num_trips_per_start_hour.iteritems():
-        # Moved the prompt before printing the next line in case the number of hours is a multiple of 5 --
-        # did not want to prompt the user and then show nothing
-        if num_printed % 5 == 0 and num_printed > 0:
-            show_more = ask_should_show_more_data()
-            if not show_more:
-                break
-        print('%5d   %7d' % (index, row))
-        num_printed += 1
+    hours = trip_stats.hour_counts.index.to_numpy()
+    hour_counts = trip_stats.hour_counts.to_numpy()
+
+    def show_hours(start, stop):
+        print('\n'.join('%5d   %7d' % row for row in zip(hours[start:stop], hour_counts[start:stop])))
+
+    PAGER.show_pages(len(hours), HOUR_ROWS_PER_PAGE, show_hours)
 
     print('-' * 40)
 
 
-def show_sequence_data(original_seq, rows_at_a_time=5):
+def format_counts(labels, counts, index_name):
     """
-    Displays the sequence of data 5 rows at a time and asks the user if the program should show more.
+    Formats counts the way pandas shows a Series of them, without building the Series
 
     Args:
-        (Pandas Sequence or database) original_seq: sequence of data for display
-        (int) Number of rows to display at a time, default to 5
+        (Index) labels: the values counted
+        (NumPy array) counts: the count of each value
+        (str) index_name: name of the values, shown above them, or None
+    Returns:
+        (str) the counts, one per line, followed by their name and type
     """
-    start_index = 0
-    end_index = rows_at_a_time if original_seq.size >= rows_at_a_time else original_seq.size
-    while start_index < original_seq.size:
-        seq = original_seq.iloc[start_index:end_index]
-        print(seq)
-        if end_index < original_seq.size:
-            if not ask_should_show_more_data():
-                break
-        start_index += rows_at_a_time
-        end_index += rows_at_a_time
-        if end_index > original_seq.size:
-            end_index = original_seq.size
+    labels = [str(label) for label in labels]
+    values = [str(count) for count in counts]
+    label_width = max(map(len, labels), default=0)
+    value_width = max(map(len, values), default=0)
 
+    lines = [] if index_name is None else [str(index_name)]
+    lines.extend(f'{label:<{label_width}}    {value:>{value_width}}' for label, value in zip(labels, values))
+    lines.append(f'Name: count, dtype: {counts.dtype}')
+    return '\n'.join(lines)
 
-def additional_station_stats(df):
+
+def show_ranked_counts(ranking, rows_at_a_time=5):
+    """
+    Displays ranked counts a page at a time, ranking only as many values as are shown
+
+    Args:
+        (RankedCounts) ranking: the counts to show, most common first
+        (int) rows_at_a_time: number of rows to show on a page
+    """
+    def show_page(start, stop):
+        print(format_counts(*ranking.get_rows(start, stop), ranking.name))
+
+    PAGER.show_pages(len(ranking), rows_at_a_time, show_page)
+
+
+@bikeshare_instrument.recorded
+def additional_station_stats(df, trip_stats=None):
     """
     Displays additional information about the stations, including how many trips there were where
     the start and end stations are the same.
 
     Args:
         (Pandas DataFrame) df: data frame of bike share data
+        (TripStats) trip_stats: statistics already computed for the data frame, or None to compute them
     """
     print('\nShow additional information about the stations...\n')
+    trip_stats = get_trip_stats(df, trip_stats)
 
     # Display the number of times the start and end stations are the same
     print('Trips where the start and end stations were the same (i.e. round trips):')
-    same_dest = df[df['Start Station'] == df['End Station']]
-    same_dest_values = same_dest['Start Station'].value_counts()
-    print(same_dest_values)
+    print(trip_stats.round_trip_counts)
 
     # Display the statistics about when the start and end destinations are the same -- the most and least
     # numbers, the mean, etc.
     print('\nSummary statistics for when the start and end destinations are the same:')
-    print(same_dest_values.describe())
+    print(trip_stats.round_trip_counts.describe())
 
-    # Display the most popular start stations, 5 at a time, this time using a sequence as opposed
-    # to iteritems function
+    # Display the most popular start stations, a page at a time
     print('\nThe most popular start stations:')
-    start_stations = df['Start Station'].value_counts()
-    show_sequence_data(start_stations, 10)
+    show_ranked_counts(trip_stats.start_station_ranking, STATION_ROWS_PER_PAGE)
 
-    # Display the most popular end stations, 5 at a time, this time using a sequence
+    # Display the most popular end stations, a page at a time
     print('\nThe most popular end stations:')
-    end_stations = df['End Station'].value_counts()
-    show_sequence_data(end_stations, 10)
+    show_ranked_counts(trip_stats.end_station_ranking, STATION_ROWS_PER_PAGE)
+
+    # Display the most popular combinations of start and end stations
+    print('\nThe most popular start and end station pairs:')
+    print(trip_stats.top_station_pairs)
 
     print('-' * 40)
 
 
-def additional_trip_duration_stats(df):
+@bikeshare_instrument.recorded
+def additional_trip_duration_stats(df, trip_stats=None):
     """
     Displays additional trip duration statistics using describe but also shows the average
     per month and the average per day of the week
 
     Args:
         (Pandas DataFrame) df: data frame of bike share data
+        (TripStats) trip_stats: statistics already computed for the data frame, or None to compute them
     """
     print('\nShow the trip duration summary statistics...\n')
-    start_time = time.time()
+    start_time = time.perf_counter()
+    trip_stats = get_trip_stats(df, trip_stats)
 
     # Show the min, max, mean, etc. of the trip duration values
     print('\nSummary statistics for the trip duration:')
-    print(df['Trip Duration'].describe())
+    print(trip_stats.duration_summary)
 
     # Show the mean trip duration by month
     print('\nMean trip duration per month:')
-    print(df.groupby(['month_no'])['Trip Duration'].mean())
+    print(trip_stats.mean_duration_by_month)
 
     # Show the mean trip duration by day of week
     print('\nMean trip duration per day of week:')
-    print(df.groupby(['day_of_week'])['Trip Duration'].mean())
+    print(trip_stats.mean_duration_by_day)
 
-    print("\nThis took %s seconds." % (time.time() - start_time))
+    print("\nThis took %s seconds." % (time.perf_counter() - start_time))
     print('-' * 40)
 
 
-def additional_user_stats(df):
+@bikeshare_instrument.recorded
+def additional_user_stats(df, trip_stats=None):
     """
     Displays additional user statistics to see if the number of customers seems to sharply
     increase during the weekends or as the weather warms and more tourists arrive.
 
     Args:
         (Pandas DataFrame) df: data frame of bike share data
+        (TripStats) trip_stats: statistics already computed for the data frame, or None to compute them
     """
     print('\nShowing additional User Stats...\n')
+    trip_stats = get_trip_stats(df, trip_stats)
 
     # Show the user types by month.  Should we see more customers (as opposed to subscribers)
     # as we approach the months linked with tourism?
     print('The user types and counts by month:')
-    print(df.groupby(['month_no'])['User Type'].value_counts())
+    print(trip_stats.user_types_by_month)
 
     # Show the user types by the day of the week to see if we have more customers on the weekends --
     # tourists and other visitors possibly.
     print('\nThe user types and counts by day of week using the day name:')
-    print(df.groupby(['day_of_week'])['User Type'].value_counts())
+    print(trip_stats.user_types_by_day)
 
     print('-' * 40)
 
 
-def main():
-    """ Repeatedly ask the user for the city, month, and day, and display information from the CSV file. """
+@bikeshare_instrument.recorded
+def distribution_stats(df, trip_stats=None):
+    """
+    Displays the percentiles and histograms of the trip duration and birth year, and the trip duration
+    percentiles per month, day of week, start hour and user type
+
+    Args:
+        (Pandas DataFrame) df: data frame of bike share data
+        (TripStats) trip_stats: statistics already computed for the data frame, or None to compute them
+    """
+    print('\nCalculating the distributions...\n')
+    start_time = time.perf_counter()
+    trip_stats = get_trip_stats(df, trip_stats, distributions=True)
+
+    # Show how the trip durations are spread out
+    print('Trip duration percentiles:')
+    print(trip_stats.duration_percentiles)
+    print('\nTrips per trip duration:')
+    print(trip_stats.duration_histogram)
+
+    # Show the trip duration percentiles of each group, with a column per percentile
+    for title, percentiles in (('month', trip_stats.duration_percentiles_by_month),
+                               ('day of week', trip_stats.duration_percentiles_by_day),
+                               ('start hour', trip_stats.duration_percentiles_by_hour),
+                               ('user type', trip_stats.duration_percentiles_by_user_type)):
+        print(f'\nTrip duration percentiles per {title} (within {SKETCH_ACCURACY_PERCENT}%):')
+        print(percentiles.unstack())
+
+    # Washington does not have the birth year
+    if trip_stats.birth_year_percentiles is not None:
+        print('\nBirth year percentiles:')
+        print(trip_stats.birth_year_percentiles)
+        print('\nTrips per birth year decade:')
+        print(trip_stats.birth_year_histogram)
+
+    print("\nThis took %s seconds." % (time.perf_counter() - start_time))
+    print('-' * 40)
+
+
+def load_selection(city, month, day, options, cache_dir):
+    """
+    Loads the data and the statistics for the specified city, month and day the way the options ask for
+
+    Args:
+        (str) city - name of the city to analyze
+        (int) month - key to the month to filter by, or ALL to apply no month filter
+        (int) day - the day of week to filter by, or ALL to apply no day filter
+        options - the parsed command line arguments
+        (str) cache_dir - directory for the parsed city data, or None to always parse the CSV file
+    Returns:
+        (tuple) the data frame, or None when only the statistics were computed, and the TripStats
+    """
+    # The approximate station statistics are counted while the file is read in chunks
+    if options.approximate:
+        trip_stats = approximate_trip_stats(city, month, day, options)
+        if options.verify_sketch:
+            verify_approximate_stats(trip_stats, stream_trip_stats(city, month, day, options.chunk_rows))
+        return None, trip_stats
+
+    # Cities that are too large to load are read in chunks, and then only the statistics are in memory
+    if should_stream(city, options.stream, options.stream_threshold_mb):
+        return None, stream_trip_stats(city, month, day, options.chunk_rows, options.quantile_sketch,
+                                       options.distributions)
+
+    # With several workers, parts of the file are parsed and aggregated at the same time
+    if options.workers > 1:
+        aggregates = bikeshare_parallel.aggregate_file(CITY_DATA[city.lower()], *get_selection(month, day),
+                                                       worker_count=options.workers,
+                                                       quantile_sketch=options.quantile_sketch,
+                                                       distributions=options.distributions)
+        return None, bikeshare_stats.TripStats(aggregates)
+
+    df = load_data(city, month, day, cache_dir)
+    trip_stats = load_trip_stats(city, month, day, cache_dir, options.distributions)
+    if options.show_cache_stats:
+        print(f'Memory cache: {bikeshare_cache.MEMORY_CACHE.stats()}')
+    if options.show_memory:
+        print(f'Memory used by the selected data: {bikeshare_data.get_memory_report(df)}')
+    return df, trip_stats
+
+
+def show_parse_times(city):
+    """
+    Displays the time spent reading and parsing each column of the city CSV file
+
+    Args:
+        (str) city - name of the city that was analyzed
+    """
+    filename = CITY_DATA[city.lower()]
+    report = bikeshare_data.get_parse_report(filename)
+    if report is None:
+        print(f'{filename} was not parsed in this process, it came from the cache or the worker processes')
+        return
+
+    print(f'Time spent parsing {filename}:')
+    for line in report:
+        print(line)
+
+
+def display_stats(df, trip_stats, distributions=False):
+    """
+    Displays all the statistics
+
+    Args:
+        (Pandas DataFrame) df: data frame of bike share data, or None when the statistics are given
+        (TripStats) trip_stats: statistics already computed for the data frame, or None to compute them
+        (bool) distributions: whether to also display the percentiles and histograms
+    """
+    # Run the functions with the questions initially asked
+    time_stats(df, trip_stats)
+    station_stats(df, trip_stats)
+    trip_duration_stats(df, trip_stats)
+    user_stats(df, trip_stats)
+
+    # Run the functions that include additional information
+    additional_time_stats(df, trip_stats)
+    additional_station_stats(df, trip_stats)
+    additional_trip_duration_stats(df, trip_stats)
+    additional_user_stats(df, trip_stats)
+    if distributions:
+        distribution_stats(df, trip_stats)
+
+
+def display_cube_stats(df, cube_stats):
+    """
+    Displays the statistics that can be answered from the cube of a city -- all except the station, birth
+    year and trip duration quartile statistics
+
+    Args:
+        (Pandas DataFrame) df: not used, always None, so this can be called like display_stats
+        (CubeStats) cube_stats: statistics answered from the cube
+    """
+    time_stats(df, cube_stats)
+    trip_duration_stats(df, cube_stats)
+    additional_time_stats(df, cube_stats)
+    additional_trip_duration_stats(df, cube_stats)
+    additional_user_stats(df, cube_stats)
+
+
+def append_city_rows(city, new_filename, cache_dir=bikeshare_defaults.DEFAULT_CACHE_DIR):
+    """
+    Adds the trips of a new CSV file to the CSV file of a city, and adds only the new trips to the cached data,
+    the cube and the rollup of the city instead of parsing the whole file again
+
+    Args:
+        (str) city - name of the city the trips are for
+        (str) new_filename - name of the CSV file with the new trips
+        (str) cache_dir - directory for the parsed city data, or None when it is not cached
+    """
+    start_time = time.time()
+    filename = CITY_DATA[city.lower()]
+    try:
+        added_bytes = bikeshare_data.append_csv_rows(filename, new_filename)
+    except (OSError, ValueError) as error:
+        print(f'Unable to add the trips of {new_filename} to {filename}: {error}')
+        return
+    print(f'Added {added_bytes} bytes from {new_filename} to {filename}')
+
+    if cache_dir is not None:
+        bikeshare_cache.load_city_frame(filename, cache_dir)
+        if os.path.exists(bikeshare_cube.get_cube_file(filename, cache_dir)):
+            bikeshare_cube.load_cube(filename, cache_dir)
+        if os.path.exists(bikeshare_rollup.get_rollup_file(filename, cache_dir)):
+            bikeshare_rollup.load_rollup(filename, cache_dir)
+        print(f'Updated the cached data of {filename}')
+    print(f'This took {time.time() - start_time:.2f} seconds.')
+
+
+def show_rollup(city, start, end, resolution, cache_dir=bikeshare_defaults.DEFAULT_CACHE_DIR,
+                chunk_rows=bikeshare_defaults.DEFAULT_CHUNK_ROWS):
+    """
+    Displays the trips and trip durations of a city for every hour, day, week or month of a range of dates,
+    from the city's rollup, building the rollup first if needed
+
+    Args:
+        (str) city - name of the city to analyze
+        (str) start - the start of the range, like 2017-03-01 or "2017-03-01 08:00"
+        (str) end - the end of the range, which is not included
+        (str) resolution - hour, day, week or month
+        (str) cache_dir - directory the rollup is stored in, or None to build the rollup without storing it
+        (int) chunk_rows - number of rows to read at a time when the rollup is built
+    """
+    start_time = time.perf_counter()
+    filename = CITY_DATA[city.lower()]
+    rollup = bikeshare_rollup.load_rollup(filename, cache_dir, chunk_rows)
+    try:
+        periods = rollup.query(start, end, resolution)
+        trips, total_duration = rollup.get_total(start, end)
+    except ValueError as error:
+        print(f'Unable to roll up {start} to {end}: {error}')
+        return
+
+    first_hour, last_hour = rollup.get_time_range()
+    print(f'{city.title()} has trips from {first_hour} to {last_hour}')
+    print(f'\nTrips per {resolution} from {start} to {end}:')
+    print(periods.to_string())
+    print(f'\n{trips} trips with a total duration of {total_duration}')
+    print("\nThis took %s seconds." % (time.perf_counter() - start_time))
+
+
+def parse_batch_selection(text):
+    """
+    Converts a batch selection like "chicago,march,all" to the selections it stands for.  Each part accepts
+    the same values as the prompt, and EVERY_VALUE for every city, every month choice or every day choice.
+    All as the city is the same as EVERY_VALUE.
+
+    Args:
+        (str) text - the city, month and day separated by commas
+    Returns:
+        (list) the (city, month, day) selections
+    """
+    parts = [part.strip().lower() for part in text.split(',')]
+    if len(parts) != 3:
+        raise argparse.ArgumentTypeError(f'"{text}" is not a city, month and day separated by commas')
+    city_text, month_text, day_text = parts
+
+    if city_text in (EVERY_VALUE, ALL_CITIES):
+        cities = list(CITY_DATA)
+    elif city_text in CITY_DATA:
+        cities = [city_text]
+    else:
+        raise argparse.ArgumentTypeError(f'"{city_text}" is not a city')
+
+    choices = []
+    for part, allowed_values, name in ((month_text, ALLOWED_MONTH_SELECTION, 'month'),
+                                       (day_text, ALLOWED_DAY_SELECTION, 'day')):
+        if part == EVERY_VALUE:
+            choices.append(list(allowed_values))
+        elif get_key_for_value(part, allowed_values) != NOT_FOUND:
+            choices.append([get_key_for_value(part, allowed_values)])
+        else:
+            raise argparse.ArgumentTypeError(f'"{part}" is not a {name}')
+
+    return [(city, month, day) for city in cities for month in choices[0] for day in choices[1]]
+
+
+def compute_batch_stats(selections, options, cache_dir):
+    """
+    Computes the statistics for every selection, loading or reading each city only once no matter how many
+    of its months and days are selected
+
+    Args:
+        (list) selections - the (city, month, day) selections
+        options - the parsed command line arguments
+        (str) cache_dir - directory for the parsed city data, or None to always parse the CSV file
+    Returns:
+        (dict) the TripStats of each selection
+    """
+    trip_stats = {}
+    for city in dict.fromkeys(city for city, _, _ in selections):
+        city_selections = [(month, day) for selection_city, month, day in selections if selection_city == city]
+
+        # Cities too large to load, and approximate statistics, are read in chunks once, adding up every
+        # selection from each chunk.  The output always has the trip duration percentiles of each group.
+        if options.approximate or should_stream(city, options.stream, options.stream_threshold_mb):
+            aggregates_class, stats_class, aggregates_options = get_aggregation_classes(options)
+            aggregates_options['distributions'] = True
+            data_selections = {get_selection(month, day): (month, day) for month, day in city_selections}
+            city_aggregates = bikeshare_data.stream_selection_aggregates(CITY_DATA[city], list(data_selections),
+                                                                         options.chunk_rows, aggregates_class,
+                                                                         **aggregates_options)
+            for data_selection, aggregates in city_aggregates.items():
+                trip_stats[(city, *data_selections[data_selection])] = stats_class(aggregates)
+        else:
+            city_data = get_city_data(city, cache_dir)
+            for month, day in city_selections:
+                trip_stats[(city, month, day)] = city_data.get_trip_stats(*get_selection(month, day),
+                                                                          distributions=True)
+    return trip_stats
+
+
+def run_batch(selections, options, cache_dir):
+    """
+    Computes the statistics for every selection without asking any questions and writes them as JSON or CSV
+
+    Args:
+        (list) selections - the (city, month, day) selections
+        options - the parsed command line arguments
+        (str) cache_dir - directory for the parsed city data, or None to always parse the CSV file
+    """
+    start_time = time.time()
+    selections = list(dict.fromkeys(selections))
+    trip_stats = compute_batch_stats(selections, options, cache_dir)
+
+    results = [{'city': city,
+                'month': ALLOWED_MONTH_SELECTION[month][NAME_IDX],
+                'day': ALLOWED_DAY_SELECTION[day][NAME_IDX],
+                'statistics': bikeshare_report.get_statistics(trip_stats[(city, month, day)])}
+               for city, month, day in selections]
+    bikeshare_report.write_report(results, options.output, options.format)
+
+    # The report may be written to the standard output, so the summary goes to the standard error
+    print(f'Wrote the statistics of {len(selections)} selections in {time.time() - start_time:.2f} seconds',
+          file=sys.stderr)
+
+
+def parse_arguments(args=None):
+    """
+    Parses the command line arguments
+
+    Args:
+        (list) args: arguments to parse, defaults to the command line arguments
+    Returns:
+        The parsed arguments
+    """
+    parser = argparse.ArgumentParser(description='Explore US bikeshare data.')
+    parser.add_argument('--cache-dir', default=bikeshare_defaults.DEFAULT_CACHE_DIR,
+                        help='directory for the parsed city data (default: %(default)s)')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='always parse the CSV files and do not use the cache')
+    parser.add_argument('--memory-cache-mb', type=int,
+                        default=bikeshare_defaults.DEFAULT_MEMORY_CACHE_BYTES // (1024 * 1024),
+                        help='memory the city data kept between selections may use (default: %(default)s)')
+    parser.add_argument('--show-cache-stats', action='store_true',
+                        help='show the memory cache hits, misses and evictions after loading the data')
+    parser.add_argument('--stream', action='store_true',
+                        help='read the CSV file in chunks instead of loading it, to use less memory')
+    parser.add_argument('--stream-threshold-mb', type=int, default=DEFAULT_STREAM_THRESHOLD_MB,
+                        help='always read CSV files larger than this in chunks (default: %(default)s)')
+    parser.add_argument('--chunk-rows', type=int, default=bikeshare_defaults.DEFAULT_CHUNK_ROWS,
+                        help='number of rows to read at a time when reading in chunks (default: %(default)s)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of worker processes that parse and aggregate parts of the CSV files at the '
+                             'same time; 1 loads the data in this process (default: %(default)s)')
+    parser.add_argument('--approximate', action='store_true',
+                        help='read the CSV file in chunks and count the stations and station pairs approximately '
+                             'in a fixed amount of memory')
+    parser.add_argument('--sketch-counters', type=int, default=bikeshare_defaults.DEFAULT_COUNTER_COUNT,
+                        help='number of stations or pairs the approximate counts are kept for; a count is at most '
+                             'the number of trips divided by this too high (default: %(default)s)')
+    parser.add_argument('--sketch-epsilon', type=float, default=bikeshare_defaults.DEFAULT_EPSILON,
+                        help='largest error of the Count-Min estimates as a fraction of the number of trips '
+                             '(default: %(default)s)')
+    parser.add_argument('--sketch-delta', type=float, default=bikeshare_defaults.DEFAULT_DELTA,
+                        help='chance that a Count-Min estimate has a larger error (default: %(default)s)')
+    parser.add_argument('--verify-sketch', action='store_true',
+                        help='with --approximate, also count the stations exactly and show how close the '
+                             'approximate counts are')
+    parser.add_argument('--distributions', action='store_true',
+                        help='also show the trip duration and birth year percentiles and histograms, and the trip '
+                             'duration percentiles per month, day of week, start hour and user type')
+    parser.add_argument('--quantile-sketch', action='store_true',
+                        help='when reading in chunks or with several workers, keep only a fixed size sketch of the '
+                             'trip durations instead of every distinct duration; the trip duration quartiles and '
+                             'percentiles are then within %d%%%% of the exact ones' % SKETCH_ACCURACY_PERCENT)
+    parser.add_argument('--no-paging', action='store_true',
+                        help='show every station and start hour of the ranked lists without asking before each '
+                             'page, for writing them to a file or another program')
+    parser.add_argument('--show-memory', action='store_true',
+                        help='show the memory used by the selected data compared to the default column types')
+    parser.add_argument('--show-parse-times', action='store_true',
+                        help='show the time spent reading and parsing each column of the CSV file')
+    parser.add_argument('--timings', metavar='FILE',
+                        help='add a JSON line with the seconds, rows, bytes read and memory of every stage of the '
+                             'work, like reading the CSV file, indexing and computing the statistics, to FILE')
+    parser.add_argument('--timing-summary', action='store_true',
+                        help='show a table of the time, rows and memory of every stage after each selection')
+    parser.add_argument('--profile', metavar='STAGE',
+                        help='run a stage, like read_csv or compute_trip_stats, under cProfile and show its '
+                             'slowest functions')
+    parser.add_argument('--profile-output', metavar='FILE',
+                        help='with --profile, store the profile in FILE for pstats or snakeviz instead')
+    parser.add_argument('--trace-memory', metavar='STAGE',
+                        help='trace the memory allocated by a stage and the stages in it with tracemalloc, and '
+                             'show the lines that allocated the most')
+    parser.add_argument('--batch', nargs='+', type=parse_batch_selection, metavar='CITY,MONTH,DAY',
+                        help='write the statistics of each selection without asking any questions; use * for every '
+                             'city, month or day, for example "*,*,*" for every selection')
+    parser.add_argument('--output', default=bikeshare_defaults.STANDARD_OUTPUT,
+                        help='file the batch statistics are written to, - for the standard output '
+                             '(default: %(default)s)')
+    parser.add_argument('--format', choices=bikeshare_defaults.REPORT_FORMATS,
+                        help='format of the batch statistics (default: csv for a .csv output file, otherwise json)')
+    parser.add_argument('--cube', action='store_true',
+                        help='answer the time, trip duration and user type statistics from the stored cube of '
+                             'each city, building it if needed; the station and birth year statistics and the '
+                             'trip duration quartiles are not shown')
+    parser.add_argument('--rollup', nargs=3, metavar=('CITY', 'START', 'END'),
+                        help='show the trips and trip durations of a city for every period from START up to END, '
+                             'like 2017-03-01 2017-04-01, from the stored rollup of the city, then exit')
+    parser.add_argument('--resolution', choices=bikeshare_defaults.ROLLUP_RESOLUTIONS,
+                        default=bikeshare_defaults.DEFAULT_ROLLUP_RESOLUTION,
+                        help='length of the periods --rollup shows (default: %(default)s)')
+    parser.add_argument('--build-cube', action='store_true',
+                        help='build and store the cubes of all the cities, then exit')
+    parser.add_argument('--append-rows', nargs=2, metavar=('CITY', 'FILE'),
+                        help='add the trips of a new CSV file with the same columns to the CSV file of a city and '
+                             'update its cached data with only the new trips, then exit')
+    parser.add_argument('--warm-cache', action='store_true',
+                        help='parse and cache the CSV files of all the cities, then exit')
+    parser.add_argument('--clear-cache', action='store_true',
+                        help='remove all the cached city data, then exit')
+    return parser.parse_args(args)
+
+
+def show_timing_summary(options, file=None):
+    """
+    Displays the table of the stages recorded since the last table, when it was asked for
+
+    Args:
+        options - the parsed command line arguments
+        file - the file to display the table on, defaults to the standard output
+    """
+    if options.timing_summary:
+        print('\nTime spent in each stage:', file=file)
+        for line in bikeshare_instrument.RECORDER.get_summary_lines():
+            print(line, file=file)
+    bikeshare_instrument.RECORDER.clear()
+
+
+def load_engine(memory_cache_bytes):
+    """
+    Imports the modules that analyse the data, and pandas with them, and sets up the memory cache
+
+    Args:
+        (int) memory_cache_bytes - memory the city data kept between selections may use
+    """
+    for module in ENGINE_MODULES:
+        module.load()
+    bikeshare_cache.MEMORY_CACHE.set_max_bytes(memory_cache_bytes)
+
+
+def run(options, cache_dir, engine_loader):
+    """
+    Does the work the options ask for, repeatedly asking the user for the city, month, and day when no batch
+    or cache maintenance is asked for
+
+    Args:
+        options - the parsed command line arguments
+        (str) cache_dir - directory for the parsed city data, or None to always parse the CSV file
+        (Thread) engine_loader - the thread running load_engine, which must finish before any data is used
+    """
+    # Handle the cache maintenance requests, which do not need any input from the user
+    if (options.clear_cache or options.warm_cache or options.build_cube or options.append_rows or options.rollup
+            or options.batch):
+        engine_loader.join()
+    if options.clear_cache:
+        bikeshare_cache.clear_cache(options.cache_dir)
+        print(f'Cleared the cache in {options.cache_dir}')
+    if options.warm_cache:
+        bikeshare_cache.warm_cache(CITY_DATA.values(), options.cache_dir)
+    if options.build_cube:
+        for filename in CITY_DATA.values():
+            bikeshare_cube.build_cube(filename, options.cache_dir, options.chunk_rows)
+            print(f'Built the cube of {filename}')
+    if options.append_rows:
+        city, new_filename = options.append_rows
+        if city.lower() not in CITY_DATA:
+            print(f'{city} is not one of the cities: {", ".join(CITY_DATA)}')
+        else:
+            append_city_rows(city, new_filename, cache_dir)
+    if options.rollup:
+        city, start, end = options.rollup
+        if city.lower() not in CITY_DATA:
+            print(f'{city} is not one of the cities: {", ".join(CITY_DATA)}')
+        else:
+            show_rollup(city, start, end, options.resolution, cache_dir, options.chunk_rows)
+    if options.clear_cache or options.warm_cache or options.build_cube or options.append_rows or options.rollup:
+        return
+
+    # The batch selections are all known up front, so there is nothing to ask
+    if options.batch:
+        run_batch([selection for selections in options.batch for selection in selections], options, cache_dir)
+        show_timing_summary(options, sys.stderr)
+        return
+
     while True:
         city, month, day = get_filters()
+        engine_loader.join()
         print(f'You selected the city = {city}, the month {ALLOWED_MONTH_SELECTION[month][NAME_IDX]}, '
               f'and the day {ALLOWED_DAY_SELECTION[day][NAME_IDX]}')
-        df = load_data(city, month, day)
-
-        # Run the functions with the questions initially asked
-        time_stats(df)
-        station_stats(df)
-        trip_duration_stats(df)
-        user_stats(df)
 
-        # Run the functions that include additional information
-        additional_time_stats(df)
-        additional_station_stats(df)
-        additional_trip_duration_stats(df)
-        additional_user_stats(df)
+        # Every city is shown in turn when all the cities were selected
+        if city.lower() == ALL_CITIES:
+            if options.cube:
+                all_city_stats = {city_name: load_cube_stats(city_name, month, day, cache_dir, options.chunk_rows)
+                                  for city_name in CITY_DATA}
+            else:
+                all_city_stats = load_all_city_trip_stats(month, day, options.workers, cache_dir,
+                                                          options.quantile_sketch, options.distributions)
+            for city_name, trip_stats in all_city_stats.items():
+                print(f'\n{city_name.title()}\n' + '=' * 40)
+                if options.cube:
+                    display_cube_stats(None, trip_stats)
+                else:
+                    display_stats(None, trip_stats, options.distributions)
+        elif options.cube:
+            display_cube_stats(None, load_cube_stats(city, month, day, cache_dir, options.chunk_rows))
+        else:
+            df, trip_stats = load_selection(city, month, day, options, cache_dir)
+            if options.show_parse_times:
+                show_parse_times(city)
+            display_stats(df, trip_stats, options.distributions)
+        show_timing_summary(options)
 
         try:
             restart: str = input(
@@ -538,5 +1310,24 @@ def main():
             break
 
 
+def main(args=None):
+    """ Repeatedly ask the user for the city, month, and day, and display information from the CSV file. """
+    options = parse_arguments(args)
+    cache_dir = None if options.no_cache else options.cache_dir
+    PAGER.ask = not options.no_paging
+
+    # Import pandas while the user answers the first question instead of before asking it
+    engine_loader = threading.Thread(target=load_engine, args=(options.memory_cache_mb * 1024 * 1024,),
+                                     daemon=True)
+    engine_loader.start()
+    if options.timings or options.timing_summary or options.profile or options.trace_memory:
+        bikeshare_instrument.RECORDER.configure(options.timings, options.profile, options.profile_output,
+                                                options.trace_memory)
+    try:
+        run(options, cache_dir, engine_loader)
+    finally:
+        bikeshare_instrument.RECORDER.close()
+
+
 if __name__ == "__main__":
     main()
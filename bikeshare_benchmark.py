@@ -0,0 +1,422 @@
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+import bikeshare_2
+import bikeshare_cache
+import bikeshare_data
+import bikeshare_stats
+
+# Directory the generated CSV files and their cached data are kept in
+DEFAULT_DATA_DIR = '.bikeshare_benchmark'
+
+# File every benchmark result is added to, one JSON record per line, so results of different versions can be compared
+DEFAULT_RESULTS_FILE = 'bench_results.jsonl'
+
+# Numbers of rows to generate and time when none are given
+DEFAULT_ROW_COUNTS = [100000, 1000000]
+
+# Number of rows generated and written at a time, so files larger than the memory can be generated
+GENERATE_CHUNK_ROWS = 1000000
+
+# Number of stations in the generated files
+STATION_COUNT = 600
+
+# Range of the generated start times, like the six months of 2017 in the real files
+FIRST_START_TIME = np.datetime64('2017-01-01T00:00:00')
+START_TIME_SECONDS = 181 * 24 * 60 * 60
+
+# Name the generated file is loaded under by load_data
+BENCHMARK_CITY = 'benchmark'
+
+# The stats functions that are timed, each called with only the data frame so it computes its own statistics
+STATS_FUNCTIONS = [bikeshare_2.time_stats, bikeshare_2.station_stats, bikeshare_2.trip_duration_stats,
+                   bikeshare_2.user_stats, bikeshare_2.additional_time_stats, bikeshare_2.additional_station_stats,
+                   bikeshare_2.additional_trip_duration_stats, bikeshare_2.additional_user_stats]
+
+# Directory of the program, which the startup steps run in
+SOURCE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Program run by the first result startup step: the statistics of a whole generated file from its cached data
+FIRST_RESULT_PROGRAM = """
+import os
+import sys
+import bikeshare_2
+bikeshare_2.CITY_DATA['%s'] = sys.argv[1]
+bikeshare_2.main(['--batch', '%s,all,all', '--output', os.devnull, '--cache-dir', sys.argv[2]])
+""" % (BENCHMARK_CITY, BENCHMARK_CITY)
+
+# Change in seconds, in percent, compared to the previous version above which a step is shown as a regression
+DEFAULT_REGRESSION_PERCENT = 10.0
+
+
+def get_data_filename(data_dir, row_count, with_demographics):
+    """
+    Returns the name of the generated CSV file for a number of rows
+
+    Args:
+        (str) data_dir: directory of the generated files
+        (int) row_count: number of rows in the file
+        (bool) with_demographics: whether the file has the Gender and Birth Year columns
+    Returns:
+        (str) name of the CSV file
+    """
+    kind = 'demographics' if with_demographics else 'no_demographics'
+    return os.path.join(data_dir, f'trips_{row_count}_{kind}.csv')
+
+
+def generate_trip_chunk(rng, first_row, row_count, with_demographics):
+    """
+    Generates random trips with the columns of the city CSV files.  Like the real files, the start stations and
+    hours are not uniform, some genders and birth years are missing, and the trip durations of the files without
+    demographics (Washington) have fractions of a second.
+
+    Args:
+        (Generator) rng: the random number generator
+        (int) first_row: number of the first row, used for the unnamed first column
+        (int) row_count: number of rows to generate
+        (bool) with_demographics: whether to add the Gender and Birth Year columns
+    Returns:
+        (Pandas DataFrame) the generated trips
+    """
+    # Most trips start during the day, so draw the hour separately from the day and the second
+    days = rng.integers(0, START_TIME_SECONDS // 86400, row_count)
+    hours = np.clip(rng.normal(14, 4, row_count), 0, 23).astype(np.int64)
+    seconds = days * 86400 + hours * 3600 + rng.integers(0, 3600, row_count)
+    start_times = FIRST_START_TIME + seconds.astype('timedelta64[s]')
+    durations = rng.integers(60, 5400, row_count)
+    end_times = start_times + durations.astype('timedelta64[s]')
+
+    stations = np.array([f'Station {number} & Main St' for number in range(STATION_COUNT)], dtype=object)
+    trips = {'': np.arange(first_row, first_row + row_count),
+             'Start Time': pd.Series(start_times).dt.strftime(bikeshare_data.TIMESTAMP_FORMAT),
+             'End Time': pd.Series(end_times).dt.strftime(bikeshare_data.TIMESTAMP_FORMAT),
+             'Trip Duration': durations if with_demographics else durations + rng.integers(0, 1000, row_count) / 1000,
+             'Start Station': stations[rng.zipf(1.3, row_count) % STATION_COUNT],
+             'End Station': stations[rng.zipf(1.3, row_count) % STATION_COUNT],
+             'User Type': rng.choice(['Subscriber', 'Customer', 'Dependent'], row_count, p=[0.8, 0.19, 0.01])}
+    if with_demographics:
+        trips['Gender'] = rng.choice(np.array(['Male', 'Female', None], dtype=object), row_count, p=[0.6, 0.25, 0.15])
+        birth_years = rng.integers(1940, 2002, row_count).astype(float)
+        birth_years[rng.random(row_count) < 0.15] = np.nan
+        trips['Birth Year'] = birth_years
+    return pd.DataFrame(trips)
+
+
+def generate_city_csv(filename, row_count, with_demographics=True, seed=0, chunk_rows=GENERATE_CHUNK_ROWS):
+    """
+    Writes a CSV file of random trips with the columns of the city CSV files, a chunk of rows at a time
+
+    Args:
+        (str) filename: name of the CSV file to write
+        (int) row_count: number of rows to write
+        (bool) with_demographics: whether to add the Gender and Birth Year columns, which Washington does not have
+        (int) seed: seed of the random number generator, so the same file is generated every time
+        (int) chunk_rows: number of rows generated and written at a time
+    """
+    rng = np.random.default_rng(seed)
+    temp_filename = filename + '.tmp'
+    with open(temp_filename, 'w', newline='', encoding='utf-8') as csv_file:
+        for first_row in range(0, row_count, chunk_rows):
+            chunk = generate_trip_chunk(rng, first_row, min(chunk_rows, row_count - first_row), with_demographics)
+            chunk.to_csv(csv_file, header=first_row == 0, index=False)
+
+    # Only a complete file gets the real name, so an interrupted run generates it again
+    os.replace(temp_filename, filename)
+
+
+def get_data_file(data_dir, row_count, with_demographics, seed=0):
+    """
+    Returns the name of the generated CSV file for a number of rows, generating it when it does not exist yet
+
+    Args:
+        (str) data_dir: directory of the generated files
+        (int) row_count: number of rows in the file
+        (bool) with_demographics: whether the file has the Gender and Birth Year columns
+        (int) seed: seed of the random number generator
+    Returns:
+        (str) name of the CSV file
+    """
+    filename = get_data_filename(data_dir, row_count, with_demographics)
+    if not os.path.exists(filename):
+        os.makedirs(data_dir, exist_ok=True)
+        print(f'Generating {filename}...')
+        start_time = time.perf_counter()
+        generate_city_csv(filename, row_count, with_demographics, seed)
+        print('Generated in %.2f seconds' % (time.perf_counter() - start_time))
+    return filename
+
+
+def get_version():
+    """
+    Returns the version of the code being timed
+
+    Returns:
+        (str) the git commit, with "-dirty" added when there are changes that are not committed, or "unknown"
+    """
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], cwd=SOURCE_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+@contextlib.contextmanager
+def quiet_stats_output():
+    """ Sends the printed statistics to nowhere and shows every row without asking while the block runs. """
+    ask_should_show_more_data = bikeshare_2.ask_should_show_more_data
+    bikeshare_2.ask_should_show_more_data = lambda: True
+    try:
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            yield
+    finally:
+        bikeshare_2.ask_should_show_more_data = ask_should_show_more_data
+
+
+def measure(step_function, repeat=1, trace_memory=True):
+    """
+    Times a step and measures the most memory it allocates.  The step is timed without tracing the memory, which
+    slows down allocations, and then run once more while tracing to get the peak.
+
+    Args:
+        (function) step_function: the step to run, without arguments
+        (int) repeat: number of times to time the step, the fastest time is kept
+        (bool) trace_memory: whether to measure the peak memory
+    Returns:
+        (tuple) the fastest seconds and the peak memory in bytes, or None when it was not measured
+    """
+    seconds = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        step_function()
+        seconds.append(time.perf_counter() - start_time)
+
+    peak_bytes = None
+    if trace_memory:
+        tracemalloc.start()
+        try:
+            step_function()
+            peak_bytes = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return min(seconds), peak_bytes
+
+
+def run_until_output(command):
+    """
+    Runs a program until it writes its first line, like the first question of bikeshare_2.py, then stops it
+
+    Args:
+        (list) command: the program and its arguments
+    """
+    with subprocess.Popen(command, cwd=SOURCE_DIR, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                          stderr=subprocess.DEVNULL, env=dict(os.environ, PYTHONUNBUFFERED='1')) as process:
+        process.stdout.readline()
+        process.kill()
+
+
+def get_startup_steps(filename, cache_dir):
+    """
+    Returns the startup latency steps, each timing a new Python process: starting Python alone, importing
+    bikeshare_2, showing the first question, and writing the statistics of a whole generated file from its
+    cached data
+
+    Args:
+        (str) filename: name of the generated CSV file
+        (str) cache_dir: directory for the cached data of the generated file
+    Returns:
+        (list) a (name, function) tuple per step
+    """
+    def run(*command):
+        subprocess.run([sys.executable, *command], cwd=SOURCE_DIR, check=True, capture_output=True)
+
+    return [('startup: python', lambda: run('-c', 'pass')),
+            ('startup: import bikeshare_2', lambda: run('-c', 'import bikeshare_2')),
+            ('startup: first question', lambda: run_until_output([sys.executable, 'bikeshare_2.py'])),
+            ('startup: first result', lambda: run('-c', FIRST_RESULT_PROGRAM, os.path.abspath(filename),
+                                                  os.path.abspath(cache_dir)))]
+
+
+def get_steps(filename, cache_dir):
+    """
+    Returns the steps that are timed for a generated file: loading the data without and with the disk cache, the
+    computation of all the statistics at once, and each stats function on its own
+
+    Args:
+        (str) filename: name of the generated CSV file
+        (str) cache_dir: directory for the cached data of the generated file
+    Returns:
+        (list) a (name, function) tuple per step
+    """
+    def load_data(step_cache_dir):
+        # Start from an empty memory cache so the data is really loaded
+        bikeshare_cache.MEMORY_CACHE.clear()
+        return bikeshare_2.load_data(BENCHMARK_CITY, bikeshare_2.ALL, bikeshare_2.ALL, step_cache_dir)
+
+    # Load the data once for the steps that only compute statistics
+    bikeshare_2.CITY_DATA[BENCHMARK_CITY] = filename
+    bikeshare_cache.load_city_frame(filename, cache_dir)
+    df = load_data(cache_dir)
+
+    steps = [('load_data (parse)', lambda: load_data(None)),
+             ('load_data (cached)', lambda: load_data(cache_dir)),
+             ('compute_trip_stats', lambda: bikeshare_stats.compute_trip_stats(df))]
+    for stats_function in STATS_FUNCTIONS:
+        steps.append((stats_function.__name__, lambda stats_function=stats_function: stats_function(df)))
+    return steps
+
+
+def run_benchmark(row_counts, demographics, data_dir=DEFAULT_DATA_DIR, repeat=1, trace_memory=True, seed=0):
+    """
+    Times loading the data and each stats function for generated files of different sizes
+
+    Args:
+        (list) row_counts: the numbers of rows to time
+        (list) demographics: for each kind of file to time, whether it has the Gender and Birth Year columns
+        (str) data_dir: directory of the generated files and their cached data
+        (int) repeat: number of times each step is timed, the fastest time is kept
+        (bool) trace_memory: whether to measure the peak memory of each step
+        (int) seed: seed of the random number generator
+    Returns:
+        (list) a dict per step with the size of the file, the seconds, the rows per second and the peak memory
+    """
+    run = {'version': get_version(),
+           'time': datetime.datetime.now().isoformat(timespec='seconds'),
+           'python': platform.python_version(),
+           'pandas': pd.__version__,
+           'numpy': np.__version__}
+    cache_dir = os.path.join(data_dir, bikeshare_cache.DEFAULT_CACHE_DIR)
+
+    results = []
+    print('%12s  %-13s  %-32s  %9s  %13s  %9s' % ('Rows', 'Demographics', 'Step', 'Seconds', 'Rows/second',
+                                                    'Peak MB'))
+    try:
+        for row_count in row_counts:
+            for with_demographics in demographics:
+                filename = get_data_file(data_dir, row_count, with_demographics, seed)
+                with quiet_stats_output():
+                    steps = get_steps(filename, cache_dir)
+                startup_steps = get_startup_steps(filename, cache_dir)
+
+                # The startup steps run in other processes, so their memory is not traced, and they mostly do not
+                # depend on the number of rows
+                for step_name, step_function in steps + startup_steps:
+                    in_process = (step_name, step_function) in steps
+                    with quiet_stats_output():
+                        seconds, peak_bytes = measure(step_function, repeat, trace_memory and in_process)
+                    rows_per_second = row_count / seconds if seconds and in_process else None
+                    result = dict(run, rows=row_count, demographics=with_demographics, step=step_name,
+                                  seconds=seconds, rows_per_second=rows_per_second,
+                                  peak_mb=None if peak_bytes is None else peak_bytes / (1024 * 1024))
+                    results.append(result)
+                    print('%12d  %-13s  %-32s  %9.3f  %13s  %9s' % (
+                        row_count, 'yes' if with_demographics else 'no', step_name, seconds,
+                        '' if result['rows_per_second'] is None else '%.0f' % result['rows_per_second'],
+                        '' if peak_bytes is None else '%.1f' % result['peak_mb']))
+    finally:
+        bikeshare_2.CITY_DATA.pop(BENCHMARK_CITY, None)
+        bikeshare_cache.MEMORY_CACHE.clear()
+    return results
+
+
+def read_results(results_file):
+    """
+    Reads the stored results of earlier runs
+
+    Args:
+        (str) results_file: name of the results file
+    Returns:
+        (list) the stored results, oldest first, or an empty list when there is no results file
+    """
+    if not os.path.exists(results_file):
+        return []
+    with open(results_file, encoding='utf-8') as results_input:
+        return [json.loads(line) for line in results_input if line.strip()]
+
+
+def write_results(results, results_file):
+    """
+    Adds the results of a run to the results file
+
+    Args:
+        (list) results: the results of the run
+        (str) results_file: name of the results file
+    """
+    with open(results_file, 'a', encoding='utf-8') as results_output:
+        for result in results:
+            results_output.write(json.dumps(result) + '\n')
+
+
+def compare_results(results, earlier_results, regression_percent=DEFAULT_REGRESSION_PERCENT):
+    """
+    Shows the change of each step compared to the latest result of another version for the same step and file
+
+    Args:
+        (list) results: the results of this run
+        (list) earlier_results: the stored results of earlier runs, oldest first
+        (float) regression_percent: the increase of the seconds, in percent, shown as a regression
+    Returns:
+        (list) a (rows, demographics, step, earlier version, percent change) tuple per regression
+    """
+    regressions = []
+    print('\n%12s  %-13s  %-32s  %-16s  %9s  %9s' % ('Rows', 'Demographics', 'Step', 'Compared to', 'Seconds',
+                                                       'Change'))
+    for result in results:
+        key = (result['rows'], result['demographics'], result['step'])
+        earlier = [earlier_result for earlier_result in earlier_results
+                   if (earlier_result['rows'], earlier_result['demographics'], earlier_result['step']) == key
+                   and earlier_result['version'] != result['version']]
+        if not earlier:
+            continue
+        earlier_result = earlier[-1]
+        change = (result['seconds'] / earlier_result['seconds'] - 1) * 100 if earlier_result['seconds'] else 0.0
+        is_regression = change > regression_percent
+        if is_regression:
+            regressions.append(key + (earlier_result['version'], change))
+        print('%12d  %-13s  %-32s  %-16s  %9.3f  %+8.1f%%%s' % (
+            result['rows'], 'yes' if result['demographics'] else 'no', result['step'], earlier_result['version'],
+            earlier_result['seconds'], change, '  REGRESSION' if is_regression else ''))
+    return regressions
+
+
+def main(args=None):
+    """ Times loading the data and each stats function for generated files, and compares with earlier versions. """
+    parser = argparse.ArgumentParser(description='Benchmark loading bikeshare data and computing its statistics.')
+    parser.add_argument('--rows', type=int, nargs='+', default=DEFAULT_ROW_COUNTS,
+                        help='numbers of rows of the generated files (default: %(default)s)')
+    parser.add_argument('--demographics', choices=['with', 'without', 'both'], default='both',
+                        help='time files with the Gender and Birth Year columns, without them like Washington, '
+                             'or both (default: %(default)s)')
+    parser.add_argument('--data-dir', default=DEFAULT_DATA_DIR,
+                        help='directory of the generated files (default: %(default)s)')
+    parser.add_argument('--results', default=DEFAULT_RESULTS_FILE,
+                        help='file the results are added to (default: %(default)s)')
+    parser.add_argument('--repeat', type=int, default=1,
+                        help='number of times each step is timed, the fastest is kept (default: %(default)s)')
+    parser.add_argument('--no-memory', action='store_true', help='do not measure the peak memory of each step')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed of the generated files (default: %(default)s)')
+    parser.add_argument('--regression-percent', type=float, default=DEFAULT_REGRESSION_PERCENT,
+                        help='increase in seconds shown as a regression (default: %(default)s)')
+    options = parser.parse_args(args)
+
+    demographics = {'with': [True], 'without': [False], 'both': [True, False]}[options.demographics]
+    earlier_results = read_results(options.results)
+    results = run_benchmark(options.rows, demographics, options.data_dir, max(options.repeat, 1),
+                            not options.no_memory, options.seed)
+    write_results(results, options.results)
+    compare_results(results, earlier_results, options.regression_percent)
+
+
+if __name__ == "__main__":
+    main()
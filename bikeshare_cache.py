@@ -0,0 +1,801 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+import bikeshare_data
+import bikeshare_defaults
+import bikeshare_instrument
+
+# Directory used for the parsed city data when no other directory is given
+DEFAULT_CACHE_DIR = bikeshare_defaults.DEFAULT_CACHE_DIR
+
+# Largest number of bytes the city data kept in memory may use
+DEFAULT_MEMORY_CACHE_BYTES = bikeshare_defaults.DEFAULT_MEMORY_CACHE_BYTES
+
+# Bump this whenever the layout of the cached files or the prepared columns change so that
+# older cache entries are rebuilt instead of being read with the wrong layout
+CACHE_FORMAT_VERSION = 4
+
+# Name of the file in each cache entry that describes the source file and the stored columns
+META_FILE_NAME = 'meta.json'
+
+# How each column is stored -- directly as a NumPy array, or as integer codes plus a list of the distinct values
+STORED_AS_ARRAY = 'array'
+STORED_AS_CODES = 'codes'
+
+# Start of the names of the files in each cache entry that hold the CityData index
+INDEX_FILE_PREFIX = 'index_'
+
+# The integer types of category codes, from the smallest, and the most categories each holds.  They are the types
+# pandas keeps the codes in, so the stored codes are used without converting (copying) them.
+CODE_DTYPES = [(np.int8, np.iinfo(np.int8).max), (np.int16, np.iinfo(np.int16).max),
+               (np.int32, np.iinfo(np.int32).max)]
+
+# Number of bytes at the end of a source CSV file that are hashed to tell if rows were only added to the file
+TAIL_BYTES = 64 * 1024
+
+
+def get_source_signature(filename):
+    """
+    Returns the values used to tell if a source CSV file changed since it was cached
+
+    Args:
+        (str) filename: name of the source CSV file
+    Returns:
+        (dict) the absolute path, size and modification time of the file
+    """
+    stat = os.stat(filename)
+    return {'path': os.path.abspath(filename),
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns}
+
+
+def get_source_tail(filename, end):
+    """
+    Returns the values used to tell if rows were only added to the end of a source CSV file -- hashes of the
+    header line and of the bytes just before the current end of the file
+
+    Args:
+        (str) filename: name of the source CSV file
+        (int) end: the current size of the file
+    Returns:
+        (dict) the hashes and whether the file ends with a line break
+    """
+    with open(filename, 'rb') as source_file:
+        header = source_file.readline()
+        start = max(end - TAIL_BYTES, 0)
+        source_file.seek(start)
+        tail = source_file.read(end - start)
+    return {'header_sha1': hashlib.sha1(header).hexdigest(),
+            'tail_sha1': hashlib.sha1(tail).hexdigest(),
+            'ends_with_line_break': tail.endswith(b'\n')}
+
+
+def get_appended_offset(meta, filename):
+    """
+    Checks if rows were only added to the end of a source CSV file since it was cached.  That is assumed when
+    the file grew, the cached part ended with a line break, and its header line and last TAIL_BYTES did not
+    change, which avoids reading the whole file again.
+
+    Args:
+        (dict) meta: the description of the cache entry or cube, with the source signature and tail
+        (str) filename: name of the source CSV file
+    Returns:
+        (int) the offset of the first added byte, or None when the file changed in another way
+    """
+    if meta is None or 'tail' not in meta:
+        return None
+    source, tail = meta['source'], meta['tail']
+    signature = get_source_signature(filename)
+    if (signature['path'] != source['path'] or signature['size'] <= source['size']
+            or not tail['ends_with_line_break']):
+        return None
+    if get_source_tail(filename, source['size']) != tail:
+        return None
+    return source['size']
+
+
+def get_code_dtype(category_count):
+    """
+    Returns the smallest integer type that holds the codes of a number of categories, the way pandas picks it
+
+    Args:
+        (int) category_count: number of categories
+    Returns:
+        (NumPy dtype) int8, int16 or int32
+    """
+    for dtype, most_categories in CODE_DTYPES:
+        if category_count < most_categories:
+            return np.dtype(dtype)
+    return np.dtype(np.int64)
+
+
+def get_cache_entry_dir(filename, cache_dir=DEFAULT_CACHE_DIR):
+    """
+    Returns the directory used to cache the parsed data of a source CSV file
+
+    Args:
+        (str) filename: name of the source CSV file
+        (str) cache_dir: directory holding all the cache entries
+    Returns:
+        (str) directory for this source file's cache entry
+    """
+    # Use the file name to make the directory easy to recognize and a hash of the full path
+    # so files with the same name in different directories do not collide
+    path_hash = hashlib.sha1(os.path.abspath(filename).encode('utf-8')).hexdigest()[:12]
+    stem = os.path.splitext(os.path.basename(filename))[0]
+    return os.path.join(cache_dir, f'{stem}-{path_hash}')
+
+
+def read_cache_meta(entry_dir):
+    """
+    Reads the description of a cache entry
+
+    Args:
+        (str) entry_dir: directory of the cache entry
+    Returns:
+        (dict) the cache entry description, or None if it is missing or unreadable
+    """
+    try:
+        with open(os.path.join(entry_dir, META_FILE_NAME), encoding='utf-8') as meta_file:
+            return json.load(meta_file)
+    except (OSError, ValueError):
+        return None
+
+
+def is_cache_entry_valid(meta, filename):
+    """
+    Checks if a cache entry still matches its source CSV file
+
+    Args:
+        (dict) meta: the cache entry description
+        (str) filename: name of the source CSV file
+    Returns:
+        (bool) whether the cache entry can be used
+    """
+    return (meta is not None
+            and meta.get('version') == CACHE_FORMAT_VERSION
+            and meta.get('source') == get_source_signature(filename))
+
+
+@bikeshare_instrument.recorded
+def write_cached_frame(df, filename, cache_dir=DEFAULT_CACHE_DIR):
+    """
+    Stores a prepared data frame in the cache, one binary file per column.  The times are stored as 64-bit
+    counts since the epoch and the numbers in their compact types.  Text columns are stored as the smallest
+    integer codes that fit and a list of the distinct values, which also keeps the station names compact.
+
+    Args:
+        (Pandas DataFrame) df: prepared data frame of bike share data
+        (str) filename: name of the source CSV file the data frame was read from
+        (str) cache_dir: directory holding all the cache entries
+    """
+    entry_dir = get_cache_entry_dir(filename, cache_dir)
+
+    # Write into a temporary directory first so a reader never sees a half written entry
+    temp_dir = f'{entry_dir}.tmp{os.getpid()}'
+    shutil.rmtree(temp_dir, ignore_errors=True)
+    os.makedirs(temp_dir)
+
+    columns = []
+    for position, column_name in enumerate(df.columns):
+        column = df[column_name]
+        column_meta = {'name': column_name, 'dtype': str(column.dtype), 'file': f'{position}.npy'}
+        if column.dtype.kind in 'biufM':
+            column_meta['stored_as'] = STORED_AS_ARRAY
+            np.save(os.path.join(temp_dir, column_meta['file']), column.to_numpy())
+        else:
+            # Category columns keep their own codes so the order of the categories does not change
+            if isinstance(column.dtype, pd.CategoricalDtype):
+                codes, categories = column.cat.codes.to_numpy(), column.cat.categories
+            else:
+                codes, categories = pd.factorize(column)
+            column_meta['stored_as'] = STORED_AS_CODES
+            column_meta['categories'] = [str(category) for category in categories]
+            np.save(os.path.join(temp_dir, column_meta['file']), codes.astype(get_code_dtype(len(categories))))
+        columns.append(column_meta)
+
+    source = get_source_signature(filename)
+    meta = {'version': CACHE_FORMAT_VERSION,
+            'source': source,
+            'tail': get_source_tail(filename, source['size']),
+            'rows': len(df),
+            'columns': columns}
+    write_cache_meta(temp_dir, meta)
+
+    # Replace any older entry with the new one
+    shutil.rmtree(entry_dir, ignore_errors=True)
+    os.replace(temp_dir, entry_dir)
+
+
+def write_cache_meta(entry_dir, meta):
+    """
+    Writes the description of a cache entry, replacing the old description in one step
+
+    Args:
+        (str) entry_dir: directory of the cache entry
+        (dict) meta: the cache entry description
+    """
+    temp_file = os.path.join(entry_dir, f'{META_FILE_NAME}.tmp{os.getpid()}')
+    with open(temp_file, 'w', encoding='utf-8') as meta_file:
+        json.dump(meta, meta_file)
+    os.replace(temp_file, os.path.join(entry_dir, META_FILE_NAME))
+
+
+def append_to_npy_file(path, values, row_count):
+    """
+    Writes values after the first row_count values of a one dimensional .npy file, in place, so only the new
+    values are written.  The .npy header has room for the length to grow, which is updated after the values
+    are written.
+
+    Args:
+        (str) path: name of the .npy file
+        (NumPy array) values: the values to add, of the type of the file
+        (int) row_count: number of values in the file to keep
+    Returns:
+        (bool) whether the values were added -- False when the new length does not fit in the header
+    """
+    with open(path, 'r+b') as npy_file:
+        version = np.lib.format.read_magic(npy_file)
+        header_start = npy_file.tell()
+        read_header = (np.lib.format.read_array_header_1_0 if version == (1, 0)
+                       else np.lib.format.read_array_header_2_0)
+        _, _, dtype = read_header(npy_file)
+        data_start = npy_file.tell()
+
+        # The header is a padded Python dict ending with a line break, after its own length
+        length_bytes = 2 if version == (1, 0) else 4
+        header = "{'descr': %r, 'fortran_order': False, 'shape': (%d,), }" % (
+            np.lib.format.dtype_to_descr(dtype), row_count + len(values))
+        header_size = data_start - header_start - length_bytes
+        if len(header) + 1 > header_size:
+            return False
+
+        npy_file.seek(data_start + row_count * dtype.itemsize)
+        npy_file.write(np.ascontiguousarray(values, dtype=dtype).tobytes())
+        npy_file.truncate()
+        npy_file.seek(header_start + length_bytes)
+        npy_file.write((header.ljust(header_size - 1) + '\n').encode('latin1'))
+    return True
+
+
+def get_column_codes(column, categories):
+    """
+    Returns the codes of a text column into a list of categories
+
+    Args:
+        (Pandas Series) column: the text column
+        (list) categories: the categories, which must hold every value of the column
+    Returns:
+        (NumPy array) codes of the type get_code_dtype gives for the categories, -1 for missing values
+    """
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        codes, labels = column.cat.codes.to_numpy(), column.cat.categories
+    else:
+        codes, labels = pd.factorize(column)
+    positions = pd.Index(categories, dtype=object).get_indexer(pd.Index(labels, dtype=object).astype(str))
+    return np.where(codes >= 0, positions[codes], -1).astype(get_code_dtype(len(categories)))
+
+
+@bikeshare_instrument.recorded
+def append_cached_frame(df, filename, cache_dir=DEFAULT_CACHE_DIR):
+    """
+    Adds the prepared rows that were appended to a source CSV file to its cache entry, writing only the new
+    rows.  Values of text columns that were not seen before are added to the end of the column's categories,
+    so the codes already stored do not change.
+
+    Args:
+        (Pandas DataFrame) df: the prepared rows added to the source CSV file
+        (str) filename: name of the source CSV file
+        (str) cache_dir: directory holding all the cache entries
+    Returns:
+        (bool) whether the rows were added -- False when they do not fit the cached columns and the entry
+        has to be rebuilt
+    """
+    entry_dir = get_cache_entry_dir(filename, cache_dir)
+    meta = read_cache_meta(entry_dir)
+    if meta is None or [column_meta['name'] for column_meta in meta['columns']] != list(df.columns):
+        return False
+
+    # Check and convert every column before changing anything
+    new_values = []
+    for column_meta in meta['columns']:
+        column = df[column_meta['name']]
+        if column_meta['stored_as'] == STORED_AS_ARRAY:
+            dtype = np.dtype(column_meta['dtype'])
+            if not np.can_cast(column.dtype, dtype, casting='same_kind' if dtype.kind == 'M' else 'safe'):
+                return False
+            new_values.append(column.to_numpy().astype(dtype))
+        else:
+            labels = (column.cat.categories if isinstance(column.dtype, pd.CategoricalDtype)
+                      else pd.Index(pd.unique(column.dropna())))
+            known = set(column_meta['categories'])
+            category_count = len(column_meta['categories'])
+            column_meta['categories'] += [str(label) for label in labels if str(label) not in known]
+
+            # The stored codes can not be made wider in place
+            if get_code_dtype(len(column_meta['categories'])) != get_code_dtype(category_count):
+                return False
+            new_values.append(get_column_codes(column, column_meta['categories']))
+
+    # Rows written past the described rows are ignored until the description is updated, so a failure
+    # part way leaves the entry as it was
+    for column_meta, values in zip(meta['columns'], new_values):
+        if not append_to_npy_file(os.path.join(entry_dir, column_meta['file']), values, meta['rows']):
+            return False
+
+    source = get_source_signature(filename)
+    meta['source'] = source
+    meta['tail'] = get_source_tail(filename, source['size'])
+    meta['rows'] += len(df)
+    write_cache_meta(entry_dir, meta)
+    return True
+
+
+@bikeshare_instrument.recorded
+def read_cached_frame(entry_dir, meta):
+    """
+    Reads a prepared data frame from a cache entry.  The column files are memory mapped and the data frame
+    uses them without copying, so only the pages that are used are read from the disk, and processes reading
+    the same city share those pages through the operating system's file cache.
+
+    Args:
+        (str) entry_dir: directory of the cache entry
+        (dict) meta: the cache entry description
+    Returns:
+        df - Pandas DataFrame with the same columns and types that were stored
+    """
+    data = {}
+    for column_meta in meta['columns']:
+        # Rows past the described ones are left over from adding rows that did not finish.  The plain array
+        # view of the memory map keeps memmap from being passed on to the results of every calculation.
+        values = np.load(os.path.join(entry_dir, column_meta['file']), mmap_mode='r')[:meta['rows']]
+        values = values.view(np.ndarray)
+        if column_meta['stored_as'] == STORED_AS_CODES:
+            # The codes were checked when they were written, and checking them again would read every page
+            values = pd.Categorical.from_codes(values, column_meta['categories'], validate=False)
+            if column_meta['dtype'] != 'category':
+                values = values.astype(column_meta['dtype'])
+        data[column_meta['name']] = values
+
+    # Without copy=False the columns of the same type would be copied into one block
+    return pd.DataFrame(data, copy=False)
+
+
+@bikeshare_instrument.recorded
+def load_city_frame(filename, cache_dir=DEFAULT_CACHE_DIR):
+    """
+    Returns the prepared data of a city CSV file, reading it from the cache when the file did not change
+    since it was cached, and otherwise parsing the CSV file and storing the result in the cache.
+
+    Args:
+        (str) filename: name of the city CSV file
+        (str) cache_dir: directory holding all the cache entries, or None to not use the cache
+    Returns:
+        df - Pandas DataFrame containing all the city data, not filtered
+    """
+    if cache_dir is None:
+        return bikeshare_data.read_city_csv(filename)
+
+    entry_dir = get_cache_entry_dir(filename, cache_dir)
+    meta = read_cache_meta(entry_dir)
+    if is_cache_entry_valid(meta, filename):
+        return read_cached_frame(entry_dir, meta)
+
+    # When rows were only added to the file, parse just those rows and add them to the cache entry
+    appended_offset = get_appended_offset(meta, filename)
+    if appended_offset is not None and meta['version'] == CACHE_FORMAT_VERSION:
+        try:
+            if append_cached_frame(bikeshare_data.read_appended_rows(filename, appended_offset), filename, cache_dir):
+                meta = read_cache_meta(entry_dir)
+                return read_cached_frame(entry_dir, meta)
+        except (OSError, ValueError) as error:
+            # Rows that can not be parsed by themselves, like a ParserError, are left to the full parse
+            print(f'Unable to add the new rows of {filename} to the cache: {error}')
+
+    df = bikeshare_data.read_city_csv(filename)
+    try:
+        write_cached_frame(df, filename, cache_dir)
+    except OSError as error:
+        # Not being able to cache the data is not a reason to stop the analysis
+        print(f'Unable to cache {filename}: {error}')
+
+    return df
+
+
+def write_cached_index(city_data, entry_dir, meta):
+    """
+    Stores the index of the rows for each month and day of week in a cache entry, so it does not have to be
+    built again each time the entry is read
+
+    Args:
+        (CityData) city_data: the city data read from the cache entry
+        (str) entry_dir: directory of the cache entry
+        (dict) meta: the cache entry description, which is updated to describe the index
+    """
+    for name, values in city_data.get_index().items():
+        temp_file = os.path.join(entry_dir, f'{INDEX_FILE_PREFIX}{name}.tmp{os.getpid()}.npy')
+        np.save(temp_file, values)
+        os.replace(temp_file, os.path.join(entry_dir, f'{INDEX_FILE_PREFIX}{name}.npy'))
+
+    # The index is only used while the entry has the rows it was built for
+    meta['index_rows'] = meta['rows']
+    write_cache_meta(entry_dir, meta)
+
+
+def read_cached_index(entry_dir, meta):
+    """
+    Reads the stored index of a cache entry, memory mapped like the columns.  Rows may have been added to the
+    entry since the index was stored, and then the index is only for the first meta['index_rows'] rows.
+
+    Args:
+        (str) entry_dir: directory of the cache entry
+        (dict) meta: the cache entry description
+    Returns:
+        (dict) the index arrays by name, or None when no index was stored for the rows of the entry
+    """
+    index_rows = meta.get('index_rows')
+    if index_rows is None or index_rows > meta['rows']:
+        return None
+    return {name: np.load(os.path.join(entry_dir, f'{INDEX_FILE_PREFIX}{name}.npy'), mmap_mode='r').view(np.ndarray)
+            for name in bikeshare_data.INDEX_ARRAY_NAMES}
+
+
+@bikeshare_instrument.recorded
+def load_city_data(filename, cache_dir=DEFAULT_CACHE_DIR):
+    """
+    Returns the prepared data of a city CSV file with the index of its rows for each month and day of week,
+    reading both from the cache when the file did not change.  The index is built and stored the first time
+    the cached data is read, and only the new rows are added to it when rows were added to the file.
+
+    Args:
+        (str) filename: name of the city CSV file
+        (str) cache_dir: directory holding all the cache entries, or None to not use the cache
+    Returns:
+        (CityData) the city data
+    """
+    df = load_city_frame(filename, cache_dir)
+    if cache_dir is None:
+        return bikeshare_data.CityData(df)
+
+    entry_dir = get_cache_entry_dir(filename, cache_dir)
+    meta = read_cache_meta(entry_dir)
+    if not is_cache_entry_valid(meta, filename) or meta['rows'] != len(df):
+        return bikeshare_data.CityData(df)
+
+    index = read_cached_index(entry_dir, meta)
+    if index is not None and meta['index_rows'] == meta['rows']:
+        return bikeshare_data.CityData(df, index)
+
+    # When rows were added to the entry since the index was stored, just the new rows are added to it
+    if index is not None:
+        city_data = bikeshare_data.CityData(df, bikeshare_data.extend_index(index, df))
+    else:
+        city_data = bikeshare_data.CityData(df)
+    try:
+        write_cached_index(city_data, entry_dir, meta)
+    except OSError as error:
+        print(f'Unable to cache the index of {filename}: {error}')
+    return city_data
+
+
+def warm_cache(filenames, cache_dir=DEFAULT_CACHE_DIR):
+    """
+    Makes sure every given CSV file has an up to date cache entry
+
+    Args:
+        (list) filenames: names of the city CSV files
+        (str) cache_dir: directory holding all the cache entries
+    """
+    for filename in filenames:
+        entry_dir = get_cache_entry_dir(filename, cache_dir)
+        was_cached = is_cache_entry_valid(read_cache_meta(entry_dir), filename)
+
+        # Loading the city data caches it, and its index when that is missing
+        load_city_data(filename, cache_dir)
+        print(f'{filename} is already cached' if was_cached else f'{filename} was cached')
+
+
+def clear_cache(cache_dir=DEFAULT_CACHE_DIR):
+    """
+    Removes all the cache entries
+
+    Args:
+        (str) cache_dir: directory holding all the cache entries
+    """
+    shutil.rmtree(cache_dir, ignore_errors=True)
+
+
+class SummaryStore:
+    """
+    Stores the summaries computed from city CSV files, like the cube and the rollup, in a .npz file next to
+    each city's cache entry, and keeps the ones read or built in memory.  A stored summary is used while its
+    CSV file does not change.  When rows were only added to the file, just those rows are added to it, and
+    otherwise it is built again.
+
+    The summary class has ARRAY_NAMES, the names of its array attributes that are stored, and the methods
+    from_csv(filename, chunk_rows), add_rows(df), get_meta_fields() and set_meta_fields(meta).
+    """
+
+    def __init__(self, name, summary_class, file_suffix, format_version):
+        """
+        Args:
+            (str) name: what the summary is called in messages, like cube
+            (class) summary_class: the class of the summaries
+            (str) file_suffix: ending added to the cache entry name of a city to get the name of its summary file
+            (int) format_version: version of the stored arrays, summaries stored with another version are rebuilt
+        """
+        self.name = name
+        self.summary_class = summary_class
+        self.file_suffix = file_suffix
+        self.format_version = format_version
+
+        # The summaries already read or built while the program runs and their description, by file name
+        self._loaded = {}
+
+    def get_file(self, filename, cache_dir=DEFAULT_CACHE_DIR):
+        """
+        Returns the name of the file the summary of a city CSV file is stored in
+
+        Args:
+            (str) filename: name of the city CSV file
+            (str) cache_dir: directory holding all the cache entries
+        Returns:
+            (str) name of the summary file
+        """
+        return get_cache_entry_dir(filename, cache_dir) + self.file_suffix
+
+    def get_meta(self, summary, filename):
+        """
+        Returns the description of a summary and the source CSV file it was computed from
+
+        Args:
+            summary: the summary
+            (str) filename: name of the city CSV file the summary was computed from
+        Returns:
+            (dict) the description stored with the summary
+        """
+        source = get_source_signature(filename)
+        return {'version': self.format_version,
+                'source': source,
+                'tail': get_source_tail(filename, source['size']),
+                **summary.get_meta_fields()}
+
+    def save(self, summary, summary_file, meta):
+        """
+        Writes a summary and its description to a file
+
+        Args:
+            summary: the summary
+            (str) summary_file: name of the file to write
+            (dict) meta: the description of the summary from get_meta
+        """
+        # Write into a temporary file first so a reader never sees a half written summary
+        os.makedirs(os.path.dirname(summary_file) or '.', exist_ok=True)
+        temp_file = f'{summary_file}.tmp{os.getpid()}.npz'
+        np.savez(temp_file, meta=np.array(json.dumps(meta)),
+                 **{name: getattr(summary, name) for name in self.summary_class.ARRAY_NAMES})
+        os.replace(temp_file, summary_file)
+
+    def read(self, summary_file):
+        """
+        Reads a summary from a file
+
+        Args:
+            (str) summary_file: name of the file to read
+        Returns:
+            (tuple) the summary and its description, or None for both when the file is missing or unreadable
+        """
+        try:
+            with np.load(summary_file) as arrays:
+                meta = json.loads(str(arrays['meta']))
+                summary = self.summary_class()
+                for name in self.summary_class.ARRAY_NAMES:
+                    setattr(summary, name, arrays[name])
+            summary.set_meta_fields(meta)
+        except (OSError, ValueError, KeyError):
+            return None, None
+        return summary, meta
+
+    def store(self, summary, filename, cache_dir):
+        """
+        Stores the summary of a city CSV file in the cache directory and keeps it in memory
+
+        Args:
+            summary: the summary
+            (str) filename: name of the city CSV file the summary was computed from
+            (str) cache_dir: directory holding all the cache entries
+        """
+        summary_file = self.get_file(filename, cache_dir)
+        meta = self.get_meta(summary, filename)
+        try:
+            self.save(summary, summary_file, meta)
+        except OSError as error:
+            # Not being able to store the summary is not a reason to stop the analysis
+            print(f'Unable to store the {self.name} of {filename}: {error}')
+        self._loaded[summary_file] = (summary, meta)
+
+    def build(self, filename, cache_dir=DEFAULT_CACHE_DIR, chunk_rows=bikeshare_data.DEFAULT_CHUNK_ROWS):
+        """
+        Computes the summary of a city CSV file and stores it in the cache directory
+
+        Args:
+            (str) filename: name of the city CSV file
+            (str) cache_dir: directory holding all the cache entries, or None to not store the summary
+            (int) chunk_rows: number of rows to read at a time
+        Returns:
+            the summary
+        """
+        summary = self.summary_class.from_csv(filename, chunk_rows)
+        if cache_dir is not None:
+            self.store(summary, filename, cache_dir)
+        return summary
+
+    def load(self, filename, cache_dir=DEFAULT_CACHE_DIR, chunk_rows=bikeshare_data.DEFAULT_CHUNK_ROWS):
+        """
+        Returns the summary of a city CSV file, reading it from the cache directory when the file did not
+        change since the summary was built, adding just the new rows when rows were only added to the file,
+        and otherwise building it again
+
+        Args:
+            (str) filename: name of the city CSV file
+            (str) cache_dir: directory holding all the cache entries, or None to always build the summary
+            (int) chunk_rows: number of rows to read at a time when the summary is built
+        Returns:
+            the summary
+        """
+        if cache_dir is None:
+            return self.build(filename, None, chunk_rows)
+
+        summary_file = self.get_file(filename, cache_dir)
+        summary, meta = self._loaded.get(summary_file, (None, None))
+        if summary is None:
+            summary, meta = self.read(summary_file)
+        if summary is None or meta.get('version') != self.format_version:
+            return self.build(filename, cache_dir, chunk_rows)
+        if meta['source'] == get_source_signature(filename):
+            self._loaded[summary_file] = (summary, meta)
+            return summary
+
+        appended_offset = get_appended_offset(meta, filename)
+        if appended_offset is None:
+            return self.build(filename, cache_dir, chunk_rows)
+        try:
+            summary.add_rows(bikeshare_data.read_appended_rows(filename, appended_offset, stats_columns_only=True))
+        except (OSError, ValueError) as error:
+            # Rows that can not be parsed by themselves are left to the full build
+            print(f'Unable to add the new rows of {filename} to its {self.name}: {error}')
+            self._loaded.pop(summary_file, None)
+            return self.build(filename, cache_dir, chunk_rows)
+        self.store(summary, filename, cache_dir)
+        return summary
+
+
+class FrameCache:
+    """
+    Keeps the most recently used city data in memory, limited by the number of bytes it uses
+    rather than the number of cities, and counts the hits, misses and evictions so the size can be tuned.
+    It can be used from several threads at once, and a city asked for by several threads is loaded only once.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MEMORY_CACHE_BYTES):
+        """
+        Args:
+            (int) max_bytes: the most memory the cached city data may use
+        """
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # Maps the key to (city data, size in bytes, source signature), least recently used first
+        self._entries = OrderedDict()
+        # Guards the entries and counters, and the lock of each key guards the loading of its city data
+        self._lock = threading.Lock()
+        self._load_locks = {}
+
+    def get(self, filename, load_function):
+        """
+        Returns the city data for a CSV file, calling load_function(filename) only when it is not cached
+        or the file changed since it was cached
+
+        Args:
+            (str) filename: name of the city CSV file
+            (function) load_function: function that loads the city data for the file
+        Returns:
+            (CityData) the cached or newly loaded city data
+        """
+        key = os.path.abspath(filename)
+        with self._lock:
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+
+        # Threads asking for the same city wait here for the one loading it, then find it cached
+        with load_lock:
+            signature = get_source_signature(filename)
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None and entry[2] == signature:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[0]
+
+                self.misses += 1
+                if entry is not None:
+                    self._remove(key)
+
+            # The other cities can be used while this one loads
+            city_data = load_function(filename)
+            size = city_data.memory_usage()
+
+            # City data that can never fit is returned without being cached
+            with self._lock:
+                if size <= self.max_bytes:
+                    self._evict(self.max_bytes - size)
+                    self._entries[key] = (city_data, size, signature)
+                    self.current_bytes += size
+
+        return city_data
+
+    def set_max_bytes(self, max_bytes):
+        """
+        Changes the most memory the cached city data may use, evicting cities if needed
+
+        Args:
+            (int) max_bytes: the most memory the cached city data may use
+        """
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._evict(max_bytes)
+
+    def _evict(self, target_bytes):
+        """
+        Removes the least recently used entries until the cache uses at most target_bytes.  The lock must be
+        held.
+
+        Args:
+            (int) target_bytes: the most memory the remaining entries may use
+        """
+        while self._entries and self.current_bytes > target_bytes:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def _remove(self, key):
+        """
+        Removes an entry from the cache.  The lock must be held.
+
+        Args:
+            (str) key: key of the entry to remove
+        """
+        _, size, _ = self._entries.pop(key)
+        self.current_bytes -= size
+
+    def clear(self):
+        """ Removes all the entries, keeping the counters """
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        """
+        Returns the counters that show how well the cache is working
+
+        Returns:
+            (dict) the hits, misses, evictions, number of entries and bytes used
+        """
+        with self._lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    'entries': len(self._entries),
+                    'bytes': self.current_bytes,
+                    'max_bytes': self.max_bytes}
+
+
+# The city data kept in memory while the program runs
+MEMORY_CACHE = FrameCache()
@@ -0,0 +1,416 @@
+import numpy as np
+import pandas as pd
+
+import bikeshare_cache
+import bikeshare_data
+import bikeshare_instrument
+import bikeshare_stats
+
+# Bump this whenever the arrays stored in a cube file change so that older cubes are rebuilt
+CUBE_FORMAT_VERSION = 1
+
+# Ending added to the cache entry name of a city to get the name of its cube file
+CUBE_FILE_SUFFIX = '.cube.npz'
+
+# Row position used for the cells no trip falls in, so they come last when looking for the first trip
+NO_ROW = np.iinfo(np.int64).max
+
+# Summary statistics of the trip duration that can be computed from the cube, in the order describe() shows them
+CUBE_SUMMARY_INDEX = ['count', 'mean', 'std', 'min', 'max']
+
+
+def get_first_rows(cell_keys, row_positions, size):
+    """
+    Returns the position of the first row that falls in each cell
+
+    Args:
+        (NumPy array) cell_keys: the cell of every row
+        (NumPy array) row_positions: the position of every row in the file
+        (int) size: the number of cells
+    Returns:
+        (NumPy array) the first row position of every cell, NO_ROW for the cells without rows
+    """
+    first_rows = np.full(size, NO_ROW, dtype=np.int64)
+    np.minimum.at(first_rows, cell_keys, row_positions)
+    return first_rows
+
+
+def get_slot_positions(labels, new_labels):
+    """
+    Lines up the label slots of two cubes, where slot 0 is kept for missing values
+
+    Args:
+        (Index) labels: the labels of this cube
+        (Index) new_labels: the labels of the other cube
+    Returns:
+        (tuple) the combined labels and the slot of each of the other cube's slots in them
+    """
+    labels, positions = bikeshare_stats.merge_labels(labels, new_labels)
+    return labels, np.concatenate([[0], positions + 1])
+
+
+class TripCube:
+    """
+    Trip counts, trip duration totals, and user type and gender counts for every month, day of week and start
+    hour of a city.  These few thousand cells answer the time, trip duration and user type statistics of any
+    month and day selection by adding up cells, without going through the trips again.
+    """
+
+    # The arrays stored in a cube file
+    ARRAY_NAMES = ['user_counts', 'user_first_rows', 'gender_counts', 'gender_first_rows', 'duration_counts',
+                   'duration_sums', 'duration_squares', 'duration_mins', 'duration_maxes']
+
+    def __init__(self):
+        shape = (bikeshare_stats.MONTH_COUNT, bikeshare_stats.DAY_COUNT, bikeshare_stats.HOUR_COUNT)
+        self.row_count = 0
+        self.duration_is_integer = True
+
+        # Trips for every month, day of week, start hour and user type, with missing user types in slot 0,
+        # and the position of the first trip in each cell
+        self.user_types = pd.Index([], dtype=object)
+        self.user_counts = np.zeros(shape + (1,), dtype=np.int64)
+        self.user_first_rows = np.full(shape + (1,), NO_ROW, dtype=np.int64)
+
+        # The same for the genders, for the cities that have them
+        self.has_genders = False
+        self.genders = pd.Index([], dtype=object)
+        self.gender_counts = np.zeros(shape + (1,), dtype=np.int64)
+        self.gender_first_rows = np.full(shape + (1,), NO_ROW, dtype=np.int64)
+
+        # Trip durations that are not missing for every month, day of week and start hour
+        self.duration_counts = np.zeros(shape, dtype=np.int64)
+        self.duration_sums = np.zeros(shape)
+        self.duration_squares = np.zeros(shape)
+        self.duration_mins = np.full(shape, np.inf)
+        self.duration_maxes = np.full(shape, -np.inf)
+
+    @classmethod
+    def from_frame(cls, df, row_offset=0):
+        """
+        Computes the cube of a data frame
+
+        Args:
+            (Pandas DataFrame) df: data frame of bike share data with the time columns added
+            (int) row_offset: position of the first row of the data frame in the whole data
+        Returns:
+            (TripCube) the cube
+        """
+        cube = cls()
+        cube.row_count = len(df)
+        shape = cube.duration_counts.shape
+        row_positions = np.arange(row_offset, row_offset + len(df), dtype=np.int64)
+
+        months = df['month_no'].to_numpy().astype(np.int64)
+        day_codes, day_names = bikeshare_stats.get_codes(df['day_of_week'])
+        day_codes = bikeshare_stats.DAY_NAMES.get_indexer(day_names)[day_codes]
+        hours = df['start_hour'].to_numpy().astype(np.int64)
+        cell_keys = np.ravel_multi_index((months, day_codes, hours), shape)
+
+        user_codes, cube.user_types = bikeshare_stats.get_codes(df['User Type'])
+        cube.user_counts, cube.user_first_rows = cube._count_slots(cell_keys, user_codes + 1,
+                                                                   len(cube.user_types) + 1, row_positions)
+
+        if 'Gender' in df.columns:
+            cube.has_genders = True
+            gender_codes, cube.genders = bikeshare_stats.get_codes(df['Gender'])
+            cube.gender_counts, cube.gender_first_rows = cube._count_slots(cell_keys, gender_codes + 1,
+                                                                           len(cube.genders) + 1, row_positions)
+
+        # Leave out the missing durations
+        durations = df['Trip Duration'].to_numpy()
+        cube.duration_is_integer = durations.dtype.kind in 'iu'
+        has_duration = ~np.isnan(durations) if durations.dtype.kind == 'f' else np.ones(len(durations), dtype=bool)
+        durations = durations[has_duration].astype(np.float64)
+        duration_keys = cell_keys[has_duration]
+
+        size = int(np.prod(shape))
+        cube.duration_counts = np.bincount(duration_keys, minlength=size).reshape(shape)
+        cube.duration_sums = np.bincount(duration_keys, weights=durations, minlength=size).reshape(shape)
+        cube.duration_squares = np.bincount(duration_keys, weights=durations ** 2, minlength=size).reshape(shape)
+        cube.duration_mins = np.full(size, np.inf)
+        np.minimum.at(cube.duration_mins, duration_keys, durations)
+        cube.duration_mins = cube.duration_mins.reshape(shape)
+        cube.duration_maxes = np.full(size, -np.inf)
+        np.maximum.at(cube.duration_maxes, duration_keys, durations)
+        cube.duration_maxes = cube.duration_maxes.reshape(shape)
+        return cube
+
+    def _count_slots(self, cell_keys, slots, slot_count, row_positions):
+        """
+        Counts the rows and finds the first row for every cell and label slot
+
+        Args:
+            (NumPy array) cell_keys: the month, day of week and start hour cell of every row
+            (NumPy array) slots: the label slot of every row
+            (int) slot_count: the number of label slots
+            (NumPy array) row_positions: the position of every row in the file
+        Returns:
+            (tuple) the counts and the first row positions, with a dimension for the slots
+        """
+        shape = self.duration_counts.shape + (slot_count,)
+        size = int(np.prod(shape))
+        keys = cell_keys * slot_count + slots
+        return (np.bincount(keys, minlength=size).reshape(shape),
+                get_first_rows(keys, row_positions, size).reshape(shape))
+
+    @classmethod
+    def from_csv(cls, filename, chunk_rows=bikeshare_data.DEFAULT_CHUNK_ROWS):
+        """
+        Computes the cube of a city CSV file, reading it in chunks so only one chunk is in memory at a time
+
+        Args:
+            (str) filename: name of the city CSV file
+            (int) chunk_rows: number of rows to read at a time
+        Returns:
+            (TripCube) the cube
+        """
+        cube = cls()
+        with bikeshare_data.read_stats_columns(filename, chunksize=chunk_rows) as reader:
+            for chunk in reader:
+                cube.merge(cls.from_frame(bikeshare_data.prepare_trip_data(chunk), cube.row_count))
+        return cube
+
+    def merge(self, other):
+        """
+        Adds the cube of the data that follows this data
+
+        Args:
+            (TripCube) other: the cube to add
+        """
+        self.row_count += other.row_count
+        self.duration_is_integer = self.duration_is_integer and other.duration_is_integer
+
+        self.user_types, user_slots = get_slot_positions(self.user_types, other.user_types)
+        self.user_counts = bikeshare_stats.pad(self.user_counts, len(self.user_types) + 1, axis=3)
+        self.user_counts[..., user_slots] += other.user_counts
+        self.user_first_rows = self._merge_first_rows(self.user_first_rows, other.user_first_rows, user_slots,
+                                                      len(self.user_types) + 1)
+
+        if other.has_genders:
+            self.has_genders = True
+            self.genders, gender_slots = get_slot_positions(self.genders, other.genders)
+            self.gender_counts = bikeshare_stats.pad(self.gender_counts, len(self.genders) + 1, axis=3)
+            self.gender_counts[..., gender_slots] += other.gender_counts
+            self.gender_first_rows = self._merge_first_rows(self.gender_first_rows, other.gender_first_rows,
+                                                            gender_slots, len(self.genders) + 1)
+
+        self.duration_counts += other.duration_counts
+        self.duration_sums += other.duration_sums
+        self.duration_squares += other.duration_squares
+        self.duration_mins = np.minimum(self.duration_mins, other.duration_mins)
+        self.duration_maxes = np.maximum(self.duration_maxes, other.duration_maxes)
+
+    @staticmethod
+    def _merge_first_rows(first_rows, other_first_rows, slots, slot_count):
+        """
+        Combines the first row positions of two cubes, after their label slots were lined up
+
+        Args:
+            (NumPy array) first_rows: the first row positions of this cube
+            (NumPy array) other_first_rows: the first row positions of the other cube
+            (NumPy array) slots: the slot of each of the other cube's slots in the combined slots
+            (int) slot_count: the number of combined slots
+        Returns:
+            (NumPy array) the combined first row positions
+        """
+        missing = slot_count - first_rows.shape[3]
+        if missing > 0:
+            first_rows = np.concatenate([first_rows, np.full(first_rows.shape[:3] + (missing,), NO_ROW)], axis=3)
+        first_rows[..., slots] = np.minimum(first_rows[..., slots], other_first_rows)
+        return first_rows
+
+    def get_trip_stats(self, month_no=None, weekday=None):
+        """
+        Returns the time, trip duration and user type statistics for a month and day of week by adding up cells
+
+        Args:
+            (int) month_no: number of the month (1 for January), or None for all the months
+            (int) weekday: day of the week (0 for Monday), or None for all the days
+        Returns:
+            (CubeStats) the statistics for the selected trips
+        """
+        # Keep the selected cells and clear the others
+        selected = np.zeros(self.duration_counts.shape, dtype=bool)
+        months = slice(None) if month_no is None else month_no
+        days = (slice(None) if weekday is None
+                else bikeshare_stats.DAY_NAMES.get_loc(bikeshare_data.WEEKDAY_NAMES[weekday]))
+        selected[months, days] = True
+
+        aggregates = bikeshare_stats.TripAggregates()
+        user_counts = np.where(selected[..., np.newaxis], self.user_counts, 0)
+        user_first_rows = np.where(selected[..., np.newaxis], self.user_first_rows, NO_ROW)
+        aggregates.row_count = int(user_counts.sum())
+        aggregates.user_types = self.user_types
+        aggregates.cell_counts = user_counts
+        aggregates.month_order, aggregates.day_order, aggregates.hour_order, aggregates.user_order = (
+            self._get_appearance_order(user_first_rows, axis) for axis in range(4))
+
+        # The durations are kept per cell, so they are all placed in the first user type slot
+        duration_counts = np.where(selected, self.duration_counts, 0)
+        duration_sums = np.where(selected, self.duration_sums, 0)
+        aggregates.cell_duration_counts = np.zeros(user_counts.shape, dtype=np.int64)
+        aggregates.cell_duration_counts[..., 0] = duration_counts
+        aggregates.cell_duration_sums = np.zeros(user_counts.shape)
+        aggregates.cell_duration_sums[..., 0] = duration_sums
+        aggregates.duration_count = int(duration_counts.sum())
+        aggregates.total_duration = duration_sums.sum()
+        if self.duration_is_integer:
+            aggregates.total_duration = np.int64(aggregates.total_duration)
+
+        if self.has_genders:
+            gender_counts = np.where(selected[..., np.newaxis], self.gender_counts, 0)[..., 1:]
+            gender_first_rows = np.where(selected[..., np.newaxis], self.gender_first_rows, NO_ROW)[..., 1:]
+            aggregates.has_genders = True
+            aggregates.genders = self.genders
+            aggregates.gender_counts = gender_counts.sum(axis=(0, 1, 2))
+            aggregates.gender_order = self._get_appearance_order(gender_first_rows, 3)
+
+        moments = (aggregates.duration_count, duration_sums.sum(), np.where(selected, self.duration_squares, 0).sum(),
+                   np.where(selected, self.duration_mins, np.inf).min(),
+                   np.where(selected, self.duration_maxes, -np.inf).max())
+        return CubeStats(aggregates, moments)
+
+    @staticmethod
+    def _get_appearance_order(first_rows, axis):
+        """
+        Returns the positions along an axis that have trips, in the order their first trip appears
+
+        Args:
+            (NumPy array) first_rows: the first row position of every cell, NO_ROW for the cells without rows
+            (int) axis: the axis to order
+        Returns:
+            (NumPy array) the positions along the axis
+        """
+        other_axes = tuple(other for other in range(first_rows.ndim) if other != axis)
+        axis_first_rows = first_rows.min(axis=other_axes)
+        used = np.flatnonzero(axis_first_rows != NO_ROW)
+        return used[np.argsort(axis_first_rows[used], kind='stable')].astype(np.int64)
+
+    def add_rows(self, df):
+        """
+        Adds the rows that were appended to the city CSV file the cube was computed from
+
+        Args:
+            (Pandas DataFrame) df: the prepared rows added to the file
+        """
+        self.merge(TripCube.from_frame(df, self.row_count))
+
+    def get_meta_fields(self):
+        """
+        Returns the description of the cube that is stored with its arrays
+
+        Returns:
+            (dict) the number of rows, and the user types and genders the slots of the arrays are for
+        """
+        return {'row_count': self.row_count,
+                'duration_is_integer': self.duration_is_integer,
+                'has_genders': self.has_genders,
+                'user_types': [str(user_type) for user_type in self.user_types],
+                'genders': [str(gender) for gender in self.genders]}
+
+    def set_meta_fields(self, meta):
+        """
+        Sets the description of a cube that was read from a file
+
+        Args:
+            (dict) meta: the description stored with the arrays, from get_meta_fields
+        """
+        self.row_count = meta['row_count']
+        self.duration_is_integer = meta['duration_is_integer']
+        self.has_genders = meta['has_genders']
+        self.user_types = pd.Index(meta['user_types'], dtype=object)
+        self.genders = pd.Index(meta['genders'], dtype=object)
+
+
+class CubeStats(bikeshare_stats.TripStats):
+    """
+    The statistics that can be answered from a TripCube.  There are no station, birth year, trip duration
+    quartile or distribution statistics, because the cube does not keep the values they need.
+    """
+
+    def __init__(self, aggregates, duration_moments):
+        """
+        Args:
+            (TripAggregates) aggregates: the counts and sums for the selected trips, without stations
+            (tuple) duration_moments: the count, sum, sum of squares, minimum and maximum of the trip durations
+        """
+        self._duration_moments = duration_moments
+        super().__init__(aggregates)
+
+    def _summarize_durations(self, aggregates):
+        """
+        Derives the trip duration total, mean and summary statistics, and the mean per month and day of week
+
+        Args:
+            (TripAggregates) aggregates: the counts and sums for the selected trips
+        """
+        super()._summarize_durations(aggregates)
+
+        count, total, squares, minimum, maximum = self._duration_moments
+        summary = [float(count)] + [np.nan] * 4
+        if count:
+            mean = total / count
+            std = np.sqrt(max(squares - total * mean, 0) / (count - 1)) if count > 1 else np.nan
+            summary = [float(count), mean, std, minimum, maximum]
+        self.duration_summary = pd.Series(summary, index=CUBE_SUMMARY_INDEX, name='Trip Duration')
+
+    def _summarize_distributions(self, aggregates):
+        """
+        Leaves out the trip duration and birth year distributions, which the cube does not keep the values for
+
+        Args:
+            (TripAggregates) aggregates: the counts and sums for the selected trips
+        """
+        self.duration_percentiles = self.duration_histogram = None
+        self.duration_percentiles_by_month = self.duration_percentiles_by_day = None
+        self.duration_percentiles_by_hour = self.duration_percentiles_by_user_type = None
+        self.birth_year_percentiles = self.birth_year_histogram = None
+
+
+# Stores the cubes next to the cached data of each city
+CUBE_STORE = bikeshare_cache.SummaryStore('cube', TripCube, CUBE_FILE_SUFFIX, CUBE_FORMAT_VERSION)
+
+
+def get_cube_file(filename, cache_dir=bikeshare_cache.DEFAULT_CACHE_DIR):
+    """
+    Returns the name of the file the cube of a city CSV file is stored in
+
+    Args:
+        (str) filename: name of the city CSV file
+        (str) cache_dir: directory holding all the cache entries
+    Returns:
+        (str) name of the cube file
+    """
+    return CUBE_STORE.get_file(filename, cache_dir)
+
+
+@bikeshare_instrument.recorded
+def build_cube(filename, cache_dir=bikeshare_cache.DEFAULT_CACHE_DIR, chunk_rows=bikeshare_data.DEFAULT_CHUNK_ROWS):
+    """
+    Computes the cube of a city CSV file and stores it in the cache directory
+
+    Args:
+        (str) filename: name of the city CSV file
+        (str) cache_dir: directory holding all the cache entries, or None to not store the cube
+        (int) chunk_rows: number of rows to read at a time
+    Returns:
+        (TripCube) the cube
+    """
+    return CUBE_STORE.build(filename, cache_dir, chunk_rows)
+
+
+@bikeshare_instrument.recorded
+def load_cube(filename, cache_dir=bikeshare_cache.DEFAULT_CACHE_DIR, chunk_rows=bikeshare_data.DEFAULT_CHUNK_ROWS):
+    """
+    Returns the cube of a city CSV file, reading it from the cache directory when the file did not change
+    since the cube was built.  When rows were only added to the file, just those rows are added to the cube,
+    and otherwise the cube is built again.
+
+    Args:
+        (str) filename: name of the city CSV file
+        (str) cache_dir: directory holding all the cache entries, or None to always build the cube
+        (int) chunk_rows: number of rows to read at a time when the cube is built
+    Returns:
+        (TripCube) the cube
+    """
+    return CUBE_STORE.load(filename, cache_dir, chunk_rows)
@@ -0,0 +1,602 @@
+import io
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+import bikeshare_defaults
+import bikeshare_instrument
+import bikeshare_stats
+
+# Number of index slots for the month numbers (1 - 12, slot 0 is not used) and the days of the week (0 - 6)
+MONTH_COUNT = 13
+WEEKDAY_COUNT = 7
+
+# The types used for the columns of the city CSV files.  The text columns repeat a small number of values, so
+# they are read as categories, and the birth year fits in a float32 (it stays a float because it has missing
+# values).  Columns a city does not have, like Gender and Birth Year for Washington, are skipped.
+TRIP_DATA_SCHEMA = {'Unnamed: 0': 'int32',
+                    'Start Station': 'category',
+                    'End Station': 'category',
+                    'User Type': 'category',
+                    'Gender': 'category',
+                    'Birth Year': 'float32'}
+
+# Number of rows read at a time when a file is read in chunks
+DEFAULT_CHUNK_ROWS = bikeshare_defaults.DEFAULT_CHUNK_ROWS
+
+# Size of each value in a column of the default types, int64, float64 or a pointer to a Python object
+DEFAULT_VALUE_SIZE = 8
+
+# Layout of the start and end times in the city CSV files.  Giving the layout lets pandas parse every value
+# the same way instead of working it out from the values.
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Columns that none of the statistics use.  They are skipped when only the statistics are computed, so they
+# are not parsed at all.
+UNUSED_STATS_COLUMNS = {'End Time'}
+
+# Names of the months (1 - 12, slot 0 is not used) and the days of the week (0 for Monday) used for the
+# month and day_of_week columns
+MONTH_NAMES = np.array(['', 'January', 'February', 'March', 'April', 'May', 'June', 'July', 'August',
+                        'September', 'October', 'November', 'December'], dtype=object)
+WEEKDAY_NAMES = np.array(['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday'],
+                         dtype=object)
+
+# Seconds spent reading and parsing each column of the CSV files parsed so far, by file name
+PARSE_TIMINGS = {}
+
+
+def parse_timestamps(values):
+    """
+    Converts text values to date time values using TIMESTAMP_FORMAT.  Values that do not follow the format
+    are parsed again one by one with their layout worked out from the value, and values that still can not
+    be parsed become NaT.
+
+    Args:
+        (Pandas Series) values: the text values of a time column
+    Returns:
+        (Pandas Series) the date time values
+    """
+    timestamps = pd.to_datetime(values, format=TIMESTAMP_FORMAT, errors='coerce')
+
+    # Only the malformed rows take the slow path
+    malformed = timestamps.isna() & values.notna()
+    if malformed.any():
+        timestamps[malformed] = pd.to_datetime(values[malformed], format='mixed', errors='coerce')
+    return timestamps
+
+
+def get_name_categories(numbers, names):
+    """
+    Returns the names for small integer numbers as a category column, with the names as categories in the
+    same sorted order astype('category') would give, without making a string for every row
+
+    Args:
+        (NumPy array) numbers: the number of every row
+        (NumPy array) names: the name of each number
+    Returns:
+        (Pandas Categorical) the name of every row
+    """
+    present = np.flatnonzero(np.bincount(numbers, minlength=len(names)))
+    order = np.argsort(names[present].astype(str), kind='stable')
+    codes = np.full(len(names), -1, dtype=np.int8)
+    codes[present[order]] = np.arange(len(present), dtype=np.int8)
+    return pd.Categorical.from_codes(codes[numbers], list(names[present[order]]))
+
+
+def add_timing(timings, name, start_time):
+    """
+    Adds the seconds since start_time to a timing
+
+    Args:
+        (dict) timings: seconds spent by name, or None to not record the timing
+        (str) name: name of the timing, usually a column name
+        (float) start_time: value of time.perf_counter() when the work started
+    Returns:
+        (float) the value of time.perf_counter() now, to start the next timing
+    """
+    now = time.perf_counter()
+    if timings is not None:
+        timings[name] = timings.get(name, 0.0) + now - start_time
+    return now
+
+
+def add_time_columns(df, timings=None):
+    """
+    Converts the start and end times to date time types and adds the month, day of week and start hour
+    columns that are used in filtering and displaying.  The end time is only converted when it was read.
+    Rows without a start time that can be parsed are dropped, because they can not be placed in a month.
+
+    Args:
+        (Pandas DataFrame) df: data frame of bike share data as read from the CSV file
+        (dict) timings: seconds spent by column, to add the time spent here to, or None
+    Returns:
+        df - the same data frame with the converted and added columns
+    """
+    # Convert the start and end times to date time types
+    start_time = time.perf_counter()
+    df['Start Time'] = parse_timestamps(df['Start Time'])
+    start_time = add_timing(timings, 'Start Time', start_time)
+    if 'End Time' in df.columns:
+        df['End Time'] = parse_timestamps(df['End Time'])
+        start_time = add_timing(timings, 'End Time', start_time)
+
+    unparsed = df['Start Time'].isna().to_numpy()
+    if unparsed.any():
+        # The rows are numbered again so the frame is the same as the one read back from the cache
+        df = df[~unparsed].reset_index(drop=True)
+        if timings is not None:
+            timings['dropped rows'] = timings.get('dropped rows', 0) + int(unparsed.sum())
+
+    # Add the month and the day of week columns to the data frame because they could be used in filtering
+    # and displaying.  Added the month number to help in sorting.  The names are categories and the numbers
+    # are small integers to keep the memory used low.
+    month_numbers = df['Start Time'].dt.month.to_numpy(dtype=np.int8)
+    df['month'] = get_name_categories(month_numbers, MONTH_NAMES)
+    df['month_no'] = month_numbers
+    df['day_of_week'] = get_name_categories(df['Start Time'].dt.dayofweek.to_numpy(dtype=np.int8), WEEKDAY_NAMES)
+    df['start_hour'] = df['Start Time'].dt.hour.to_numpy(dtype=np.int8)
+    add_timing(timings, 'derived columns', start_time)
+
+    return df
+
+
+def compact_trip_duration(df):
+    """
+    Stores the trip durations as int32 when they are all whole numbers that fit, which halves their memory.
+    Durations with fractions of a second stay float64 so the totals and means do not change.
+
+    Args:
+        (Pandas DataFrame) df: data frame of bike share data as read from the CSV file
+    Returns:
+        df - the same data frame with the trip duration converted if possible
+    """
+    durations = df['Trip Duration'].to_numpy()
+    int32_limits = np.iinfo(np.int32)
+    if (durations.dtype.kind in 'iuf'
+            and not np.isnan(durations).any()
+            and np.array_equal(np.floor(durations), durations)
+            and (len(durations) == 0 or int32_limits.min <= durations.min() <= durations.max() <= int32_limits.max)):
+        df['Trip Duration'] = durations.astype(np.int32)
+
+    return df
+
+
+def read_city_csv(filename):
+    """
+    Reads a city CSV file and prepares all the columns used in the analysis.  The time spent on each column
+    is kept in PARSE_TIMINGS.
+
+    Args:
+        (str) filename: name of the city CSV file
+    Returns:
+        df - Pandas DataFrame containing all the city data, not filtered
+    """
+    timings = {}
+    start_time = time.perf_counter()
+    with bikeshare_instrument.RECORDER.span('read_csv', bytes_read=os.path.getsize(filename)) as span:
+        df = pd.read_csv(filename, dtype=TRIP_DATA_SCHEMA)
+        span.count(rows=len(df))
+    add_timing(timings, 'read_csv', start_time)
+    PARSE_TIMINGS[filename] = timings
+    return prepare_trip_data(df, timings)
+
+
+def read_appended_rows(filename, start, stats_columns_only=False):
+    """
+    Reads and prepares the rows of a city CSV file from a byte offset to the end, for rows added to a file
+    that was already read.  The time spent on each column is kept in PARSE_TIMINGS.
+
+    Args:
+        (str) filename: name of the city CSV file
+        (int) start: offset of the first added byte, which must be the start of a line
+        (bool) stats_columns_only: whether to skip the columns none of the statistics use
+    Returns:
+        df - Pandas DataFrame containing the added rows
+    """
+    timings = {}
+    start_time = time.perf_counter()
+    with open(filename, 'rb') as csv_file:
+        header = csv_file.readline()
+        csv_file.seek(start)
+        data = io.BytesIO(header + csv_file.read())
+    with bikeshare_instrument.RECORDER.span('read_csv', bytes_read=len(data.getbuffer())) as span:
+        df = read_stats_columns(data) if stats_columns_only else pd.read_csv(data, dtype=TRIP_DATA_SCHEMA)
+        span.count(rows=len(df))
+    add_timing(timings, 'read_csv', start_time)
+    PARSE_TIMINGS[filename] = timings
+    return prepare_trip_data(df, timings)
+
+
+def append_csv_rows(filename, new_filename):
+    """
+    Adds the rows of a CSV file to the end of a city CSV file with the same columns, like a new daily or monthly
+    file of trips
+
+    Args:
+        (str) filename: name of the city CSV file to add the rows to
+        (str) new_filename: name of the CSV file with the new rows
+    Returns:
+        (int) the number of bytes added
+    """
+    with open(filename, 'rb') as csv_file:
+        header = csv_file.readline()
+        csv_file.seek(0, io.SEEK_END)
+        needs_line_break = False
+        if csv_file.tell() > 0:
+            csv_file.seek(-1, io.SEEK_END)
+            needs_line_break = csv_file.read(1) != b'\n'
+
+    with open(new_filename, 'rb') as new_file, open(filename, 'ab') as csv_file:
+        if new_file.readline().rstrip(b'\r\n') != header.rstrip(b'\r\n'):
+            raise ValueError(f'{new_filename} does not have the same columns as {filename}')
+        data = new_file.read()
+        if data and not data.endswith(b'\n'):
+            data += b'\n'
+        if needs_line_break:
+            data = b'\n' + data
+        csv_file.write(data)
+    return len(data)
+
+
+def read_stats_columns(filename, **kwargs):
+    """
+    Reads a city CSV file, or a part of it, without the columns none of the statistics use
+
+    Args:
+        (str) filename: name or file object of the city CSV file
+        kwargs: other arguments for pd.read_csv, like chunksize
+    Returns:
+        the Pandas DataFrame, or the reader of its chunks
+    """
+    return pd.read_csv(filename, dtype=TRIP_DATA_SCHEMA, usecols=lambda name: name not in UNUSED_STATS_COLUMNS,
+                       **kwargs)
+
+
+@bikeshare_instrument.recorded
+def prepare_trip_data(df, timings=None):
+    """
+    Prepares the columns of trip data read with TRIP_DATA_SCHEMA for the analysis
+
+    Args:
+        (Pandas DataFrame) df: data frame of bike share data as read from the CSV file
+        (dict) timings: seconds spent by column, to add the time spent here to, or None
+    Returns:
+        df - the same data frame with the stations lined up, the duration compacted and the time columns added
+    """
+    # Give the start and end stations the same categories so they can be compared with each other
+    start_time = time.perf_counter()
+    stations = df['Start Station'].cat.categories.union(df['End Station'].cat.categories)
+    df['Start Station'] = df['Start Station'].cat.set_categories(stations)
+    df['End Station'] = df['End Station'].cat.set_categories(stations)
+    df = compact_trip_duration(df)
+    add_timing(timings, 'stations and duration', start_time)
+
+    return add_time_columns(df, timings)
+
+
+def get_parse_report(filename):
+    """
+    Returns lines describing the time spent reading and parsing each column of a CSV file
+
+    Args:
+        (str) filename: name of the city CSV file
+    Returns:
+        (list) one line per column, or None when the file was not parsed while the program runs
+    """
+    timings = PARSE_TIMINGS.get(filename)
+    if timings is None:
+        return None
+    lines = [f'{name:>22}: {seconds:.3f} seconds' for name, seconds in timings.items() if name != 'dropped rows']
+    if timings.get('dropped rows'):
+        lines.append(f'{"dropped rows":>22}: {timings["dropped rows"]} without a start time that could be parsed')
+    return lines
+
+
+def filter_trips(df, month_no=None, weekday=None):
+    """
+    Returns the rows of a data frame for a month and day of week by comparing the values of every row.  Used
+    for data that is not indexed, like the chunks of a file that is read in parts.
+
+    Args:
+        (Pandas DataFrame) df: data frame of bike share data with the time columns added
+        (int) month_no: number of the month (1 for January), or None for all the months
+        (int) weekday: day of the week (0 for Monday), or None for all the days
+    Returns:
+        df - the selected rows
+    """
+    if month_no is not None:
+        df = df[df['month_no'].to_numpy() == month_no]
+    if weekday is not None:
+        df = df[df['Start Time'].dt.dayofweek.to_numpy() == weekday]
+    return df
+
+
+def stream_trip_aggregates(filename, month_no=None, weekday=None, chunk_rows=DEFAULT_CHUNK_ROWS,
+                           quantile_sketch=False, distributions=False):
+    """
+    Reads a city CSV file in chunks and adds up the counts and sums for a month and day of week, so only one
+    chunk of the file is in memory at a time
+
+    Args:
+        (str) filename: name of the city CSV file
+        (int) month_no: number of the month (1 for January), or None for all the months
+        (int) weekday: day of the week (0 for Monday), or None for all the days
+        (int) chunk_rows: number of rows to read at a time
+        (bool) quantile_sketch: True to keep only the sketch of the trip durations
+        (bool) distributions: True to count the trip duration sketch of every month, day, hour and user type
+    Returns:
+        (TripAggregates) the counts and sums for the selected rows
+    """
+    selection = (month_no, weekday)
+    return stream_selection_aggregates(filename, [selection], chunk_rows, quantile_sketch=quantile_sketch,
+                                       distributions=distributions)[selection]
+
+
+def stream_selection_aggregates(filename, selections, chunk_rows=DEFAULT_CHUNK_ROWS,
+                                aggregates_class=bikeshare_stats.TripAggregates, **aggregates_options):
+    """
+    Reads a city CSV file in chunks once and adds up the counts and sums for several months and days of week,
+    so only one chunk of the file is in memory at a time.  The columns the statistics do not use are not
+    read, and the time spent on each column is kept in PARSE_TIMINGS.
+
+    Args:
+        (str) filename: name of the city CSV file
+        (list) selections: (month number, day of week) pairs, with None for all the months or days
+        (int) chunk_rows: number of rows to read at a time
+        (class) aggregates_class: TripAggregates or a subclass of it to add up the chunks with
+        aggregates_options: arguments for the constructor of aggregates_class
+    Returns:
+        (dict) the aggregates_class counts and sums for the selected rows, by selection
+    """
+    aggregates = {selection: aggregates_class(**aggregates_options) for selection in selections}
+    timings = {}
+    PARSE_TIMINGS[filename] = timings
+    recorder = bikeshare_instrument.RECORDER
+    with recorder.span('stream', bytes_read=os.path.getsize(filename)) as stream_span, \
+            read_stats_columns(filename, chunksize=chunk_rows) as reader:
+        start_time = time.perf_counter()
+        for chunk in reader:
+            add_timing(timings, 'read_csv', start_time)
+            stream_span.count(rows=len(chunk))
+
+            # Index the chunk once so every selection is found without comparing the values of every row
+            chunk_data = CityData(prepare_trip_data(chunk, timings))
+            with recorder.span('aggregate', rows=len(chunk_data.df)):
+                for selection, selection_aggregates in aggregates.items():
+                    selection_aggregates.merge(aggregates_class.from_frame(chunk_data.select(*selection),
+                                                                           **aggregates_options))
+            start_time = time.perf_counter()
+    return aggregates
+
+
+def estimate_default_memory_usage(df):
+    """
+    Estimates the memory the data frame would use with the default types read_csv uses -- Python strings
+    for the text columns, and int64 or float64 for the numbers.
+
+    Args:
+        (Pandas DataFrame) df: data frame of bike share data
+    Returns:
+        (int) the estimated number of bytes
+    """
+    total = int(df.index.memory_usage())
+    for column_name in df.columns:
+        column = df[column_name]
+        total += len(column) * DEFAULT_VALUE_SIZE
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            # Every row would point to its own string object.  Missing values (code -1) share a single object.
+            categories = column.cat.categories
+            string_sizes = np.array([sys.getsizeof(str(category)) for category in categories], dtype=np.int64)
+            codes = column.cat.codes.to_numpy()
+            total += int(np.bincount(codes[codes >= 0], minlength=len(categories)).dot(string_sizes))
+    return total
+
+
+def get_memory_report(df):
+    """
+    Returns a line describing the memory the data frame uses compared to the default types
+
+    Args:
+        (Pandas DataFrame) df: data frame of bike share data
+    Returns:
+        (str) the memory used and the estimated memory with the default types in megabytes
+    """
+    used = df.memory_usage(index=True, deep=True).sum() / (1024 * 1024)
+    default = estimate_default_memory_usage(df) / (1024 * 1024)
+    return f'{used:.1f} MB ({default:.1f} MB with Python string and 64-bit number columns)'
+
+
+def get_row_order(keys, key_count):
+    """
+    Groups the row positions by key without changing the order of the rows within a key
+
+    Args:
+        (NumPy array) keys: small non-negative integer key of every row
+        (int) key_count: number of possible keys
+    Returns:
+        (tuple) the row positions ordered by key, and the offsets where each key starts and ends in them
+    """
+    order = np.argsort(keys, kind='stable').astype(np.int32 if len(keys) < 2 ** 31 else np.int64)
+    offsets = np.zeros(key_count + 1, dtype=np.int64)
+    np.cumsum(np.bincount(keys, minlength=key_count), out=offsets[1:])
+    return order, offsets
+
+
+def extend_row_order(order, offsets, new_keys, key_count):
+    """
+    Adds rows after the last row to the row positions grouped by get_row_order.  Only the new rows are grouped:
+    they come after every row that was already grouped, so they go at the end of the positions of their key.
+
+    Args:
+        (NumPy array) order: the row positions ordered by key
+        (NumPy array) offsets: the offsets where each key starts and ends in the order
+        (NumPy array) new_keys: small non-negative integer key of every added row
+        (int) key_count: number of possible keys
+    Returns:
+        (tuple) the positions of all the rows ordered by key, and the offsets where each key starts and ends in them
+    """
+    row_count = len(order) + len(new_keys)
+    new_order, new_offsets = get_row_order(new_keys, key_count)
+    extended = np.empty(row_count, dtype=np.int32 if row_count < 2 ** 31 else np.int64)
+    extended_offsets = offsets + new_offsets
+
+    # Copy the positions of each key, then the positions of the new rows with that key after them
+    for key in range(key_count):
+        middle = extended_offsets[key] + offsets[key + 1] - offsets[key]
+        extended[extended_offsets[key]:middle] = order[offsets[key]:offsets[key + 1]]
+        extended[middle:extended_offsets[key + 1]] = new_order[new_offsets[key]:new_offsets[key + 1]] + len(order)
+    return extended, extended_offsets
+
+
+def get_index_keys(df):
+    """
+    Returns the keys the rows are grouped by in the index of the city data
+
+    Args:
+        (Pandas DataFrame) df: data frame of bike share data with the time columns added
+    Returns:
+        (dict) the key of every row and the number of possible keys, by the name of the index they group the
+        rows for
+    """
+    months = df['month_no'].to_numpy(dtype=np.int64)
+    weekdays = df['Start Time'].dt.dayofweek.to_numpy(dtype=np.int64)
+    return {'month': (months, MONTH_COUNT),
+            'weekday': (weekdays, WEEKDAY_COUNT),
+            'month_weekday': (months * WEEKDAY_COUNT + weekdays, MONTH_COUNT * WEEKDAY_COUNT)}
+
+
+def extend_index(index, df):
+    """
+    Adds the rows of a data frame that come after the rows an index was built for to the index, so the rows
+    appended to a city file do not make the whole index be built again
+
+    Args:
+        (dict) index: the index arrays by name, as CityData.get_index returned them for the first rows
+        (Pandas DataFrame) df: data frame of bike share data with the time columns added, with all the rows
+    Returns:
+        (dict) the index arrays of all the rows by name
+    """
+    index_rows = len(index['month_order'])
+    extended = {}
+    with bikeshare_instrument.RECORDER.span('extend_index', rows=len(df) - index_rows):
+        for name, (keys, key_count) in get_index_keys(df.iloc[index_rows:]).items():
+            extended[f'{name}_order'], extended[f'{name}_offsets'] = extend_row_order(
+                index[f'{name}_order'], index[f'{name}_offsets'], keys, key_count)
+    return extended
+
+
+# Names of the arrays of the CityData index, which can be stored and given back instead of built again
+INDEX_ARRAY_NAMES = ['month_order', 'month_offsets', 'weekday_order', 'weekday_offsets', 'month_weekday_order',
+                     'month_weekday_offsets']
+
+
+class CityData:
+    """
+    The prepared data of a city with an index of the rows for each month, day of week, and month and day
+    of week, built once so that any selection is found without comparing the values of every row.
+    """
+
+    def __init__(self, df, index=None):
+        """
+        Args:
+            (Pandas DataFrame) df: data frame of bike share data with the time columns added
+            (dict) index: the index arrays of the data frame by name, as get_index returned them, or None to
+                build the index
+        """
+        self.df = df
+
+        if index is not None:
+            for name in INDEX_ARRAY_NAMES:
+                setattr(self, '_' + name, index[name])
+        else:
+            self._build_index()
+
+        # The statistics computed for each selection, by month number and day of the week
+        self._trip_stats = {}
+
+    def _build_index(self):
+        """ Builds the index of the rows for each month, day of week, and month and day of week. """
+        with bikeshare_instrument.RECORDER.span('index', rows=len(self.df)):
+            for name, (keys, key_count) in get_index_keys(self.df).items():
+                order, offsets = get_row_order(keys, key_count)
+                setattr(self, f'_{name}_order', order)
+                setattr(self, f'_{name}_offsets', offsets)
+
+    def get_index(self):
+        """
+        Returns the arrays of the index, to store them with the data
+
+        Returns:
+            (dict) the index arrays by name
+        """
+        return {name: getattr(self, '_' + name) for name in INDEX_ARRAY_NAMES}
+
+    def get_positions(self, month_no=None, weekday=None):
+        """
+        Returns the positions of the rows for a month and day of week, in the order of the rows in the data
+
+        Args:
+            (int) month_no: number of the month (1 for January), or None for all the months
+            (int) weekday: day of the week (0 for Monday), or None for all the days
+        Returns:
+            (NumPy array) the row positions, or None when all the rows are selected
+        """
+        if month_no is None and weekday is None:
+            return None
+        if weekday is None:
+            order, offsets, key = self._month_order, self._month_offsets, month_no
+        elif month_no is None:
+            order, offsets, key = self._weekday_order, self._weekday_offsets, weekday
+        else:
+            order, offsets = self._month_weekday_order, self._month_weekday_offsets
+            key = month_no * WEEKDAY_COUNT + weekday
+        return order[offsets[key]:offsets[key + 1]]
+
+    def select(self, month_no=None, weekday=None):
+        """
+        Returns the rows for a month and day of week
+
+        Args:
+            (int) month_no: number of the month (1 for January), or None for all the months
+            (int) weekday: day of the week (0 for Monday), or None for all the days
+        Returns:
+            df - the data frame itself when all rows are selected, otherwise a data frame with the selected rows
+        """
+        positions = self.get_positions(month_no, weekday)
+        if positions is None:
+            return self.df
+        return self.df.take(positions)
+
+    def get_trip_stats(self, month_no=None, weekday=None, distributions=False):
+        """
+        Returns the statistics for a month and day of week, computing them the first time they are needed
+
+        Args:
+            (int) month_no: number of the month (1 for January), or None for all the months
+            (int) weekday: day of the week (0 for Monday), or None for all the days
+            (bool) distributions: True to also have the trip duration percentiles per month, day of week, start
+                hour and user type
+        Returns:
+            (TripStats) the statistics for the selected rows
+        """
+        # Statistics computed with the percentiles per group also answer the requests without them
+        key = (month_no, weekday)
+        trip_stats = self._trip_stats.get(key)
+        if trip_stats is None or (distributions and trip_stats.duration_percentiles_by_month is None):
+            trip_stats = bikeshare_stats.compute_trip_stats(self.select(month_no, weekday), distributions)
+            self._trip_stats[key] = trip_stats
+        return trip_stats
+
+    def memory_usage(self):
+        """
+        Returns the memory used by the data and its index
+
+        Returns:
+            (int) number of bytes used
+        """
+        return int(self.df.memory_usage(index=True, deep=True).sum()
+                   + self._month_order.nbytes + self._weekday_order.nbytes + self._month_weekday_order.nbytes)
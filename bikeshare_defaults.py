@@ -0,0 +1,35 @@
+# The default settings shared by the command line and the modules that analyse the data.  They are kept apart
+# from those modules, which import pandas, so the command line can be set up and the questions asked without
+# waiting for pandas to be imported.
+
+# Directory used for the parsed city data when no other directory is given
+DEFAULT_CACHE_DIR = '.bikeshare_cache'
+
+# Largest number of bytes the city data kept in memory may use
+DEFAULT_MEMORY_CACHE_BYTES = 1024 ** 3
+
+# Number of rows read at a time when a file is read in chunks
+DEFAULT_CHUNK_ROWS = 500000
+
+# Number of values a sketch keeps counts for.  The count of a value is at most the number of trips divided by
+# this number too high.
+DEFAULT_COUNTER_COUNT = 1000
+
+# Largest error of the Count-Min estimates as a fraction of the number of trips, and the chance of a larger error
+DEFAULT_EPSILON = 0.0001
+DEFAULT_DELTA = 0.01
+
+# Largest error of the trip duration quantiles read from the trip duration sketch, relative to the true value
+SKETCH_RELATIVE_ACCURACY = 0.01
+
+# Resolutions the trips of a range of dates can be rolled up to, and the one used when none is given
+ROLLUP_RESOLUTIONS = ('hour', 'day', 'week', 'month')
+DEFAULT_ROLLUP_RESOLUTION = 'day'
+
+# Formats the statistics can be written in
+JSON_FORMAT = 'json'
+CSV_FORMAT = 'csv'
+REPORT_FORMATS = (JSON_FORMAT, CSV_FORMAT)
+
+# Output name to use to write to the standard output
+STANDARD_OUTPUT = '-'
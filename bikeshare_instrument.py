@@ -0,0 +1,316 @@
+import functools
+import json
+import sys
+import threading
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, where the peak memory of the process is not recorded
+    resource = None
+
+# Number of functions shown for a profiled stage and of lines shown for a stage whose memory is traced
+PROFILE_LINE_COUNT = 25
+MEMORY_LINE_COUNT = 10
+
+# Separator between the names of nested stages, like "load_data/load_city_frame/read_csv"
+STAGE_SEPARATOR = '/'
+
+MEGABYTE = 1024 * 1024
+
+
+def get_max_rss_mb():
+    """
+    Returns the most memory the process has used so far
+
+    Returns:
+        (float) the peak resident set size in megabytes, or None when it is not available
+    """
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # Linux gives kilobytes and macOS gives bytes
+    return max_rss / (MEGABYTE if sys.platform == 'darwin' else 1024)
+
+
+class NullSpan:
+    """ The span handed out when recording is off, which does nothing so the stages cost almost nothing. """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    def count(self, rows=None, bytes_read=None):
+        pass
+
+
+NULL_SPAN = NullSpan()
+
+
+class Span:
+    """
+    A stage of the work being timed, with the number of rows it handled and bytes it read.  Use it as a
+    context manager around the stage.
+    """
+
+    def __init__(self, recorder, name, rows=None, bytes_read=None):
+        """
+        Args:
+            (Recorder) recorder: the recorder the span is recorded by
+            (str) name: name of the stage
+            (int) rows: number of rows the stage handled, if known when it starts
+            (int) bytes_read: number of bytes the stage read, if known when it starts
+        """
+        self.recorder = recorder
+        self.name = name
+        self.stage = name
+        self.rows = rows
+        self.bytes_read = bytes_read
+        self.start = 0.0
+        self.start_memory = 0
+        self.parent_peak = 0
+        self.child_peak = 0
+        self.profile = None
+        self.started_tracing = False
+
+    def count(self, rows=None, bytes_read=None):
+        """
+        Adds to the rows handled and bytes read by the stage
+
+        Args:
+            (int) rows: number of rows handled, or None
+            (int) bytes_read: number of bytes read, or None
+        """
+        if rows is not None:
+            self.rows = (self.rows or 0) + rows
+        if bytes_read is not None:
+            self.bytes_read = (self.bytes_read or 0) + bytes_read
+
+    def __enter__(self):
+        self.recorder.enter_span(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.recorder.exit_span(self)
+        return False
+
+
+class Recorder:
+    """
+    Records the time, rows, bytes read and memory of the stages of the work as structured records, and can run
+    a chosen stage under cProfile or tracemalloc.  Recording is off until it is configured, and then every
+    stage only costs the check of whether it is on.  Each thread nests its own stages, so stages running at
+    the same time in different threads are not recorded inside each other.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.records = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._output = None
+        self._profile_stage = None
+        self._profile_output = None
+        self._memory_stage = None
+        self._origin = time.perf_counter()
+
+    def configure(self, output=None, profile_stage=None, profile_output=None, memory_stage=None):
+        """
+        Turns recording on
+
+        Args:
+            (str) output: name of a file every record is added to as a JSON line, or None
+            (str) profile_stage: name or full name of a stage to run under cProfile, or None
+            (str) profile_output: name of a file to store the profile in, or None to show the slowest functions
+            (str) memory_stage: name or full name of a stage to trace the memory allocations of, or None
+        """
+        self.close()
+        self.enabled = True
+        self._output = None if output is None else open(output, 'a', encoding='utf-8')
+        self._profile_stage = profile_stage
+        self._profile_output = profile_output
+        self._memory_stage = memory_stage
+        self._origin = time.perf_counter()
+
+    def close(self):
+        """ Closes the records file and turns recording off. """
+        if self._output is not None:
+            self._output.close()
+            self._output = None
+        self.enabled = False
+
+    def span(self, name, rows=None, bytes_read=None):
+        """
+        Returns the span to put around a stage, as a context manager
+
+        Args:
+            (str) name: name of the stage
+            (int) rows: number of rows the stage handles, if known when it starts
+            (int) bytes_read: number of bytes the stage reads, if known when it starts
+        Returns:
+            (Span) the span of the stage, or NULL_SPAN when recording is off
+        """
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name, rows, bytes_read)
+
+    @property
+    def _stack(self):
+        """ The stages the current thread is in, outermost first. """
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _matches(self, stage_name, span):
+        """ Returns whether a stage name given in the options is the name or full name of the span. """
+        return stage_name is not None and stage_name in (span.name, span.stage)
+
+    def enter_span(self, span):
+        """
+        Starts timing a stage, and starts the profiler or memory tracing when it is the chosen stage
+
+        Args:
+            (Span) span: the stage that starts
+        """
+        if self._stack:
+            span.stage = self._stack[-1].stage + STAGE_SEPARATOR + span.name
+        self._stack.append(span)
+
+        if self._matches(self._memory_stage, span) and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            span.started_tracing = True
+        if tracemalloc.is_tracing():
+            # The peak is reset for each stage, so remember the peak of the enclosing stage so far
+            span.start_memory, span.parent_peak = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+        if self._matches(self._profile_stage, span) and not any(outer.profile for outer in self._stack[:-1]):
+            # The profiler is imported only when it is used, to keep it out of the startup time
+            import cProfile
+            span.profile = cProfile.Profile()
+            span.profile.enable()
+
+        span.start = time.perf_counter()
+
+    def exit_span(self, span):
+        """
+        Finishes timing a stage and records it
+
+        Args:
+            (Span) span: the stage that finished, which is the latest one that started
+        """
+        seconds = time.perf_counter() - span.start
+        if span.profile is not None:
+            span.profile.disable()
+
+        record = {'stage': span.stage,
+                  'start': span.start - self._origin,
+                  'seconds': seconds,
+                  'rows': span.rows,
+                  'bytes_read': span.bytes_read,
+                  'rows_per_second': span.rows / seconds if span.rows and seconds else None,
+                  'max_rss_mb': get_max_rss_mb()}
+
+        self._stack.pop()
+        if tracemalloc.is_tracing():
+            peak = max(tracemalloc.get_traced_memory()[1], span.child_peak)
+            record['peak_mb'] = (peak - span.start_memory) / MEGABYTE
+            if self._stack:
+                parent = self._stack[-1]
+                parent.child_peak = max(parent.child_peak, span.parent_peak, peak)
+        if span.started_tracing:
+            self.show_allocations(span, tracemalloc.take_snapshot())
+            tracemalloc.stop()
+        if span.profile is not None:
+            self.show_profile(span)
+
+        with self._lock:
+            self.records.append(record)
+            if self._output is not None:
+                self._output.write(json.dumps(record) + '\n')
+                self._output.flush()
+
+    def show_profile(self, span):
+        """
+        Stores the profile of a stage, or shows its slowest functions on the standard error
+
+        Args:
+            (Span) span: the profiled stage
+        """
+        if self._profile_output is not None:
+            span.profile.dump_stats(self._profile_output)
+            print(f'Stored the profile of {span.stage} in {self._profile_output}', file=sys.stderr)
+            return
+        import pstats
+        print(f'\nProfile of {span.stage}:', file=sys.stderr)
+        pstats.Stats(span.profile, stream=sys.stderr).sort_stats('cumulative').print_stats(PROFILE_LINE_COUNT)
+
+    def show_allocations(self, span, snapshot):
+        """
+        Shows the lines that allocated the most memory still in use at the end of a stage on the standard error
+
+        Args:
+            (Span) span: the traced stage
+            (Snapshot) snapshot: the tracemalloc snapshot taken at the end of the stage
+        """
+        print(f'\nMemory still allocated at the end of {span.stage}:', file=sys.stderr)
+        for statistic in snapshot.statistics('lineno')[:MEMORY_LINE_COUNT]:
+            print(f'  {statistic}', file=sys.stderr)
+
+    def get_summary_lines(self):
+        """
+        Returns a table of the recorded stages, adding up the stages that ran more than once
+
+        Returns:
+            (list) the lines of the table, in the order the stages first finished
+        """
+        totals = {}
+        for record in self.records:
+            total = totals.setdefault(record['stage'], {'calls': 0, 'seconds': 0.0, 'rows': 0, 'bytes_read': 0,
+                                                        'peak_mb': None})
+            total['calls'] += 1
+            total['seconds'] += record['seconds']
+            total['rows'] += record['rows'] or 0
+            total['bytes_read'] += record['bytes_read'] or 0
+            if record.get('peak_mb') is not None:
+                total['peak_mb'] = max(total['peak_mb'] or 0.0, record['peak_mb'])
+
+        lines = ['%-56s  %5s  %9s  %11s  %9s  %12s  %8s' % ('Stage', 'Calls', 'Seconds', 'Rows', 'MB read',
+                                                            'Rows/second', 'Peak MB')]
+        for stage, total in totals.items():
+            rows_per_second = total['rows'] / total['seconds'] if total['rows'] and total['seconds'] else None
+            lines.append('%-56s  %5d  %9.3f  %11s  %9s  %12s  %8s' % (
+                stage, total['calls'], total['seconds'], total['rows'] or '',
+                '%.1f' % (total['bytes_read'] / MEGABYTE) if total['bytes_read'] else '',
+                '%.0f' % rows_per_second if rows_per_second else '',
+                '' if total['peak_mb'] is None else '%.1f' % total['peak_mb']))
+        return lines
+
+    def clear(self):
+        """ Forgets the records kept in memory. """
+        self.records = []
+
+
+# The recorder used by every module
+RECORDER = Recorder()
+
+
+def recorded(function):
+    """
+    Decorates a function so each call is recorded as a stage named after the function
+
+    Args:
+        (function) function: the function to record
+    Returns:
+        (function) the decorated function
+    """
+    @functools.wraps(function)
+    def record_call(*args, **kwargs):
+        with RECORDER.span(function.__name__):
+            return function(*args, **kwargs)
+    return record_call
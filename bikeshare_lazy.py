@@ -0,0 +1,37 @@
+import importlib
+import threading
+
+
+class LazyModule:
+    """
+    Stands in for a module that is only imported the first time one of its attributes is used, or when it is
+    loaded on purpose, for example in a background thread while the user answers the questions.
+    """
+
+    def __init__(self, name):
+        """
+        Args:
+            (str) name: name of the module to import
+        """
+        self._name = name
+        self._module = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        """
+        Imports the module if it was not imported yet
+
+        Returns:
+            the module
+        """
+        with self._lock:
+            if self._module is None:
+                self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attribute_name):
+        # Only called for the attributes of the module, because the stand in's own attributes are found first
+        return getattr(self._module or self.load(), attribute_name)
+
+    def __repr__(self):
+        return f'<lazy module {self._name!r}{"" if self._module is None else " (imported)"}>'
@@ -0,0 +1,192 @@
+import argparse
+import io
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import bikeshare_data
+import bikeshare_stats
+
+# Largest part of a CSV file, in bytes, that one worker reads and aggregates at a time
+DEFAULT_PART_BYTES = 64 * 1024 * 1024
+
+
+def get_default_worker_count():
+    """
+    Returns the number of worker processes to use when none is given
+
+    Returns:
+        (int) the number of CPUs available to this process
+    """
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def split_csv_file(filename, part_count, part_bytes=DEFAULT_PART_BYTES):
+    """
+    Splits a CSV file into byte ranges that each start at the beginning of a line, so every range can be
+    parsed on its own.  Assumes that no value in the file contains a line break.
+
+    Args:
+        (str) filename: name of the CSV file
+        (int) part_count: the least number of ranges to split the file into
+        (int) part_bytes: the largest size of a range, which may increase the number of ranges
+    Returns:
+        (tuple) the header line and a list of (start, end) byte offsets
+    """
+    file_size = os.path.getsize(filename)
+    with open(filename, 'rb') as csv_file:
+        header = csv_file.readline()
+        data_start = csv_file.tell()
+        part_count = max(part_count, -(-(file_size - data_start) // part_bytes), 1)
+
+        # Move each approximate boundary forward to the start of the next line
+        boundaries = [data_start]
+        for part in range(1, part_count):
+            offset = data_start + (file_size - data_start) * part // part_count
+            if offset <= boundaries[-1]:
+                continue
+            csv_file.seek(offset - 1)
+            csv_file.readline()
+            if csv_file.tell() < file_size and csv_file.tell() > boundaries[-1]:
+                boundaries.append(csv_file.tell())
+        boundaries.append(file_size)
+
+    return header, list(zip(boundaries[:-1], boundaries[1:]))
+
+
+def aggregate_byte_range(filename, header, start, end, month_no=None, weekday=None, quantile_sketch=False,
+                         distributions=False):
+    """
+    Parses a byte range of a CSV file and computes the counts and sums for a month and day of week.
+    This runs in the worker processes.
+
+    Args:
+        (str) filename: name of the CSV file
+        (bytes) header: the header line of the file
+        (int) start: offset of the first byte of the range
+        (int) end: offset just past the last byte of the range
+        (int) month_no: number of the month (1 for January), or None for all the months
+        (int) weekday: day of the week (0 for Monday), or None for all the days
+        (bool) quantile_sketch: True to keep only the sketch of the trip durations
+        (bool) distributions: True to count the trip duration sketch of every month, day, hour and user type
+    Returns:
+        (TripAggregates) the counts and sums for the selected rows in the range
+    """
+    with open(filename, 'rb') as csv_file:
+        csv_file.seek(start)
+        data = csv_file.read(end - start)
+
+    df = bikeshare_data.read_stats_columns(io.BytesIO(header + data))
+    df = bikeshare_data.filter_trips(bikeshare_data.prepare_trip_data(df), month_no, weekday)
+    return bikeshare_stats.TripAggregates.from_frame(df, quantile_sketch=quantile_sketch, distributions=distributions)
+
+
+def merge_in_order(partial_aggregates, **aggregates_options):
+    """
+    Merges the counts and sums of consecutive parts of a file, in file order
+
+    Args:
+        (iterable) partial_aggregates: the TripAggregates of each part, in file order
+        aggregates_options: the arguments the parts were computed with
+    Returns:
+        (TripAggregates) the counts and sums for the whole file
+    """
+    aggregates = bikeshare_stats.TripAggregates(**aggregates_options)
+    for partial in partial_aggregates:
+        aggregates.merge(partial)
+    return aggregates
+
+
+def aggregate_cities(filenames, month_no=None, weekday=None, worker_count=None, part_bytes=DEFAULT_PART_BYTES,
+                     quantile_sketch=False, distributions=False):
+    """
+    Computes the counts and sums for a month and day of week for several CSV files at the same time.  Every
+    file is split into byte ranges that are parsed and aggregated by a pool of worker processes, and the
+    results of each file are merged in file order.
+
+    Args:
+        (list) filenames: names of the CSV files
+        (int) month_no: number of the month (1 for January), or None for all the months
+        (int) weekday: day of the week (0 for Monday), or None for all the days
+        (int) worker_count: number of worker processes, defaults to the number of CPUs
+        (int) part_bytes: the largest byte range a worker parses at a time
+        (bool) quantile_sketch: True to keep only the sketch of the trip durations
+        (bool) distributions: True to count the trip duration sketch of every month, day, hour and user type
+    Returns:
+        (dict) the TripAggregates of each file, by file name
+    """
+    worker_count = worker_count or get_default_worker_count()
+    with ProcessPoolExecutor(max_workers=worker_count) as executor:
+        futures = {}
+        for filename in filenames:
+            header, ranges = split_csv_file(filename, worker_count, part_bytes)
+            futures[filename] = [executor.submit(aggregate_byte_range, filename, header, start, end, month_no, weekday,
+                                                 quantile_sketch, distributions)
+                                 for start, end in ranges]
+
+        return {filename: merge_in_order((future.result() for future in file_futures),
+                                         quantile_sketch=quantile_sketch, distributions=distributions)
+                for filename, file_futures in futures.items()}
+
+
+def aggregate_file(filename, month_no=None, weekday=None, worker_count=None, part_bytes=DEFAULT_PART_BYTES,
+                   quantile_sketch=False, distributions=False):
+    """
+    Computes the counts and sums for a month and day of week for a CSV file using a pool of worker processes
+
+    Args:
+        (str) filename: name of the CSV file
+        (int) month_no: number of the month (1 for January), or None for all the months
+        (int) weekday: day of the week (0 for Monday), or None for all the days
+        (int) worker_count: number of worker processes, defaults to the number of CPUs
+        (int) part_bytes: the largest byte range a worker parses at a time
+        (bool) quantile_sketch: True to keep only the sketch of the trip durations
+        (bool) distributions: True to count the trip duration sketch of every month, day, hour and user type
+    Returns:
+        (TripAggregates) the counts and sums for the selected rows
+    """
+    return aggregate_cities([filename], month_no, weekday, worker_count, part_bytes, quantile_sketch,
+                            distributions)[filename]
+
+
+def benchmark(filenames, worker_counts, part_bytes=DEFAULT_PART_BYTES):
+    """
+    Times the aggregation of CSV files with different numbers of worker processes and shows the speedup
+    compared to the first number of workers
+
+    Args:
+        (list) filenames: names of the CSV files
+        (list) worker_counts: the numbers of worker processes to time
+        (int) part_bytes: the largest byte range a worker parses at a time
+    Returns:
+        (list) a (worker count, seconds, speedup) tuple for each number of workers
+    """
+    results = []
+    print(' Workers   Seconds   Speedup')
+    for worker_count in worker_counts:
+        start_time = time.perf_counter()
+        aggregate_cities(filenames, worker_count=worker_count, part_bytes=part_bytes)
+        seconds = time.perf_counter() - start_time
+        speedup = results[0][1] / seconds if results else 1.0
+        results.append((worker_count, seconds, speedup))
+        print('%8d  %8.2f  %7.2fx' % (worker_count, seconds, speedup))
+    return results
+
+
+def main(args=None):
+    """ Times the parallel aggregation of CSV files with different numbers of worker processes. """
+    parser = argparse.ArgumentParser(description='Benchmark the parallel aggregation of bikeshare CSV files.')
+    parser.add_argument('filenames', nargs='+', help='CSV files to aggregate')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8],
+                        help='numbers of worker processes to time (default: %(default)s)')
+    parser.add_argument('--part-mb', type=int, default=DEFAULT_PART_BYTES // (1024 * 1024),
+                        help='largest part of a file a worker parses at a time (default: %(default)s)')
+    options = parser.parse_args(args)
+    benchmark(options.filenames, options.workers, options.part_mb * 1024 * 1024)
+
+
+if __name__ == "__main__":
+    main()
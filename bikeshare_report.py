@@ -0,0 +1,155 @@
+import csv
+import json
+import math
+import sys
+
+import numpy as np
+
+import bikeshare_defaults
+
+# Formats the statistics can be written in
+JSON_FORMAT = bikeshare_defaults.JSON_FORMAT
+CSV_FORMAT = bikeshare_defaults.CSV_FORMAT
+REPORT_FORMATS = bikeshare_defaults.REPORT_FORMATS
+
+# Output name to use to write to the standard output
+STANDARD_OUTPUT = bikeshare_defaults.STANDARD_OUTPUT
+
+# The TripStats attributes that hold a single value
+SINGLE_STATISTICS = ['trip_count', 'total_duration', 'mean_duration', 'most_common_pair',
+                     'earliest_birth_year', 'latest_birth_year', 'most_common_birth_year']
+
+# The TripStats attributes that hold a value for each month, day, station or other key
+SERIES_STATISTICS = ['month_counts', 'month_counts_by_number', 'day_counts', 'hour_counts', 'user_type_counts',
+                     'user_types_by_month', 'user_types_by_day', 'duration_summary', 'mean_duration_by_month',
+                     'mean_duration_by_day', 'start_station_counts', 'end_station_counts', 'round_trip_counts',
+                     'top_station_pairs', 'gender_counts', 'duration_percentiles', 'duration_histogram',
+                     'duration_percentiles_by_month', 'duration_percentiles_by_day', 'duration_percentiles_by_hour',
+                     'duration_percentiles_by_user_type', 'birth_year_percentiles', 'birth_year_histogram']
+
+# The most common values that are written, by their output name and the column passed to get_most_common
+MOST_COMMON_FIELDS = {'most_common_month': 'month',
+                      'most_common_day_of_week': 'day_of_week',
+                      'most_common_start_hour': 'start_hour',
+                      'most_common_start_station': 'Start Station',
+                      'most_common_end_station': 'End Station'}
+
+# Columns of the CSV output.  Statistics with two part keys, like the station pairs, use both key columns.
+CSV_COLUMNS = ['city', 'month', 'day', 'statistic', 'key', 'key2', 'value']
+
+
+def to_python(value):
+    """
+    Converts a NumPy or pandas value to a plain Python value that can be written as JSON
+
+    Args:
+        value: the value to convert
+    Returns:
+        the int, float, str or None for the value, with missing numbers as None
+    """
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    return value
+
+
+def series_to_records(series):
+    """
+    Converts a series of statistics to a list of records, one per key
+
+    Args:
+        (Pandas Series) series: the statistics, indexed by one or more key columns
+    Returns:
+        (list) a dict per key with the key columns and the value
+    """
+    key_names = [name or 'key' for name in series.index.names]
+    value_name = series.name or 'value'
+    records = []
+    for label, value in series.items():
+        labels = label if isinstance(label, tuple) else (label,)
+        record = {name: to_python(key) for name, key in zip(key_names, labels)}
+        record[value_name] = to_python(value)
+        records.append(record)
+    return records
+
+
+def get_statistics(trip_stats):
+    """
+    Returns all the statistics of a selection as plain Python values
+
+    Args:
+        (TripStats) trip_stats: the statistics for the selected trips
+    Returns:
+        (dict) every statistic by name, as a single value or a list of records
+    """
+    statistics = {name: to_python(getattr(trip_stats, name)) for name in SINGLE_STATISTICS}
+    for name, field_name in MOST_COMMON_FIELDS.items():
+        statistics[name] = to_python(trip_stats.get_most_common(field_name))
+    for name in SERIES_STATISTICS:
+        series = getattr(trip_stats, name)
+        statistics[name] = None if series is None else series_to_records(series)
+    return statistics
+
+
+def get_csv_rows(result):
+    """
+    Returns the CSV rows of the statistics of a selection, one row per value
+
+    Args:
+        (dict) result: the city, month and day names and the statistics of the selection
+    Returns:
+        (list) the rows, each a list of the values for CSV_COLUMNS
+    """
+    selection = [result['city'], result['month'], result['day']]
+    rows = []
+    for name, value in result['statistics'].items():
+        if not isinstance(value, list):
+            rows.append(selection + [name, '', '', value])
+            continue
+        for record in value:
+            # The last value of a record is the statistic and the others are its key
+            *keys, record_value = record.values()
+            keys = keys + [''] * (2 - len(keys))
+            rows.append(selection + [name] + keys + [record_value])
+    return rows
+
+
+def get_report_format(output, report_format=None):
+    """
+    Returns the format to write the statistics in
+
+    Args:
+        (str) output: name of the output file, or STANDARD_OUTPUT
+        (str) report_format: the format that was asked for, or None to use the extension of the output file
+    Returns:
+        (str) JSON_FORMAT or CSV_FORMAT
+    """
+    if report_format is not None:
+        return report_format
+    return CSV_FORMAT if output.lower().endswith('.csv') else JSON_FORMAT
+
+
+def write_report(results, output=STANDARD_OUTPUT, report_format=None):
+    """
+    Writes the statistics of several selections as JSON or CSV
+
+    Args:
+        (list) results: a dict per selection with the city, month and day names and the statistics
+        (str) output: name of the file to write, or STANDARD_OUTPUT
+        (str) report_format: JSON_FORMAT or CSV_FORMAT, or None to use the extension of the output file
+    """
+    report_format = get_report_format(output, report_format)
+    report_file = sys.stdout if output == STANDARD_OUTPUT else open(output, 'w', newline='', encoding='utf-8')
+    try:
+        if report_format == CSV_FORMAT:
+            writer = csv.writer(report_file)
+            writer.writerow(CSV_COLUMNS)
+            for result in results:
+                writer.writerows(get_csv_rows(result))
+        else:
+            json.dump(results, report_file, indent=1)
+            report_file.write('\n')
+    finally:
+        if report_file is not sys.stdout:
+            report_file.close()
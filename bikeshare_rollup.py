@@ -0,0 +1,309 @@
+import numpy as np
+import pandas as pd
+
+import bikeshare_cache
+import bikeshare_data
+import bikeshare_defaults
+import bikeshare_instrument
+
+# Bump this whenever the arrays stored in a rollup file change so that older rollups are rebuilt
+ROLLUP_FORMAT_VERSION = 1
+
+# Ending added to the cache entry name of a city to get the name of its rollup file
+ROLLUP_FILE_SUFFIX = '.rollup.npz'
+
+# The pandas period frequency of each resolution a range can be rolled up to.  Weeks start on Monday.
+RESOLUTION_FREQUENCIES = dict(zip(bikeshare_defaults.ROLLUP_RESOLUTIONS, ['h', 'D', 'W-SUN', 'M']))
+DEFAULT_RESOLUTION = bikeshare_defaults.DEFAULT_ROLLUP_RESOLUTION
+
+# Columns of a rolled up range
+ROLLUP_COLUMNS = ['trips', 'total_duration', 'mean_duration']
+
+
+def parse_range(start, end):
+    """
+    Converts the start and end of a range of times to Timestamps
+
+    Args:
+        (str or Timestamp) start: the start of the range
+        (str or Timestamp) end: the end of the range, not included
+    Returns:
+        (tuple) the start and end Timestamps
+    """
+    start, end = pd.Timestamp(start), pd.Timestamp(end)
+    if start >= end:
+        raise ValueError(f'the start of the range ({start}) must be before its end ({end})')
+    return start, end
+
+
+def to_hours(times):
+    """
+    Returns the number of whole hours since the epoch of times
+
+    Args:
+        (NumPy array) times: datetime64 times
+    Returns:
+        (NumPy array) the hour of each time
+    """
+    return times.astype('datetime64[h]').astype(np.int64)
+
+
+class TripRollup:
+    """
+    The trips and trip durations of a city for every calendar hour from its first trip to its last, with their
+    running totals.  The trips and duration of any range of hours are the difference of two running totals, so
+    a range is rolled up to hours, days, weeks or months without going through the trips or the hours in it.
+    """
+
+    # The arrays stored in a rollup file
+    ARRAY_NAMES = ['trip_counts', 'duration_counts', 'duration_sums']
+
+    def __init__(self):
+        self.row_count = 0
+
+        # Trips, trip durations that are not missing and their total for every hour from first_hour on
+        self.first_hour = 0
+        self.trip_counts = np.zeros(0, dtype=np.int64)
+        self.duration_counts = np.zeros(0, dtype=np.int64)
+        self.duration_sums = np.zeros(0)
+
+        # The running totals, computed the first time a range is queried
+        self._running_totals = None
+
+    @classmethod
+    def from_frame(cls, df):
+        """
+        Computes the rollup of a data frame
+
+        Args:
+            (Pandas DataFrame) df: data frame of bike share data with the time columns added
+        Returns:
+            (TripRollup) the rollup
+        """
+        rollup = cls()
+        rollup.row_count = len(df)
+        times = df['Start Time'].to_numpy()
+        has_time = ~np.isnat(times)
+        if not has_time.any():
+            return rollup
+
+        hours = to_hours(times[has_time])
+        rollup.first_hour = int(hours.min())
+        hour_positions = hours - rollup.first_hour
+        hour_count = int(hour_positions.max()) + 1
+        rollup.trip_counts = np.bincount(hour_positions, minlength=hour_count)
+
+        # Leave out the missing durations
+        durations = df['Trip Duration'].to_numpy()[has_time].astype(np.float64)
+        has_duration = ~np.isnan(durations)
+        rollup.duration_counts = np.bincount(hour_positions, weights=has_duration,
+                                             minlength=hour_count).astype(np.int64)
+        rollup.duration_sums = np.bincount(hour_positions, weights=np.where(has_duration, durations, 0),
+                                           minlength=hour_count)
+        return rollup
+
+    @classmethod
+    def from_csv(cls, filename, chunk_rows=bikeshare_data.DEFAULT_CHUNK_ROWS):
+        """
+        Computes the rollup of a city CSV file, reading it in chunks so only one chunk is in memory at a time
+
+        Args:
+            (str) filename: name of the city CSV file
+            (int) chunk_rows: number of rows to read at a time
+        Returns:
+            (TripRollup) the rollup
+        """
+        rollup = cls()
+        with bikeshare_data.read_stats_columns(filename, chunksize=chunk_rows) as reader:
+            for chunk in reader:
+                rollup.merge(cls.from_frame(bikeshare_data.prepare_trip_data(chunk)))
+        return rollup
+
+    def merge(self, other):
+        """
+        Adds the rollup of other data, which may cover other hours
+
+        Args:
+            (TripRollup) other: the rollup to add
+        """
+        self.row_count += other.row_count
+        if len(other.trip_counts) == 0:
+            return
+        if len(self.trip_counts) == 0:
+            self.first_hour = other.first_hour
+
+        # Widen the hours to cover both rollups, and add the other rollup at its hours
+        first_hour = min(self.first_hour, other.first_hour)
+        end_hour = max(self.first_hour + len(self.trip_counts), other.first_hour + len(other.trip_counts))
+        offset = self.first_hour - first_hour
+        other_offset = other.first_hour - first_hour
+        for name in ('trip_counts', 'duration_counts', 'duration_sums'):
+            values = getattr(self, name)
+            widened = np.zeros(end_hour - first_hour, dtype=values.dtype)
+            widened[offset:offset + len(values)] = values
+            other_values = getattr(other, name)
+            widened[other_offset:other_offset + len(other_values)] += other_values
+            setattr(self, name, widened)
+        self.first_hour = first_hour
+        self._running_totals = None
+
+    def get_running_totals(self):
+        """
+        Returns the trips, trip durations and their total up to the start of every hour and the end of the last
+
+        Returns:
+            (tuple) the running totals of trip_counts, duration_counts and duration_sums, starting at 0
+        """
+        if self._running_totals is None:
+            self._running_totals = tuple(np.concatenate([[0], np.cumsum(values)])
+                                         for values in (self.trip_counts, self.duration_counts, self.duration_sums))
+        return self._running_totals
+
+    def get_positions(self, times):
+        """
+        Returns the position in the running totals of the start of the hour of times, limited to the hours kept
+
+        Args:
+            (NumPy array) times: datetime64 times
+        Returns:
+            (NumPy array) the positions
+        """
+        return np.clip(to_hours(times) - self.first_hour, 0, len(self.trip_counts))
+
+    def query(self, start, end, resolution=DEFAULT_RESOLUTION):
+        """
+        Rolls up the trips and trip durations of a range of times to hours, days, weeks or months.  The first
+        and last period only count the hours inside the range.
+
+        Args:
+            (str or Timestamp) start: the start of the range
+            (str or Timestamp) end: the end of the range, not included
+            (str) resolution: one of RESOLUTION_FREQUENCIES
+        Returns:
+            (Pandas DataFrame) the trips, total duration and mean duration of every period of the range
+        """
+        start, end = parse_range(start, end)
+        if resolution not in RESOLUTION_FREQUENCIES:
+            raise ValueError(f'"{resolution}" is not one of the resolutions: {", ".join(RESOLUTION_FREQUENCIES)}')
+
+        # Each period is the difference of the running totals at its two ends
+        frequency = RESOLUTION_FREQUENCIES[resolution]
+        periods = pd.period_range(start.to_period(frequency), (end - pd.Timedelta(1)).to_period(frequency),
+                                  freq=frequency, name=resolution)
+        bounds = np.concatenate([periods.start_time.to_numpy(dtype='datetime64[ns]')[1:],
+                                 [end.to_datetime64()]])
+        positions = self.get_positions(np.concatenate([[start.to_datetime64()], bounds]))
+        trips, duration_counts, duration_sums = (np.diff(running_totals[positions])
+                                                 for running_totals in self.get_running_totals())
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean_durations = np.where(duration_counts > 0, duration_sums / duration_counts, np.nan)
+        return pd.DataFrame({'trips': trips, 'total_duration': duration_sums, 'mean_duration': mean_durations},
+                            index=periods, columns=ROLLUP_COLUMNS)
+
+    def get_total(self, start, end):
+        """
+        Returns the trips and trip duration total of a range of times from two running totals
+
+        Args:
+            (str or Timestamp) start: the start of the range
+            (str or Timestamp) end: the end of the range, not included
+        Returns:
+            (tuple) the number of trips and the total trip duration
+        """
+        start, end = parse_range(start, end)
+        positions = self.get_positions(np.array([start.to_datetime64(), end.to_datetime64()]))
+        trips, _, duration_sums = (np.diff(running_totals[positions])[0]
+                                   for running_totals in self.get_running_totals())
+        return int(trips), float(duration_sums)
+
+    def get_time_range(self):
+        """
+        Returns the first and last hour that have trips
+
+        Returns:
+            (tuple) the start of the first and last hour as Timestamps, or None for both without trips
+        """
+        used = np.flatnonzero(self.trip_counts)
+        if len(used) == 0:
+            return None, None
+        return tuple(pd.Timestamp(np.datetime64(int(self.first_hour + hour), 'h')) for hour in used[[0, -1]])
+
+    def add_rows(self, df):
+        """
+        Adds the rows that were appended to the city CSV file the rollup was computed from
+
+        Args:
+            (Pandas DataFrame) df: the prepared rows added to the file
+        """
+        self.merge(TripRollup.from_frame(df))
+
+    def get_meta_fields(self):
+        """
+        Returns the description of the rollup that is stored with its arrays
+
+        Returns:
+            (dict) the number of rows and the hour the arrays start at
+        """
+        return {'row_count': self.row_count, 'first_hour': self.first_hour}
+
+    def set_meta_fields(self, meta):
+        """
+        Sets the description of a rollup that was read from a file
+
+        Args:
+            (dict) meta: the description stored with the arrays, from get_meta_fields
+        """
+        self.row_count = meta['row_count']
+        self.first_hour = meta['first_hour']
+
+
+# Stores the rollups next to the cached data of each city
+ROLLUP_STORE = bikeshare_cache.SummaryStore('rollup', TripRollup, ROLLUP_FILE_SUFFIX, ROLLUP_FORMAT_VERSION)
+
+
+def get_rollup_file(filename, cache_dir=bikeshare_cache.DEFAULT_CACHE_DIR):
+    """
+    Returns the name of the file the rollup of a city CSV file is stored in
+
+    Args:
+        (str) filename: name of the city CSV file
+        (str) cache_dir: directory holding all the cache entries
+    Returns:
+        (str) name of the rollup file
+    """
+    return ROLLUP_STORE.get_file(filename, cache_dir)
+
+
+@bikeshare_instrument.recorded
+def build_rollup(filename, cache_dir=bikeshare_cache.DEFAULT_CACHE_DIR,
+                 chunk_rows=bikeshare_data.DEFAULT_CHUNK_ROWS):
+    """
+    Computes the rollup of a city CSV file and stores it in the cache directory
+
+    Args:
+        (str) filename: name of the city CSV file
+        (str) cache_dir: directory holding all the cache entries, or None to not store the rollup
+        (int) chunk_rows: number of rows to read at a time
+    Returns:
+        (TripRollup) the rollup
+    """
+    return ROLLUP_STORE.build(filename, cache_dir, chunk_rows)
+
+
+@bikeshare_instrument.recorded
+def load_rollup(filename, cache_dir=bikeshare_cache.DEFAULT_CACHE_DIR,
+                chunk_rows=bikeshare_data.DEFAULT_CHUNK_ROWS):
+    """
+    Returns the rollup of a city CSV file, reading it from the cache directory when the file did not change
+    since the rollup was built.  When rows were only added to the file, just those rows are added to the
+    rollup, and otherwise the rollup is built again.
+
+    Args:
+        (str) filename: name of the city CSV file
+        (str) cache_dir: directory holding all the cache entries, or None to always build the rollup
+        (int) chunk_rows: number of rows to read at a time when the rollup is built
+    Returns:
+        (TripRollup) the rollup
+    """
+    return ROLLUP_STORE.load(filename, cache_dir, chunk_rows)
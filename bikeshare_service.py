@@ -0,0 +1,461 @@
+import argparse
+import asyncio
+import json
+import time
+from collections import OrderedDict, deque
+from urllib.parse import parse_qs, urlsplit
+
+import bikeshare_2
+import bikeshare_cache
+import bikeshare_defaults
+import bikeshare_report
+import bikeshare_rollup
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8080
+
+# Number of selection results kept, as ready to send JSON
+DEFAULT_RESULT_CACHE_SIZE = 1024
+
+# Number of latest request latencies kept for each endpoint to compute the percentiles from
+LATENCY_WINDOW = 1000
+LATENCY_PERCENTILES = (50, 90, 99)
+
+# Longest a client may take to send the request line and headers, in seconds
+REQUEST_TIMEOUT = 30
+
+# The statistics each report returns, by the name of the stats function that displays them
+REPORT_STATISTICS = {
+    'time_stats': ['most_common_month', 'most_common_day_of_week', 'most_common_start_hour'],
+    'station_stats': ['most_common_start_station', 'most_common_end_station', 'most_common_pair'],
+    'trip_duration_stats': ['total_duration', 'mean_duration'],
+    'user_stats': ['user_type_counts', 'gender_counts', 'earliest_birth_year', 'latest_birth_year',
+                   'most_common_birth_year'],
+    'additional_time_stats': ['month_counts', 'month_counts_by_number', 'day_counts', 'hour_counts'],
+    'additional_station_stats': ['round_trip_counts', 'start_station_counts', 'end_station_counts',
+                                 'top_station_pairs'],
+    'additional_trip_duration_stats': ['duration_summary', 'mean_duration_by_month', 'mean_duration_by_day'],
+    'additional_user_stats': ['user_types_by_month', 'user_types_by_day'],
+    'distribution_stats': ['duration_percentiles', 'duration_histogram', 'duration_percentiles_by_month',
+                           'duration_percentiles_by_day', 'duration_percentiles_by_hour',
+                           'duration_percentiles_by_user_type', 'birth_year_percentiles', 'birth_year_histogram']}
+
+# Report name that returns every report at once
+ALL_REPORTS = 'all'
+
+HTTP_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+                500: 'Internal Server Error', 503: 'Service Unavailable'}
+
+
+class RequestError(Exception):
+    """ A request that can not be answered, with the HTTP status to answer it with. """
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def get_query_value(query, name, default=None):
+    """
+    Returns a parameter of a query string in lower case
+
+    Args:
+        (dict) query: the query string parameters, as parsed by parse_qs
+        (str) name: name of the parameter
+        default: the value when the parameter is missing, or None when it must be given
+    Returns:
+        (str) the value of the parameter
+    """
+    values = query.get(name)
+    if not values:
+        if default is None:
+            raise RequestError(400, f'the {name} is missing')
+        return default
+    return values[0].strip().lower()
+
+
+def parse_city(query):
+    """
+    Returns the city of a query string
+
+    Args:
+        (dict) query: the query string parameters, as parsed by parse_qs
+    Returns:
+        (str) the city name
+    """
+    city = get_query_value(query, 'city')
+    if city not in bikeshare_2.CITY_DATA:
+        raise RequestError(400, f'"{city}" is not one of the cities: {", ".join(bikeshare_2.CITY_DATA)}')
+    return city
+
+
+def parse_selection(query):
+    """
+    Converts the city, month and day of a query string to the selection they stand for.  They accept the same
+    values as the prompt, and the month and day default to all.
+
+    Args:
+        (dict) query: the query string parameters, as parsed by parse_qs
+    Returns:
+        (tuple) the city name, the month key and the day key
+    """
+    city = parse_city(query)
+    keys = []
+    for name, allowed_values in (('month', bikeshare_2.ALLOWED_MONTH_SELECTION),
+                                 ('day', bikeshare_2.ALLOWED_DAY_SELECTION)):
+        key = bikeshare_2.get_key_for_value(get_query_value(query, name, 'all'), allowed_values)
+        if key == bikeshare_2.NOT_FOUND:
+            raise RequestError(400, f'"{get_query_value(query, name)}" is not a {name}')
+        keys.append(key)
+
+    return city, keys[0], keys[1]
+
+
+class LatencyMetrics:
+    """ The number of requests, errors and latencies of each endpoint. """
+
+    def __init__(self):
+        self._endpoints = {}
+
+    def add(self, endpoint, status, seconds):
+        """
+        Records a request
+
+        Args:
+            (str) endpoint: the endpoint that was asked for
+            (int) status: the HTTP status of the answer
+            (float) seconds: time from reading the request to sending the answer
+        """
+        metrics = self._endpoints.setdefault(endpoint, {'requests': 0, 'errors': 0, 'total_seconds': 0.0,
+                                                        'latencies': deque(maxlen=LATENCY_WINDOW)})
+        metrics['requests'] += 1
+        metrics['errors'] += status >= 400
+        metrics['total_seconds'] += seconds
+        metrics['latencies'].append(seconds)
+
+    def summary(self):
+        """
+        Returns the metrics of every endpoint
+
+        Returns:
+            (dict) the requests, errors, mean and percentile latencies in milliseconds, by endpoint
+        """
+        summary = {}
+        for endpoint, metrics in self._endpoints.items():
+            latencies = sorted(metrics['latencies'])
+            endpoint_summary = {'requests': metrics['requests'],
+                                'errors': metrics['errors'],
+                                'mean_ms': metrics['total_seconds'] / metrics['requests'] * 1000}
+            for percentile in LATENCY_PERCENTILES:
+                position = min(len(latencies) - 1, len(latencies) * percentile // 100)
+                endpoint_summary[f'p{percentile}_ms'] = latencies[position] * 1000
+            summary[endpoint] = endpoint_summary
+        return summary
+
+
+class StatsService:
+    """
+    Answers the statistics of any selection from city data that is loaded once and kept in memory.  The answer
+    for each selection is kept in a least recently used cache until the CSV file changes, and a selection that
+    is being computed is not computed again for the requests that ask for it at the same time.
+    """
+
+    def __init__(self, cache_dir=bikeshare_cache.DEFAULT_CACHE_DIR, result_cache_size=DEFAULT_RESULT_CACHE_SIZE):
+        """
+        Args:
+            (str) cache_dir: directory for the parsed city data, or None to always parse the CSV files
+            (int) result_cache_size: number of selection results to keep
+        """
+        self.cache_dir = cache_dir
+        self.result_cache_size = result_cache_size
+        self.metrics = LatencyMetrics()
+        self.started = time.time()
+        self._results = OrderedDict()
+        self._pending = {}
+        self._rollups = {}
+        self._pending_rollups = {}
+        self.result_hits = 0
+        self.result_misses = 0
+
+    def preload(self):
+        """ Loads the data and the rollup of every city, so no request has to wait for them. """
+        for city in bikeshare_2.CITY_DATA:
+            start_time = time.perf_counter()
+            bikeshare_2.get_city_data(city, self.cache_dir)
+            self.load_rollup(city, bikeshare_cache.get_source_signature(bikeshare_2.CITY_DATA[city]))
+            print(f'Loaded {city} in {time.perf_counter() - start_time:.2f} seconds')
+
+    def load_rollup(self, city, signature):
+        """
+        Loads the rollup of a city and keeps it for the version of the CSV file it was loaded from.  When rows
+        were only added to the file, just those rows are added to the rollup.  This runs in a worker thread.
+
+        Args:
+            (str) city - name of the city
+            (dict) signature - the signature of the CSV file, as returned by get_source_signature
+        Returns:
+            (TripRollup) the rollup
+        """
+        rollup = bikeshare_rollup.load_rollup(bikeshare_2.CITY_DATA[city], self.cache_dir)
+        self._rollups[city] = (rollup, signature)
+        return rollup
+
+    async def get_rollup(self, city):
+        """
+        Returns the rollup of a city, loading it again without blocking the other requests when the CSV file
+        changed since it was loaded
+
+        Args:
+            (str) city - name of the city
+        Returns:
+            (TripRollup) the rollup
+        """
+        signature = bikeshare_cache.get_source_signature(bikeshare_2.CITY_DATA[city])
+        rollup, rollup_signature = self._rollups.get(city, (None, None))
+        if rollup is not None and rollup_signature == signature:
+            return rollup
+
+        # Requests for a rollup that is being loaded wait for the same rollup
+        key = (city, signature['size'], signature['mtime_ns'])
+        if key not in self._pending_rollups:
+            loop = asyncio.get_running_loop()
+            self._pending_rollups[key] = loop.run_in_executor(None, self.load_rollup, city, signature)
+        try:
+            return await asyncio.shield(self._pending_rollups[key])
+        finally:
+            self._pending_rollups.pop(key, None)
+
+    def compute_statistics(self, city, month, day):
+        """
+        Computes all the statistics of a selection.  This runs in a worker thread.
+
+        Args:
+            (str) city - name of the city
+            (int) month - key to the month to filter by, or ALL
+            (int) day - the day of week to filter by, or ALL
+        Returns:
+            (dict) every statistic by name, as plain Python values
+        """
+        city_data = bikeshare_2.get_city_data(city, self.cache_dir)
+        trip_stats = city_data.get_trip_stats(*bikeshare_2.get_selection(month, day), distributions=True)
+        return bikeshare_report.get_statistics(trip_stats)
+
+    async def get_statistics(self, selection):
+        """
+        Returns all the statistics of a selection from the result cache, or computes them without blocking the
+        other requests
+
+        Args:
+            (tuple) selection: the city name, the month key and the day key
+        Returns:
+            (dict) every statistic by name
+        """
+        # The results are kept for the version of the CSV file they were computed from, so the answers change
+        # as soon as rows are added to it.  The results of older versions are left for the cache to evict.
+        signature = bikeshare_cache.get_source_signature(bikeshare_2.CITY_DATA[selection[0]])
+        key = (*selection, signature['size'], signature['mtime_ns'])
+        if key in self._results:
+            self._results.move_to_end(key)
+            self.result_hits += 1
+            return self._results[key]
+
+        # Requests for a selection that is being computed wait for the same result
+        if key not in self._pending:
+            self.result_misses += 1
+            loop = asyncio.get_running_loop()
+            self._pending[key] = loop.run_in_executor(None, self.compute_statistics, *selection)
+        try:
+            statistics = await asyncio.shield(self._pending[key])
+        finally:
+            self._pending.pop(key, None)
+
+        self._results[key] = statistics
+        if len(self._results) > self.result_cache_size:
+            self._results.popitem(last=False)
+        return statistics
+
+    async def answer(self, path, query):
+        """
+        Returns the answer to a request
+
+        Args:
+            (str) path: the path of the request, like /stats/time_stats
+            (dict) query: the query string parameters, as parsed by parse_qs
+        Returns:
+            (dict) the answer, which is sent as JSON
+        """
+        if path == '/health':
+            return {'status': 'ok', 'uptime_seconds': time.time() - self.started}
+        if path == '/metrics':
+            return {'endpoints': self.metrics.summary(),
+                    'result_cache': {'size': len(self._results), 'hits': self.result_hits,
+                                     'misses': self.result_misses},
+                    'memory_cache': bikeshare_cache.MEMORY_CACHE.stats()}
+
+        if path == '/rollup':
+            return await self.answer_rollup(query)
+
+        parts = path.strip('/').split('/')
+        if parts[0] != 'stats' or len(parts) > 2:
+            raise RequestError(404, f'{path} is not /stats, /stats/REPORT, /rollup, /metrics or /health')
+        report = parts[1] if len(parts) == 2 else ALL_REPORTS
+        if report != ALL_REPORTS and report not in REPORT_STATISTICS:
+            raise RequestError(404, f'"{report}" is not one of the reports: {", ".join(REPORT_STATISTICS)}')
+
+        city, month, day = parse_selection(query)
+        statistics = await self.get_statistics((city, month, day))
+        answer = {'city': city,
+                  'month': bikeshare_2.ALLOWED_MONTH_SELECTION[month][bikeshare_2.NAME_IDX],
+                  'day': bikeshare_2.ALLOWED_DAY_SELECTION[day][bikeshare_2.NAME_IDX]}
+        if report == ALL_REPORTS:
+            answer['statistics'] = statistics
+        else:
+            answer['statistics'] = {name: statistics[name] for name in REPORT_STATISTICS[report]}
+        return answer
+
+    async def answer_rollup(self, query):
+        """
+        Returns the trips and trip durations of a city for every period of a range of dates.  Only two running
+        totals are read for each period, so this is answered right away.
+
+        Args:
+            (dict) query: the query string parameters, with the city, start, end and optional resolution
+        Returns:
+            (dict) the answer, which is sent as JSON
+        """
+        city = parse_city(query)
+        start, end = get_query_value(query, 'start'), get_query_value(query, 'end')
+        resolution = get_query_value(query, 'resolution', bikeshare_defaults.DEFAULT_ROLLUP_RESOLUTION)
+        rollup = await self.get_rollup(city)
+        try:
+            periods = rollup.query(start, end, resolution)
+            trips, total_duration = rollup.get_total(start, end)
+        except ValueError as error:
+            raise RequestError(400, str(error))
+
+        return {'city': city, 'start': start, 'end': end, 'resolution': resolution,
+                'trips': trips, 'total_duration': total_duration,
+                'periods': [{resolution: str(period),
+                             **{name: bikeshare_report.to_python(value) for name, value in values.items()}}
+                            for period, values in zip(periods.index, periods.to_dict('records'))]}
+
+    async def handle_connection(self, reader, writer):
+        """
+        Answers the requests of a connection, keeping it open between requests unless the client closes it
+
+        Args:
+            (StreamReader) reader: reads from the client
+            (StreamWriter) writer: writes to the client
+        """
+        try:
+            while True:
+                try:
+                    request_line = await asyncio.wait_for(reader.readline(), REQUEST_TIMEOUT)
+                    headers = {}
+                    while True:
+                        line = await asyncio.wait_for(reader.readline(), REQUEST_TIMEOUT)
+                        if line in (b'\r\n', b'\n', b''):
+                            break
+                        name, _, value = line.decode('latin-1').partition(':')
+                        headers[name.strip().lower()] = value.strip()
+                except asyncio.TimeoutError:
+                    break
+                if not request_line:
+                    break
+
+                keep_alive = await self.handle_request(request_line.decode('latin-1'), headers, writer)
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def handle_request(self, request_line, headers, writer):
+        """
+        Answers one request and records its latency
+
+        Args:
+            (str) request_line: the first line of the request, like "GET /stats?city=chicago HTTP/1.1"
+            (dict) headers: the request headers, with lower case names
+            (StreamWriter) writer: writes to the client
+        Returns:
+            (bool) whether the connection stays open for another request
+        """
+        start_time = time.perf_counter()
+        parts = request_line.split()
+        version = parts[2] if len(parts) == 3 else 'HTTP/1.0'
+        keep_alive = (headers.get('connection', '').lower() != 'close' if version == 'HTTP/1.1'
+                      else headers.get('connection', '').lower() == 'keep-alive')
+
+        endpoint = 'invalid'
+        try:
+            if len(parts) != 3:
+                raise RequestError(400, 'the request line is not "METHOD PATH VERSION"')
+            if parts[0] != 'GET':
+                raise RequestError(405, 'only GET requests are answered')
+            url = urlsplit(parts[1])
+            endpoint = url.path
+            status, answer = 200, await self.answer(url.path, parse_qs(url.query))
+        except RequestError as error:
+            status, answer = error.status, {'error': str(error)}
+        except Exception as error:
+            status, answer = 500, {'error': f'{type(error).__name__}: {error}'}
+
+        body = json.dumps(answer).encode('utf-8')
+        writer.write((f'HTTP/1.1 {status} {HTTP_REASONS[status]}\r\n'
+                      f'Content-Type: application/json\r\n'
+                      f'Content-Length: {len(body)}\r\n'
+                      f'Connection: {"keep-alive" if keep_alive else "close"}\r\n\r\n').encode('latin-1') + body)
+        await writer.drain()
+
+        # Unknown paths are counted together so they can not grow the metrics without limit
+        if status == 404:
+            endpoint = 'not found'
+        self.metrics.add(endpoint, status, time.perf_counter() - start_time)
+        return keep_alive
+
+
+async def serve(service, host=DEFAULT_HOST, port=DEFAULT_PORT):
+    """
+    Loads every city and answers requests until the program is stopped
+
+    Args:
+        (StatsService) service: the service that answers the requests
+        (str) host: address to listen on
+        (int) port: port to listen on
+    """
+    await asyncio.get_running_loop().run_in_executor(None, service.preload)
+    server = await asyncio.start_server(service.handle_connection, host, port)
+    print(f'Answering requests on http://{host}:{port}/stats?city=chicago&month=all&day=all')
+    async with server:
+        await server.serve_forever()
+
+
+def main(args=None):
+    """ Answers the statistics of any city, month and day over HTTP from data loaded once. """
+    parser = argparse.ArgumentParser(description='Answer bikeshare statistics over HTTP as JSON.')
+    parser.add_argument('--host', default=DEFAULT_HOST, help='address to listen on (default: %(default)s)')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help='port to listen on (default: %(default)s)')
+    parser.add_argument('--cache-dir', default=bikeshare_cache.DEFAULT_CACHE_DIR,
+                        help='directory for the parsed city data (default: %(default)s)')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='always parse the CSV files and do not use the cache')
+    parser.add_argument('--memory-cache-mb', type=int,
+                        default=bikeshare_cache.DEFAULT_MEMORY_CACHE_BYTES // (1024 * 1024),
+                        help='memory the loaded city data may use; it should hold every city so none is loaded '
+                             'again (default: %(default)s)')
+    parser.add_argument('--result-cache-size', type=int, default=DEFAULT_RESULT_CACHE_SIZE,
+                        help='number of selection results to keep (default: %(default)s)')
+    options = parser.parse_args(args)
+
+    bikeshare_cache.MEMORY_CACHE.set_max_bytes(options.memory_cache_mb * 1024 * 1024)
+    service = StatsService(None if options.no_cache else options.cache_dir, options.result_cache_size)
+    try:
+        asyncio.run(serve(service, options.host, options.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
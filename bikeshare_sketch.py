@@ -0,0 +1,329 @@
+import numpy as np
+import pandas as pd
+
+import bikeshare_defaults
+import bikeshare_stats
+
+# Number of values a sketch keeps counts for, and the largest error of the Count-Min estimates and the chance of
+# a larger error
+DEFAULT_COUNTER_COUNT = bikeshare_defaults.DEFAULT_COUNTER_COUNT
+DEFAULT_EPSILON = bikeshare_defaults.DEFAULT_EPSILON
+DEFAULT_DELTA = bikeshare_defaults.DEFAULT_DELTA
+
+# Seed of the hash functions of the Count-Min sketches.  Sketches must use the same hash functions to be merged.
+HASH_SEED = 20170601
+
+# Multiplier used to combine the hashes of the start and end stations into the hash of the pair
+PAIR_HASH_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+
+# Number of the most popular values compared when the approximate counts are verified
+VERIFY_TOP_COUNT = 10
+
+
+def hash_labels(labels):
+    """
+    Returns a 64 bit hash of every label that is the same in every chunk and every run
+
+    Args:
+        (Index or array) labels: the text labels
+    Returns:
+        (NumPy array) the uint64 hash of each label
+    """
+    return pd.util.hash_array(np.asarray(labels, dtype=object))
+
+
+def combine_hashes(start_hashes, end_hashes):
+    """
+    Returns the hash of each start and end station pair
+
+    Args:
+        (NumPy array) start_hashes: uint64 hashes of the start stations
+        (NumPy array) end_hashes: uint64 hashes of the end stations
+    Returns:
+        (NumPy array) the uint64 hash of each pair
+    """
+    with np.errstate(over='ignore'):
+        return start_hashes * PAIR_HASH_MULTIPLIER + end_hashes
+
+
+class HeavyHitterSketch:
+    """
+    Approximate counts of the most common values using a fixed amount of memory, whatever the number of
+    distinct values.  A Space-Saving summary keeps counts for the counter_count most common values, and a
+    Count-Min sketch keeps an estimate for every value.  Both only ever count too high, so the smaller of the two
+    is used.  Sketches of consecutive parts of the data can be merged.
+    """
+
+    def __init__(self, counter_count=DEFAULT_COUNTER_COUNT, epsilon=DEFAULT_EPSILON, delta=DEFAULT_DELTA):
+        """
+        Args:
+            (int) counter_count: number of values to keep counts for
+            (float) epsilon: largest error of the Count-Min estimates as a fraction of the number of trips
+            (float) delta: the chance that a Count-Min estimate has a larger error
+        """
+        self.counter_count = counter_count
+        self.total = 0
+
+        # The Space-Saving counters -- the hashes of the values, their counts, how much each count may be too
+        # high, and the values themselves.  A value without a counter appears at most missing_bound times.
+        self.keys = np.zeros(0, dtype=np.uint64)
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.errors = np.zeros(0, dtype=np.int64)
+        self.labels = np.zeros(0, dtype=object)
+        self.missing_bound = 0
+
+        # The Count-Min table, with a width that is a power of two so the multiply-shift hashes can be used
+        width_bits = max(int(np.ceil(np.log2(np.e / epsilon))), 1)
+        depth = max(int(np.ceil(np.log(1 / delta))), 1)
+        self.table = np.zeros((depth, 1 << width_bits), dtype=np.int64)
+        self._shift = np.uint64(64 - width_bits)
+        self._multipliers = np.random.default_rng(HASH_SEED).integers(
+            1, np.iinfo(np.int64).max, size=depth, dtype=np.int64).astype(np.uint64) | np.uint64(1)
+
+    def _get_cells(self, keys):
+        """
+        Returns the position in the flattened Count-Min table of every key in every row
+
+        Args:
+            (NumPy array) keys: uint64 hashes of the values
+        Returns:
+            (NumPy array) the positions, one row per table row
+        """
+        with np.errstate(over='ignore'):
+            columns = (self._multipliers[:, np.newaxis] * keys[np.newaxis, :]) >> self._shift
+        rows = np.arange(self.table.shape[0])[:, np.newaxis] * self.table.shape[1]
+        return rows + columns.astype(np.int64)
+
+    def add(self, keys, counts, get_labels):
+        """
+        Adds the exact counts of the distinct values of a part of the data
+
+        Args:
+            (NumPy array) keys: uint64 hashes of the distinct values
+            (NumPy array) counts: the number of times each value appears
+            (function) get_labels: function returning the values for an array of positions in keys
+        """
+        self.total += int(counts.sum())
+        cells = self._get_cells(keys)
+        self.table += np.bincount(cells.ravel(), weights=np.tile(counts, len(self.table)),
+                                  minlength=self.table.size).astype(np.int64).reshape(self.table.shape)
+
+        # Only the values that can keep a counter need their labels
+        order = np.argsort(-counts, kind='stable')
+        missing_bound = int(counts[order[self.counter_count]]) if len(order) > self.counter_count else 0
+        kept = order[:self.counter_count]
+        labels = np.fromiter(get_labels(kept), dtype=object, count=len(kept))
+        self._merge_counters(keys[kept], counts[kept], np.zeros(len(kept), dtype=np.int64), labels, missing_bound)
+
+    def merge(self, other):
+        """
+        Adds the sketch of another part of the data, which must use the same epsilon and delta
+
+        Args:
+            (HeavyHitterSketch) other: the sketch to add
+        """
+        self.total += other.total
+        self.table += other.table
+        self._merge_counters(other.keys, other.counts, other.errors, other.labels, other.missing_bound)
+
+    def _merge_counters(self, keys, counts, errors, labels, missing_bound):
+        """
+        Merges Space-Saving counters into these counters, keeping the counter_count largest counts.  A value
+        without a counter on one side is counted as that side's missing_bound.
+
+        Args:
+            (NumPy array) keys: uint64 hashes of the values
+            (NumPy array) counts: the count of each value
+            (NumPy array) errors: how much each count may be too high
+            (NumPy array) labels: the values
+            (int) missing_bound: the most times a value without a counter appears
+        """
+        own_count = len(self.keys)
+        merged_keys, positions = np.unique(np.concatenate([self.keys, keys]), return_inverse=True)
+        own_positions, other_positions = positions[:own_count], positions[own_count:]
+
+        merged_counts = np.zeros(len(merged_keys), dtype=np.int64)
+        merged_errors = np.zeros(len(merged_keys), dtype=np.int64)
+        merged_labels = np.empty(len(merged_keys), dtype=object)
+        for side_positions, side_counts, side_errors, side_labels, side_bound in (
+                (own_positions, self.counts, self.errors, self.labels, self.missing_bound),
+                (other_positions, counts, errors, labels, missing_bound)):
+            merged_counts += side_bound
+            merged_errors += side_bound
+            merged_counts[side_positions] += side_counts - side_bound
+            merged_errors[side_positions] += side_errors - side_bound
+            merged_labels[side_positions] = side_labels
+
+        dropped_bound = 0
+        order = np.argsort(-merged_counts, kind='stable')
+        if len(order) > self.counter_count:
+            dropped_bound = int(merged_counts[order[self.counter_count]])
+            order = order[:self.counter_count]
+        self.keys, self.counts = merged_keys[order], merged_counts[order]
+        self.errors, self.labels = merged_errors[order], merged_labels[order]
+        self.missing_bound = max(self.missing_bound + missing_bound, dropped_bound)
+
+    def estimate(self, keys):
+        """
+        Returns the Count-Min estimate of the count of each value, which is never too low
+
+        Args:
+            (NumPy array) keys: uint64 hashes of the values
+        Returns:
+            (NumPy array) the estimated counts
+        """
+        return self.table.ravel()[self._get_cells(keys)].min(axis=0)
+
+    def get_counts(self):
+        """
+        Returns the values with counters and their estimated counts, most common first
+
+        Returns:
+            (tuple) the values, their counts and the most each count may be too high
+        """
+        counts = np.minimum(self.counts, self.estimate(self.keys))
+        errors = np.minimum(self.errors, counts)
+        order = np.argsort(-counts, kind='stable')
+        return self.labels[order], counts[order], errors[order]
+
+    def get_error_bound(self):
+        """
+        Returns the most any count of the Space-Saving summary can be too high, the number of counted trips
+        divided by the number of counters
+
+        Returns:
+            (float) the error bound
+        """
+        return self.total / self.counter_count
+
+
+class ApproximateTripAggregates(bikeshare_stats.TripAggregates):
+    """
+    TripAggregates that keep sketches of the stations and the station pairs instead of exact counts, so the
+    memory they use does not grow with the number of stations or pairs
+    """
+
+    def __init__(self, counter_count=DEFAULT_COUNTER_COUNT, epsilon=DEFAULT_EPSILON, delta=DEFAULT_DELTA,
+                 quantile_sketch=False, distributions=False):
+        """
+        Args:
+            (int) counter_count: number of values each sketch keeps counts for
+            (float) epsilon: largest error of the Count-Min estimates as a fraction of the number of trips
+            (float) delta: the chance that a Count-Min estimate has a larger error
+            (bool) quantile_sketch: True to keep only the sketch of the trip durations
+            (bool) distributions: True to count the trip duration sketch of every month, day, hour and user type
+        """
+        super().__init__(quantile_sketch, distributions)
+        self.start_station_sketch = HeavyHitterSketch(counter_count, epsilon, delta)
+        self.end_station_sketch = HeavyHitterSketch(counter_count, epsilon, delta)
+        self.round_trip_sketch = HeavyHitterSketch(counter_count, epsilon, delta)
+        self.pair_sketch = HeavyHitterSketch(counter_count, epsilon, delta)
+
+    def _aggregate_stations(self, df):
+        """
+        Adds the trips per start station, end station, round trip station, and start and end station pair to
+        the sketches
+
+        Args:
+            (Pandas DataFrame) df: data frame of bike share data
+        """
+        start_codes, end_codes, stations = bikeshare_stats.get_station_codes(df)
+        station_count = len(stations)
+        station_hashes = hash_labels(stations)
+        station_labels = stations.to_numpy(dtype=object)
+        round_trip_codes = np.where(start_codes == end_codes, start_codes, -1)
+
+        for sketch, codes in ((self.start_station_sketch, start_codes),
+                              (self.end_station_sketch, end_codes),
+                              (self.round_trip_sketch, round_trip_codes)):
+            counts = np.bincount(codes[codes >= 0], minlength=station_count)
+            present = np.flatnonzero(counts)
+            sketch.add(station_hashes[present], counts[present], lambda kept: station_labels[present[kept]])
+
+        pair_keys, pair_counts = bikeshare_stats.count_station_pairs(start_codes, end_codes, station_count)
+        pair_starts, pair_ends = np.divmod(pair_keys, bikeshare_stats.PAIR_KEY_BASE)
+        self.pair_sketch.add(combine_hashes(station_hashes[pair_starts], station_hashes[pair_ends]), pair_counts,
+                             lambda kept: zip(station_labels[pair_starts[kept]], station_labels[pair_ends[kept]]))
+
+    def merge(self, other):
+        """
+        Adds the counts, sums and sketches of the data that follows this data
+
+        Args:
+            (ApproximateTripAggregates) other: the counts, sums and sketches to add
+        """
+        super().merge(other)
+        self.start_station_sketch.merge(other.start_station_sketch)
+        self.end_station_sketch.merge(other.end_station_sketch)
+        self.round_trip_sketch.merge(other.round_trip_sketch)
+        self.pair_sketch.merge(other.pair_sketch)
+
+
+def make_sketch_counts(sketch, name):
+    """
+    Returns the approximate counts of a sketch the way value_counts shows counts
+
+    Args:
+        (HeavyHitterSketch) sketch: the sketch
+        (str) name: name of the column the values come from
+    Returns:
+        (Pandas Series) the counts of the values with counters, most common first
+    """
+    labels, counts, _ = sketch.get_counts()
+    return pd.Series(counts, index=pd.Index(labels, name=name, dtype=object), name='count')
+
+
+class ApproximateTripStats(bikeshare_stats.TripStats):
+    """
+    TripStats with the station statistics taken from sketches.  The station lists only hold the values with
+    counters, and their counts may be too high by at most the error given in station_errors.
+    """
+
+    def _summarize_stations(self, aggregates):
+        """
+        Derives the station counts and the most popular station pairs from the sketches
+
+        Args:
+            (ApproximateTripAggregates) aggregates: the counts, sums and sketches for the selected trips
+        """
+        self.start_station_ranking = bikeshare_stats.RankedCounts.from_series(
+            make_sketch_counts(aggregates.start_station_sketch, 'Start Station'))
+        self.end_station_ranking = bikeshare_stats.RankedCounts.from_series(
+            make_sketch_counts(aggregates.end_station_sketch, 'End Station'))
+        self.round_trip_counts = make_sketch_counts(aggregates.round_trip_sketch, 'Start Station')
+
+        pairs, counts, _ = aggregates.pair_sketch.get_counts()
+        self.most_common_pair = None
+        if len(counts):
+            self.most_common_pair = min(f'Start: {start}  End: {end}'
+                                        for start, end in pairs[counts == counts.max()])
+        top = slice(0, bikeshare_stats.TOP_STATION_PAIR_COUNT)
+        index = pd.MultiIndex.from_tuples(list(pairs[top]), names=['Start Station', 'End Station'])
+        self.top_station_pairs = pd.Series(counts[top], index=index, name='count')
+
+        # The most each list of counts can be too high
+        self.station_errors = {name: sketch.get_error_bound()
+                               for name, sketch in (('start stations', aggregates.start_station_sketch),
+                                                    ('end stations', aggregates.end_station_sketch),
+                                                    ('round trips', aggregates.round_trip_sketch),
+                                                    ('station pairs', aggregates.pair_sketch))}
+
+
+def compare_counts(exact_counts, approximate_counts, top_count=VERIFY_TOP_COUNT):
+    """
+    Compares approximate counts with the exact counts
+
+    Args:
+        (Pandas Series) exact_counts: the exact counts, most common first
+        (Pandas Series) approximate_counts: the approximate counts, most common first
+        (int) top_count: number of the most common values to compare
+    Returns:
+        (tuple) how many of the top_count most common values were found, how many were compared, and the
+        largest difference between an approximate count and its exact count
+    """
+    exact_top = exact_counts.head(top_count)
+    found = int(exact_top.index.isin(approximate_counts.head(top_count).index).sum())
+    exact_values = exact_counts.reindex(approximate_counts.index, fill_value=0)
+    differences = (approximate_counts.to_numpy() - exact_values.to_numpy())
+    largest_difference = int(np.abs(differences).max()) if len(differences) else 0
+    return found, len(exact_top), largest_difference
@@ -0,0 +1,1055 @@
+import numpy as np
+import pandas as pd
+
+import bikeshare_defaults
+import bikeshare_instrument
+
+# Names pandas uses for the months (by month number, 1 for January) and the number of hours in a day
+MONTH_NAMES = np.array(['', 'January', 'February', 'March', 'April', 'May', 'June', 'July', 'August',
+                        'September', 'October', 'November', 'December'], dtype=object)
+MONTH_COUNT = len(MONTH_NAMES)
+HOUR_COUNT = 24
+
+# Names pandas uses for the days of the week, in the order the day of week categories are sorted
+DAY_NAMES = pd.Index(sorted(['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']))
+DAY_COUNT = len(DAY_NAMES)
+
+# Types of the month number and start hour columns
+MONTH_NO_DTYPE = np.int8
+HOUR_DTYPE = np.int8
+
+# Number of the most popular start and end station pairs that are kept
+TOP_STATION_PAIR_COUNT = 10
+
+# Largest number of possible station pairs that are counted with an array holding every pair; beyond that
+# only the pairs that appear are counted
+MAX_DENSE_PAIR_COUNT = 2 ** 24
+
+# Station pairs are stored as start station code * PAIR_KEY_BASE + end station code
+PAIR_KEY_BASE = 2 ** 32
+
+# Summary statistics of the trip duration, in the order describe() shows them, and the quantiles it uses
+DURATION_SUMMARY_INDEX = ['count', 'mean', 'std', 'min', '25%', '50%', '75%', 'max']
+SUMMARY_QUANTILES = (0.25, 0.5, 0.75)
+
+# Percentiles of the trip duration shown for the selection and for each month, day of week, start hour and
+# user type, and of the birth year
+DISTRIBUTION_PERCENTILES = (50, 90, 99)
+DISTRIBUTION_QUANTILES = tuple(percentile / 100 for percentile in DISTRIBUTION_PERCENTILES)
+PERCENTILE_LABELS = [f'p{percentile}' for percentile in DISTRIBUTION_PERCENTILES]
+
+# Trip durations are also counted in buckets whose bounds grow by SKETCH_GAMMA, as a DDSketch does, so a
+# quantile read from the bucket counts is within SKETCH_RELATIVE_ACCURACY of the true value and the bucket
+# counts of parts of the data simply add up.  Bucket 0 holds the durations under SKETCH_MIN_DURATION and the
+# last bucket the durations of SKETCH_MAX_DURATION and over.
+SKETCH_RELATIVE_ACCURACY = bikeshare_defaults.SKETCH_RELATIVE_ACCURACY
+SKETCH_GAMMA = (1 + SKETCH_RELATIVE_ACCURACY) / (1 - SKETCH_RELATIVE_ACCURACY)
+SKETCH_LOG_GAMMA = np.log(SKETCH_GAMMA)
+SKETCH_MIN_DURATION = 1
+SKETCH_MAX_DURATION = 1e9
+SKETCH_BUCKET_COUNT = int(np.ceil(np.log(SKETCH_MAX_DURATION / SKETCH_MIN_DURATION) / SKETCH_LOG_GAMMA)) + 1
+
+# The value each bucket stands for, which is within SKETCH_RELATIVE_ACCURACY of every value in the bucket
+SKETCH_VALUES = np.concatenate([[0.0], SKETCH_MIN_DURATION * 2 * SKETCH_GAMMA ** np.arange(1, SKETCH_BUCKET_COUNT)
+                                / (SKETCH_GAMMA + 1)])
+
+# Upper bounds of the bars of the trip duration histogram in seconds, and the label of each bar
+DURATION_HISTOGRAM_EDGES = np.array([300, 600, 900, 1800, 3600, 7200])
+DURATION_HISTOGRAM_LABELS = ['under 5 minutes', '5 to 10 minutes', '10 to 15 minutes', '15 to 30 minutes',
+                             '30 to 60 minutes', '1 to 2 hours', '2 hours or more']
+
+# Number of years in each bar of the birth year histogram
+BIRTH_YEAR_BAR_YEARS = 10
+
+
+def get_codes(column):
+    """
+    Returns integer codes for the values of a column, using the categories of category columns
+
+    Args:
+        (Pandas Series) column: column to encode
+    Returns:
+        (tuple) the codes (-1 for missing values) and the values the codes refer to
+    """
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        return column.cat.codes.to_numpy(), column.cat.categories
+    return pd.factorize(column, sort=True)
+
+
+def make_counts(counts, labels, name):
+    """
+    Returns the counts as value_counts would -- most common first, and values with the same count in the
+    order that is given, which should be the order the values first appear in
+
+    Args:
+        (NumPy array) counts: the number of times each value appears
+        (Index or array) labels: the values
+        (str) name: name of the column the values come from
+    Returns:
+        (Pandas Series) the counts
+    """
+    counts = pd.Series(counts, index=pd.Index(labels, name=name), name='count')
+    return counts.sort_values(ascending=False, kind='stable')
+
+
+def get_mode(counts):
+    """
+    Returns the most common value from value counts, using the smallest value when several are the most common
+    as mode() does
+
+    Args:
+        (Pandas Series) counts: the number of times each value appears
+    Returns:
+        The most common value, or None if there are no values
+    """
+    if counts.empty:
+        return None
+    return counts.index[counts.to_numpy() == counts.max()].min()
+
+
+class RankedCounts:
+    """
+    Counts of values ranked the way value_counts ranks them -- most common first, and values with the same
+    count in the order they first appear.  Only the ranks that are asked for are sorted: the most common values
+    are picked out with a partial sort, and the sorted ranks grow as later ranks are asked for, so showing the
+    first page of a long list does not sort the whole list.
+    """
+
+    def __init__(self, counts, labels, name):
+        """
+        Args:
+            (NumPy array) counts: the number of times each value appears, in the order the values first appear
+            (Index) labels: the values
+            (str) name: name of the column the values come from
+        """
+        self.counts = np.asarray(counts)
+        self.labels = labels
+        self.name = name
+
+        # One number orders the values: larger counts first, then the values that appear first
+        value_count = len(self.counts)
+        self._keys = (self.counts.max(initial=0) - self.counts).astype(np.int64) * value_count + np.arange(value_count)
+        self._ranked = np.zeros(0, dtype=np.int64)
+        self._series = None
+
+    @classmethod
+    def from_series(cls, counts):
+        """
+        Returns the ranking of counts that are already ranked
+
+        Args:
+            (Pandas Series) counts: the counts indexed by value, most common first
+        Returns:
+            (RankedCounts) the ranking
+        """
+        return cls(counts.to_numpy(), counts.index, counts.index.name)
+
+    def __len__(self):
+        return len(self.counts)
+
+    def _rank(self, stop):
+        """
+        Sorts the values down to a rank, sorting at least twice as many as before so asking for every rank in
+        turn costs about as much as one full sort
+
+        Args:
+            (int) stop: the rank after the last rank needed
+        """
+        if stop <= len(self._ranked):
+            return
+        stop = min(max(stop, 2 * len(self._ranked)), len(self.counts))
+        if stop < len(self.counts):
+            candidates = np.argpartition(self._keys, stop - 1)[:stop]
+        else:
+            candidates = np.arange(len(self.counts))
+        self._ranked = candidates[np.argsort(self._keys[candidates])]
+
+    def get_rows(self, start, stop):
+        """
+        Returns the values and counts of a range of ranks
+
+        Args:
+            (int) start: the first rank, 0 for the most common value
+            (int) stop: the rank after the last one
+        Returns:
+            (tuple) the values and their counts
+        """
+        self._rank(stop)
+        positions = self._ranked[start:stop]
+        return self.labels.take(positions), self.counts[positions]
+
+    def get_mode(self):
+        """
+        Returns the most common value without ranking the values, using the smallest value when several are the
+        most common as mode() does
+
+        Returns:
+            The most common value, or None if there are no values
+        """
+        if len(self.counts) == 0:
+            return None
+        return self.labels[self.counts == self.counts.max()].min()
+
+    def to_series(self):
+        """
+        Returns all the ranked counts as value_counts would
+
+        Returns:
+            (Pandas Series) the counts indexed by value
+        """
+        if self._series is None:
+            labels, counts = self.get_rows(0, len(self.counts))
+            self._series = pd.Series(counts, index=pd.Index(labels, name=self.name), name='count')
+        return self._series
+
+
+def get_appearance_order(codes):
+    """
+    Returns the codes that appear, in the order they first appear
+
+    Args:
+        (NumPy array) codes: codes, -1 for missing values
+    Returns:
+        (NumPy array) the distinct codes that are not missing
+    """
+    return pd.unique(codes[codes >= 0]).astype(np.int64)
+
+
+def merge_appearance_order(first_order, second_order):
+    """
+    Combines the order values first appear in for two consecutive parts of the data
+
+    Args:
+        (NumPy array) first_order: the values in the order they first appear in the first part
+        (NumPy array) second_order: the values in the order they first appear in the second part
+    Returns:
+        (NumPy array) the values in the order they first appear in both parts
+    """
+    return pd.unique(np.concatenate([first_order, second_order])).astype(np.int64)
+
+
+def merge_labels(labels, new_labels):
+    """
+    Adds labels to a list of labels, keeping the position of the labels already in the list
+
+    Args:
+        (Index) labels: the current labels
+        (Index) new_labels: the labels to add
+    Returns:
+        (tuple) the combined labels and the position of each new label in them
+    """
+    if labels.equals(new_labels):
+        return labels, np.arange(len(new_labels))
+    combined = labels.append(new_labels[~new_labels.isin(labels)])
+    return combined, combined.get_indexer(new_labels)
+
+
+def pad(values, length, axis=0):
+    """
+    Pads an array of counts with zeros up to a length along an axis
+
+    Args:
+        (NumPy array) values: the counts
+        (int) length: the length wanted
+        (int) axis: the axis to pad
+    Returns:
+        (NumPy array) the padded counts
+    """
+    missing = length - values.shape[axis]
+    if missing <= 0:
+        return values
+    widths = [(0, 0)] * values.ndim
+    widths[axis] = (0, missing)
+    return np.pad(values, widths)
+
+
+def merge_value_counts(first_counts, second_counts):
+    """
+    Adds two sets of value counts together
+
+    Args:
+        (Pandas Series) first_counts: counts indexed by value
+        (Pandas Series) second_counts: counts indexed by value
+    Returns:
+        (Pandas Series) the combined counts indexed by value, sorted by value
+    """
+    if first_counts.empty:
+        return second_counts.sort_index()
+    if second_counts.empty:
+        return first_counts
+    return pd.concat([first_counts, second_counts]).groupby(level=0).sum()
+
+
+def get_station_codes(df):
+    """
+    Returns the codes of the start and end stations using the same list of stations for both
+
+    Args:
+        (Pandas DataFrame) df: data frame of bike share data
+    Returns:
+        (tuple) the start station codes, the end station codes and the stations
+    """
+    start_codes, stations = get_codes(df['Start Station'])
+    end_codes, end_stations = get_codes(df['End Station'])
+    if not stations.equals(end_stations):
+        stations = stations.union(end_stations)
+        start_codes = stations.get_indexer(df['Start Station'])
+        end_codes = stations.get_indexer(df['End Station'])
+    return start_codes, end_codes, stations
+
+
+def count_station_pairs(start_codes, end_codes, station_count):
+    """
+    Counts the trips for each start and end station pair using a single integer key per pair, so no text
+    is built for the trips
+
+    Args:
+        (NumPy array) start_codes: start station codes, -1 for missing stations
+        (NumPy array) end_codes: end station codes, -1 for missing stations
+        (int) station_count: number of stations the codes refer to
+    Returns:
+        (tuple) the keys of the pairs that appear (start code * PAIR_KEY_BASE + end code) and their counts
+    """
+    has_stations = (start_codes >= 0) & (end_codes >= 0)
+    pair_keys = start_codes[has_stations].astype(np.int64) * station_count + end_codes[has_stations]
+    if station_count * station_count <= MAX_DENSE_PAIR_COUNT:
+        counts = np.bincount(pair_keys, minlength=station_count * station_count)
+        pair_keys = np.flatnonzero(counts)
+        counts = counts[pair_keys]
+    else:
+        pair_keys, counts = np.unique(pair_keys, return_counts=True)
+
+    start_codes, end_codes = np.divmod(pair_keys, station_count)
+    return start_codes * PAIR_KEY_BASE + end_codes, counts
+
+
+def get_top_station_pairs(pair_keys, counts, stations, top_count=TOP_STATION_PAIR_COUNT):
+    """
+    Returns the most common station pairs, most common first and pairs with the same count in station order
+
+    Args:
+        (NumPy array) pair_keys: keys of the pairs
+        (NumPy array) counts: number of trips for each pair
+        (Index) stations: the stations the pair keys refer to
+        (int) top_count: number of pairs to return
+    Returns:
+        (Pandas Series) the number of trips indexed by the start and end station
+    """
+    # Only sort the pairs that can be in the top pairs -- those with at least the count of the top_count-th pair
+    if len(counts) > top_count > 0:
+        threshold = np.partition(counts, len(counts) - top_count)[len(counts) - top_count]
+        candidates = np.flatnonzero(counts >= threshold)
+    else:
+        candidates = np.arange(len(counts))
+    top = candidates[np.lexsort((pair_keys[candidates], -counts[candidates]))][:top_count]
+
+    start_codes, end_codes = np.divmod(pair_keys[top], PAIR_KEY_BASE)
+    index = pd.MultiIndex.from_arrays([stations.take(start_codes), stations.take(end_codes)],
+                                      names=['Start Station', 'End Station'])
+    return pd.Series(counts[top], index=index, name='count')
+
+
+def get_most_common_pair_label(pair_keys, counts, stations):
+    """
+    Returns the most common station pair as text, using the first text in sort order when several pairs
+    are the most common
+
+    Args:
+        (NumPy array) pair_keys: keys of the pairs
+        (NumPy array) counts: number of trips for each pair
+        (Index) stations: the stations the pair keys refer to
+    Returns:
+        (str) the most common pair, or None if there are no pairs
+    """
+    if len(counts) == 0:
+        return None
+    start_codes, end_codes = np.divmod(pair_keys[counts == counts.max()], PAIR_KEY_BASE)
+    return min(f'Start: {start}  End: {end}'
+               for start, end in zip(stations.take(start_codes), stations.take(end_codes)))
+
+
+def interpolate(low_value, high_value, fraction):
+    """
+    Interpolates between two values the way NumPy does for the linear quantile method
+
+    Args:
+        (float or NumPy array) low_value: the value at the lower position
+        (float or NumPy array) high_value: the value at the higher position
+        (float or NumPy array) fraction: how far between the positions the quantile is
+    Returns:
+        (NumPy array) the interpolated value
+    """
+    difference = high_value - low_value
+    return np.where(fraction >= 0.5, high_value - difference * (1 - fraction), low_value + difference * fraction)
+
+
+def get_quantiles(values, counts, quantiles):
+    """
+    Computes quantiles the way NumPy does for the linear quantile method from the number of times each value
+    appears, for one or several groups at once
+
+    Args:
+        (NumPy array) values: the values, sorted
+        (NumPy array) counts: the number of times each value appears, one row per group or a single row
+        (tuple) quantiles: the quantiles to compute, between 0 and 1
+    Returns:
+        (NumPy array) the quantiles of each group, NaN for groups without values, one row per group of counts
+    """
+    counts = np.asarray(counts)
+    if counts.shape[-1] == 0 or len(values) == 0:
+        return np.full(counts.shape[:-1] + (len(quantiles),), np.nan)
+    group_counts = counts.reshape(-1, counts.shape[-1])
+    totals = group_counts.sum(axis=1)
+    positions = np.multiply.outer(totals - 1, quantiles)
+    low_positions = np.floor(positions)
+    high_positions = np.minimum(low_positions + 1, totals[:, np.newaxis] - 1)
+
+    # Shift the running counts of each group past those of the groups before it, so the value at a position
+    # of every group is found with one search
+    group_starts = np.arange(len(group_counts))[:, np.newaxis]
+    shift = totals.max(initial=0) + 1
+    running_counts = (np.cumsum(group_counts, axis=1) + group_starts * shift).ravel()
+    value_positions = []
+    for position in (low_positions, high_positions):
+        found = np.searchsorted(running_counts, position + group_starts * shift, side='right')
+        value_positions.append(np.minimum(found - group_starts * counts.shape[-1], len(values) - 1))
+
+    result = interpolate(values[value_positions[0]], values[value_positions[1]], positions - low_positions)
+    result = np.where(totals[:, np.newaxis] > 0, result, np.nan)
+    return result.reshape(counts.shape[:-1] + (len(quantiles),))
+
+
+def get_duration_buckets(durations):
+    """
+    Returns the sketch bucket of each trip duration
+
+    Args:
+        (NumPy array) durations: trip durations in seconds, without missing values
+    Returns:
+        (NumPy array) the bucket of each duration, between 0 and SKETCH_BUCKET_COUNT - 1
+    """
+    # Durations under SKETCH_MIN_DURATION are raised to just under it, which puts them all in bucket 0.  The
+    # steps work in place to go through the durations as few times as possible.
+    positions = np.maximum(durations.astype(np.float64), SKETCH_MIN_DURATION / SKETCH_GAMMA)
+    np.log(positions, out=positions)
+    positions *= 1 / SKETCH_LOG_GAMMA
+    positions += 1 - np.log(SKETCH_MIN_DURATION) / SKETCH_LOG_GAMMA
+
+    # The positions are not negative, so dropping the fraction rounds them down
+    buckets = positions.astype(np.int64)
+    return np.minimum(buckets, SKETCH_BUCKET_COUNT - 1, out=buckets)
+
+
+def count_duration_buckets(group_codes, group_count, buckets):
+    """
+    Counts the trip durations in each sketch bucket for each group
+
+    Args:
+        (NumPy array) group_codes: the group of each duration, from 0 to group_count - 1
+        (int) group_count: number of groups
+        (NumPy array) buckets: the sketch bucket of each duration
+    Returns:
+        (NumPy array) the counts, one row per group and one column per bucket
+    """
+    keys = group_codes.astype(np.int64, copy=False) * SKETCH_BUCKET_COUNT + buckets
+    return np.bincount(keys, minlength=group_count * SKETCH_BUCKET_COUNT).reshape(group_count, SKETCH_BUCKET_COUNT)
+
+
+def summarize_value_counts(value_counts, name):
+    """
+    Computes the same summary statistics describe() shows from the number of times each value appears
+
+    Args:
+        (Pandas Series) value_counts: the number of times each value appears, indexed by value
+        (str) name: name of the column
+    Returns:
+        (Pandas Series) the count, mean, standard deviation, minimum, quartiles and maximum
+    """
+    values = value_counts.index.to_numpy(dtype=np.float64)
+    counts = value_counts.to_numpy()
+    order = np.argsort(values, kind='stable')
+    values, counts = values[order], counts[order]
+    total_count = counts.sum()
+    if total_count == 0:
+        return pd.Series([0.0] + [np.nan] * 7, index=DURATION_SUMMARY_INDEX, name=name)
+
+    mean = values.dot(counts) / total_count
+    std = np.sqrt(((values - mean) ** 2).dot(counts) / (total_count - 1)) if total_count > 1 else np.nan
+
+    quantiles = list(get_quantiles(values, counts, SUMMARY_QUANTILES))
+    return pd.Series([float(total_count), mean, std, values[0]] + quantiles + [values[-1]],
+                     index=DURATION_SUMMARY_INDEX, name=name)
+
+
+def summarize_duration_sketch(bucket_counts, count, total, squares, minimum, maximum, name):
+    """
+    Computes the summary statistics describe() shows from the trip duration sketch, with the quartiles read
+    from the sketch buckets and the other statistics exact
+
+    Args:
+        (NumPy array) bucket_counts: the number of durations in each sketch bucket
+        (int) count: number of durations
+        (float) total: sum of the durations
+        (float) squares: sum of the squares of the durations
+        (float) minimum: the shortest duration
+        (float) maximum: the longest duration
+        (str) name: name of the column
+    Returns:
+        (Pandas Series) the count, mean, standard deviation, minimum, quartiles and maximum
+    """
+    if count == 0:
+        return pd.Series([0.0] + [np.nan] * 7, index=DURATION_SUMMARY_INDEX, name=name)
+
+    mean = total / count
+    std = np.sqrt(max(squares - total * mean, 0) / (count - 1)) if count > 1 else np.nan
+    quantiles = list(np.clip(get_quantiles(SKETCH_VALUES, bucket_counts, SUMMARY_QUANTILES), minimum, maximum))
+    return pd.Series([float(count), mean, std, minimum] + quantiles + [maximum], index=DURATION_SUMMARY_INDEX,
+                     name=name)
+
+
+def make_percentiles_by_group(quantiles, group_labels, group_name, name):
+    """
+    Returns the percentiles of each group that has values
+
+    Args:
+        (NumPy array) quantiles: the DISTRIBUTION_QUANTILES of each group, one row per group
+        (Index or array) group_labels: the label of each row of the quantiles
+        (str) group_name: name of the group column
+        (str) name: name of the column the percentiles are of
+    Returns:
+        (Pandas Series) the percentiles indexed by the group and the percentile
+    """
+    used_groups = ~np.isnan(quantiles[:, 0])
+    group_labels = pd.Index(group_labels)[used_groups]
+    index = pd.MultiIndex.from_product([group_labels, PERCENTILE_LABELS], names=[group_name, 'percentile'])
+    return pd.Series(quantiles[used_groups].ravel(), index=index, name=name)
+
+
+class TripAggregates:
+    """
+    Counts and sums about trips that can be computed for parts of the data -- like the chunks of a file that
+    is too large to load at once -- and then merged into the counts and sums for all the data.  Text values
+    are kept as codes into lists of labels that grow as new values are found.
+    """
+
+    def __init__(self, quantile_sketch=False, distributions=False):
+        """
+        Args:
+            (bool) quantile_sketch: True to keep only the sketch of the trip durations instead of the number of
+                times each duration appears, so the memory used does not grow with the number of durations
+            (bool) distributions: True to count the trip duration sketch of every month, day of week, start hour
+                and user type, for their trip duration percentiles.  The sketch is always counted when it is
+                the only record of the trip durations.
+        """
+        self.row_count = 0
+
+        # Trips and trip durations for every month, day of week, start hour and user type.  Missing user types
+        # are kept in slot 0 of the user type dimension.
+        self.user_types = pd.Index([], dtype=object)
+        self.cell_counts = np.zeros((MONTH_COUNT, DAY_COUNT, HOUR_COUNT, 1), dtype=np.int64)
+        self.cell_duration_sums = np.zeros(self.cell_counts.shape)
+        self.cell_duration_counts = np.zeros(self.cell_counts.shape, dtype=np.int64)
+
+        # The order the months, days, hours and user type slots first appear in
+        self.month_order = self.day_order = self.hour_order = self.user_order = np.zeros(0, dtype=np.int64)
+
+        # Trip durations
+        self.total_duration = 0
+        self.duration_count = 0
+        self.duration_counts = None if quantile_sketch else pd.Series([], dtype=np.int64)
+        self.total_squared_duration = 0.0
+        self.min_duration = self.max_duration = np.nan
+        self.duration_histogram_counts = np.zeros(len(DURATION_HISTOGRAM_EDGES) + 1, dtype=np.int64)
+
+        # Sketch bucket counts of the trip durations for every month, day of week, start hour and user type slot,
+        # or None when they are not counted
+        self.month_duration_buckets = self.day_duration_buckets = None
+        self.hour_duration_buckets = self.user_duration_buckets = None
+        if quantile_sketch or distributions:
+            self.month_duration_buckets = np.zeros((MONTH_COUNT, SKETCH_BUCKET_COUNT), dtype=np.int64)
+            self.day_duration_buckets = np.zeros((DAY_COUNT, SKETCH_BUCKET_COUNT), dtype=np.int64)
+            self.hour_duration_buckets = np.zeros((HOUR_COUNT, SKETCH_BUCKET_COUNT), dtype=np.int64)
+            self.user_duration_buckets = np.zeros((1, SKETCH_BUCKET_COUNT), dtype=np.int64)
+
+        # Stations, indexed by the position of the station in the stations list
+        self.stations = pd.Index([], dtype=object)
+        self.start_station_counts = np.zeros(0, dtype=np.int64)
+        self.end_station_counts = np.zeros(0, dtype=np.int64)
+        self.round_trip_counts = np.zeros(0, dtype=np.int64)
+        self.start_station_order = self.end_station_order = self.round_trip_order = np.zeros(0, dtype=np.int64)
+        self.pair_keys = np.zeros(0, dtype=np.int64)
+        self.pair_counts = np.zeros(0, dtype=np.int64)
+
+        # Genders and birth years, for the cities that have them
+        self.has_genders = False
+        self.genders = pd.Index([], dtype=object)
+        self.gender_counts = np.zeros(0, dtype=np.int64)
+        self.gender_order = np.zeros(0, dtype=np.int64)
+        self.has_birth_years = False
+        self.birth_year_counts = pd.Series([], dtype=np.int64)
+
+    @classmethod
+    def from_frame(cls, df, **options):
+        """
+        Computes the counts and sums for a data frame
+
+        Args:
+            (Pandas DataFrame) df: data frame of bike share data with the time columns added
+            options: arguments for the constructor of subclasses that take any
+        Returns:
+            (TripAggregates) the counts and sums
+        """
+        aggregates = cls(**options)
+        aggregates.row_count = len(df)
+        aggregates._aggregate_cells(df)
+        aggregates._aggregate_durations(df)
+        aggregates._aggregate_stations(df)
+        aggregates._aggregate_demographics(df)
+        return aggregates
+
+    def _aggregate_cells(self, df):
+        """
+        Counts the trips and sums the trip durations for every month, day of week, start hour and user type, and
+        when the sketch is kept, counts the trip durations in the sketch buckets of each of them
+
+        Args:
+            (Pandas DataFrame) df: data frame of bike share data
+        """
+        months = df['month_no'].to_numpy().astype(np.int64)
+        day_codes, day_names = get_codes(df['day_of_week'])
+        day_codes = DAY_NAMES.get_indexer(day_names)[day_codes]
+        hours = df['start_hour'].to_numpy().astype(np.int64)
+        user_codes, self.user_types = get_codes(df['User Type'])
+
+        shape = (MONTH_COUNT, DAY_COUNT, HOUR_COUNT, len(self.user_types) + 1)
+        size = int(np.prod(shape))
+        cell_keys = np.ravel_multi_index((months, day_codes, hours, user_codes + 1), shape)
+        self.cell_counts = np.bincount(cell_keys, minlength=size).reshape(shape)
+
+        # Sum the durations in the same cells, leaving out missing durations
+        durations = df['Trip Duration'].to_numpy()
+        if durations.dtype.kind == 'f':
+            has_duration = ~np.isnan(durations)
+            durations = np.where(has_duration, durations, 0)
+            self.cell_duration_counts = np.bincount(cell_keys, weights=has_duration,
+                                                    minlength=size).astype(np.int64).reshape(shape)
+        else:
+            self.cell_duration_counts = self.cell_counts.copy()
+        self.cell_duration_sums = np.bincount(cell_keys, weights=durations, minlength=size).reshape(shape)
+
+        # The buckets of the durations are found once and counted for the month and user type slot pairs and the
+        # day and hour pairs, so the trips are only gone through twice
+        if self.month_duration_buckets is not None:
+            if durations.dtype.kind == 'f':
+                months, day_codes, hours, user_codes = (codes[has_duration]
+                                                        for codes in (months, day_codes, hours, user_codes))
+                durations = durations[has_duration]
+            buckets = get_duration_buckets(durations)
+            slot_count = len(self.user_types) + 1
+            month_user_buckets = count_duration_buckets(
+                months * slot_count + user_codes + 1, MONTH_COUNT * slot_count,
+                buckets).reshape(MONTH_COUNT, slot_count, SKETCH_BUCKET_COUNT)
+            day_hour_buckets = count_duration_buckets(day_codes * HOUR_COUNT + hours, DAY_COUNT * HOUR_COUNT,
+                                                      buckets).reshape(DAY_COUNT, HOUR_COUNT, SKETCH_BUCKET_COUNT)
+            self.month_duration_buckets = month_user_buckets.sum(axis=1)
+            self.user_duration_buckets = month_user_buckets.sum(axis=0)
+            self.day_duration_buckets = day_hour_buckets.sum(axis=1)
+            self.hour_duration_buckets = day_hour_buckets.sum(axis=0)
+
+        # The cells in the order they first appear give the order each month, day, hour and user type first
+        # appear in, which is the order value_counts uses for values with the same count
+        appearing_cells = np.unravel_index(pd.unique(cell_keys), shape)
+        self.month_order, self.day_order, self.hour_order, self.user_order = (
+            pd.unique(dimension).astype(np.int64) for dimension in appearing_cells)
+
+    def _aggregate_durations(self, df):
+        """
+        Sums the trip durations, counts them in the histogram bars and, unless only the sketch is kept, counts
+        how many times each duration appears
+
+        Args:
+            (Pandas DataFrame) df: data frame of bike share data
+        """
+        durations = df['Trip Duration']
+        self.total_duration = durations.sum()
+        self.duration_count = int(durations.count())
+
+        # The other duration statistics come from the distinct durations when they are counted, as there are
+        # usually far fewer of them than trips
+        if self.duration_counts is not None:
+            self.duration_counts = durations.value_counts(sort=False).sort_index()
+            values = self.duration_counts.index.to_numpy(dtype=np.float64)
+            weights = self.duration_counts.to_numpy()
+        else:
+            values = durations.to_numpy(dtype=np.float64, na_value=np.nan)
+            values = values[~np.isnan(values)]
+            weights = np.ones(len(values), dtype=np.int64)
+        if len(values):
+            self.total_squared_duration = (values * values).dot(weights)
+            self.min_duration, self.max_duration = values.min(), values.max()
+        bars = np.searchsorted(DURATION_HISTOGRAM_EDGES, values, side='right')
+        self.duration_histogram_counts = np.bincount(bars, weights=weights,
+                                                     minlength=len(DURATION_HISTOGRAM_EDGES) + 1).astype(np.int64)
+
+    def _aggregate_stations(self, df):
+        """
+        Counts the trips per start station, end station, round trip station, and start and end station pair
+
+        Args:
+            (Pandas DataFrame) df: data frame of bike share data
+        """
+        start_codes, end_codes, self.stations = get_station_codes(df)
+        station_count = len(self.stations)
+        round_trip_codes = np.where(start_codes == end_codes, start_codes, -1)
+
+        self.start_station_counts = np.bincount(start_codes[start_codes >= 0], minlength=station_count)
+        self.end_station_counts = np.bincount(end_codes[end_codes >= 0], minlength=station_count)
+        self.round_trip_counts = np.bincount(round_trip_codes[round_trip_codes >= 0], minlength=station_count)
+        self.start_station_order = get_appearance_order(start_codes)
+        self.end_station_order = get_appearance_order(end_codes)
+        self.round_trip_order = get_appearance_order(round_trip_codes)
+        self.pair_keys, self.pair_counts = count_station_pairs(start_codes, end_codes, station_count)
+
+    def _aggregate_demographics(self, df):
+        """
+        Counts the genders and birth years when the city has them
+
+        Args:
+            (Pandas DataFrame) df: data frame of bike share data
+        """
+        if 'Gender' in df.columns:
+            self.has_genders = True
+            gender_codes, self.genders = get_codes(df['Gender'])
+            self.gender_counts = np.bincount(gender_codes[gender_codes >= 0], minlength=len(self.genders))
+            self.gender_order = get_appearance_order(gender_codes)
+
+        if 'Birth Year' in df.columns:
+            self.has_birth_years = True
+            self.birth_year_counts = df['Birth Year'].value_counts(sort=False).sort_index()
+
+    def merge(self, other):
+        """
+        Adds the counts and sums of the data that follows this data
+
+        Args:
+            (TripAggregates) other: the counts and sums to add
+        """
+        self.row_count += other.row_count
+
+        # Line up the user type slots of the other data with these slots
+        self.user_types, user_positions = merge_labels(self.user_types, other.user_types)
+        user_slots = np.concatenate([[0], user_positions + 1])
+        self.cell_counts = pad(self.cell_counts, len(self.user_types) + 1, axis=3)
+        self.cell_duration_sums = pad(self.cell_duration_sums, len(self.user_types) + 1, axis=3)
+        self.cell_duration_counts = pad(self.cell_duration_counts, len(self.user_types) + 1, axis=3)
+        self.cell_counts[..., user_slots] += other.cell_counts
+        self.cell_duration_sums[..., user_slots] += other.cell_duration_sums
+        self.cell_duration_counts[..., user_slots] += other.cell_duration_counts
+        self.month_order = merge_appearance_order(self.month_order, other.month_order)
+        self.day_order = merge_appearance_order(self.day_order, other.day_order)
+        self.hour_order = merge_appearance_order(self.hour_order, other.hour_order)
+        self.user_order = merge_appearance_order(self.user_order, user_slots[other.user_order])
+
+        # The sketch only describes all the data when both sides counted it
+        if self.month_duration_buckets is None or other.month_duration_buckets is None:
+            self.month_duration_buckets = self.day_duration_buckets = None
+            self.hour_duration_buckets = self.user_duration_buckets = None
+        else:
+            self.month_duration_buckets += other.month_duration_buckets
+            self.day_duration_buckets += other.day_duration_buckets
+            self.hour_duration_buckets += other.hour_duration_buckets
+            self.user_duration_buckets = pad(self.user_duration_buckets, len(self.user_types) + 1)
+            self.user_duration_buckets[user_slots] += other.user_duration_buckets
+
+        self.total_duration = self.total_duration + other.total_duration
+        self.duration_count += other.duration_count
+        if self.duration_counts is None or other.duration_counts is None:
+            self.duration_counts = None
+        else:
+            self.duration_counts = merge_value_counts(self.duration_counts, other.duration_counts)
+        self.total_squared_duration += other.total_squared_duration
+        self.min_duration = np.fmin(self.min_duration, other.min_duration)
+        self.max_duration = np.fmax(self.max_duration, other.max_duration)
+        self.duration_histogram_counts += other.duration_histogram_counts
+
+        # Line up the stations of the other data with these stations
+        self.stations, station_positions = merge_labels(self.stations, other.stations)
+        for counts_name in ('start_station_counts', 'end_station_counts', 'round_trip_counts'):
+            counts = pad(getattr(self, counts_name), len(self.stations))
+            counts[station_positions] += getattr(other, counts_name)
+            setattr(self, counts_name, counts)
+        for order_name in ('start_station_order', 'end_station_order', 'round_trip_order'):
+            setattr(self, order_name,
+                    merge_appearance_order(getattr(self, order_name), station_positions[getattr(other, order_name)]))
+
+        other_starts, other_ends = np.divmod(other.pair_keys, PAIR_KEY_BASE)
+        pair_keys = np.concatenate([self.pair_keys,
+                                    station_positions[other_starts] * PAIR_KEY_BASE + station_positions[other_ends]])
+        self.pair_keys, pair_positions = np.unique(pair_keys, return_inverse=True)
+        self.pair_counts = np.bincount(pair_positions, weights=np.concatenate([self.pair_counts, other.pair_counts]),
+                                       minlength=len(self.pair_keys)).astype(np.int64)
+
+        if other.has_genders:
+            self.has_genders = True
+            self.genders, gender_positions = merge_labels(self.genders, other.genders)
+            self.gender_counts = pad(self.gender_counts, len(self.genders))
+            self.gender_counts[gender_positions] += other.gender_counts
+            self.gender_order = merge_appearance_order(self.gender_order, gender_positions[other.gender_order])
+        if other.has_birth_years:
+            self.has_birth_years = True
+            self.birth_year_counts = merge_value_counts(self.birth_year_counts, other.birth_year_counts)
+
+
+class TripStats:
+    """
+    All the statistics shown about a selection of trips.  The counts per month, day of week, start hour and
+    user type and the trip duration totals come from a single count of the trips in each combination of those
+    values, so each column is scanned once no matter how many of the statistics are shown.
+    """
+
+    def __init__(self, aggregates):
+        """
+        Args:
+            (TripAggregates) aggregates: the counts and sums for the selected trips
+        """
+        self.trip_count = aggregates.row_count
+        self._summarize_cells(aggregates)
+        self._summarize_durations(aggregates)
+        self._summarize_stations(aggregates)
+        self._summarize_demographics(aggregates)
+        self._summarize_distributions(aggregates)
+
+    def _summarize_cells(self, aggregates):
+        """
+        Derives the counts per month, day of week, start hour and user type from the cell counts
+
+        Args:
+            (TripAggregates) aggregates: the counts and sums for the selected trips
+        """
+        cell_counts = aggregates.cell_counts
+        user_types = aggregates.user_types
+        user_order = aggregates.user_order[aggregates.user_order > 0]
+
+        month_counts = cell_counts.sum(axis=(1, 2, 3))
+        day_counts = cell_counts.sum(axis=(0, 2, 3))
+        hour_counts = cell_counts.sum(axis=(0, 1, 3))
+        user_counts = cell_counts.sum(axis=(0, 1, 2))
+
+        self.month_counts = make_counts(month_counts[aggregates.month_order], MONTH_NAMES[aggregates.month_order],
+                                        'month')
+        self.day_counts = make_counts(day_counts[aggregates.day_order], DAY_NAMES.take(aggregates.day_order),
+                                      'day_of_week')
+        self.hour_counts = make_counts(hour_counts[aggregates.hour_order], aggregates.hour_order.astype(HOUR_DTYPE),
+                                       'start_hour')
+        self.user_type_counts = make_counts(user_counts[user_order], user_types.take(user_order - 1), 'User Type')
+
+        # The trips per month ordered by the month number
+        months_used = np.flatnonzero(month_counts)
+        self.month_counts_by_number = pd.Series(
+            month_counts[months_used],
+            index=pd.MultiIndex.from_arrays([months_used.astype(MONTH_NO_DTYPE), MONTH_NAMES[months_used]],
+                                            names=['month_no', 'month']),
+            name='count')
+
+        # The user types per month and per day of week, most common first within each month or day
+        self.user_types_by_month = self._count_by_group(cell_counts.sum(axis=(1, 2))[:, 1:],
+                                                        np.arange(MONTH_COUNT).astype(MONTH_NO_DTYPE),
+                                                        'month_no', user_types)
+        self.user_types_by_day = self._count_by_group(cell_counts.sum(axis=(0, 2))[:, 1:], DAY_NAMES,
+                                                      'day_of_week', user_types)
+
+    @staticmethod
+    def _count_by_group(group_counts, group_labels, group_name, user_types):
+        """
+        Returns the user type counts within each group as groupby and value_counts would
+
+        Args:
+            (NumPy array) group_counts: the counts with one row per group and one column per user type
+            (Index or array) group_labels: the label of each row of the counts
+            (str) group_name: name of the group column
+            (Index) user_types: the user types
+        Returns:
+            (Pandas Series) the counts indexed by the group and the user type
+        """
+        used_groups = group_counts.sum(axis=1) > 0
+        group_counts = group_counts[used_groups]
+        group_labels = group_labels[used_groups]
+        labels, types, counts = [], [], []
+        for label, row in zip(group_labels, group_counts):
+            used = np.flatnonzero(row)
+            used = used[np.argsort(-row[used], kind='stable')]
+            labels.extend([label] * len(used))
+            types.extend(user_types.take(used))
+            counts.extend(row[used])
+
+        index = pd.MultiIndex.from_arrays([pd.Index(labels, dtype=getattr(group_labels, 'dtype', None)),
+                                           pd.Index(types, dtype=user_types.dtype)],
+                                          names=[group_name, 'User Type'])
+        return pd.Series(np.array(counts, dtype=np.int64), index=index, name='count')
+
+    def _summarize_durations(self, aggregates):
+        """
+        Derives the trip duration total, mean and summary statistics, and the mean per month and day of week
+
+        Args:
+            (TripAggregates) aggregates: the counts and sums for the selected trips
+        """
+        self.total_duration = aggregates.total_duration
+        self.mean_duration = (aggregates.total_duration / aggregates.duration_count
+                              if aggregates.duration_count else np.nan)
+        if aggregates.duration_counts is None:
+            self.duration_summary = summarize_duration_sketch(aggregates.month_duration_buckets.sum(axis=0),
+                                                              aggregates.duration_count, aggregates.total_duration,
+                                                              aggregates.total_squared_duration,
+                                                              aggregates.min_duration, aggregates.max_duration,
+                                                              'Trip Duration')
+        else:
+            self.duration_summary = summarize_value_counts(aggregates.duration_counts, 'Trip Duration')
+
+        month_sums = aggregates.cell_duration_sums.sum(axis=(1, 2, 3))
+        month_counts = aggregates.cell_duration_counts.sum(axis=(1, 2, 3))
+        months_used = np.flatnonzero(month_counts)
+        self.mean_duration_by_month = pd.Series(month_sums[months_used] / month_counts[months_used],
+                                                index=pd.Index(months_used.astype(MONTH_NO_DTYPE), name='month_no'),
+                                                name='Trip Duration')
+
+        day_sums = aggregates.cell_duration_sums.sum(axis=(0, 2, 3))
+        day_counts = aggregates.cell_duration_counts.sum(axis=(0, 2, 3))
+        days_used = np.flatnonzero(day_counts)
+        self.mean_duration_by_day = pd.Series(day_sums[days_used] / day_counts[days_used],
+                                              index=pd.Index(DAY_NAMES.take(days_used), name='day_of_week'),
+                                              name='Trip Duration')
+
+    def _summarize_stations(self, aggregates):
+        """
+        Derives the station counts and the most popular station pairs.  The start and end stations are only
+        ranked as far as they are shown.
+
+        Args:
+            (TripAggregates) aggregates: the counts and sums for the selected trips
+        """
+        stations = aggregates.stations
+        self.start_station_ranking = RankedCounts(aggregates.start_station_counts[aggregates.start_station_order],
+                                                  stations.take(aggregates.start_station_order), 'Start Station')
+        self.end_station_ranking = RankedCounts(aggregates.end_station_counts[aggregates.end_station_order],
+                                                stations.take(aggregates.end_station_order), 'End Station')
+        self.round_trip_counts = make_counts(aggregates.round_trip_counts[aggregates.round_trip_order],
+                                             stations.take(aggregates.round_trip_order), 'Start Station')
+        self.most_common_pair = get_most_common_pair_label(aggregates.pair_keys, aggregates.pair_counts, stations)
+        self.top_station_pairs = get_top_station_pairs(aggregates.pair_keys, aggregates.pair_counts, stations)
+
+    def _summarize_demographics(self, aggregates):
+        """
+        Derives the gender counts and the birth year statistics when the city has them
+
+        Args:
+            (TripAggregates) aggregates: the counts and sums for the selected trips
+        """
+        self.gender_counts = None
+        if aggregates.has_genders:
+            self.gender_counts = make_counts(aggregates.gender_counts[aggregates.gender_order],
+                                             aggregates.genders.take(aggregates.gender_order), 'Gender')
+
+        self.has_birth_years = aggregates.has_birth_years
+        self.earliest_birth_year = self.latest_birth_year = self.most_common_birth_year = None
+        birth_year_counts = aggregates.birth_year_counts
+        if self.has_birth_years and not birth_year_counts.empty:
+            self.earliest_birth_year = birth_year_counts.index.min()
+            self.latest_birth_year = birth_year_counts.index.max()
+            self.most_common_birth_year = get_mode(birth_year_counts)
+
+    def _summarize_distributions(self, aggregates):
+        """
+        Derives the trip duration percentiles and histogram, the trip duration percentiles per month, day of
+        week, start hour and user type from the sketch buckets when they were counted, and the birth year
+        percentiles and histogram
+
+        Args:
+            (TripAggregates) aggregates: the counts and sums for the selected trips
+        """
+        # The percentiles of all the trips are exact unless only the sketch was kept
+        if aggregates.duration_counts is None:
+            percentiles = np.clip(get_quantiles(SKETCH_VALUES, aggregates.month_duration_buckets.sum(axis=0),
+                                                DISTRIBUTION_QUANTILES),
+                                  aggregates.min_duration, aggregates.max_duration)
+        else:
+            percentiles = get_quantiles(aggregates.duration_counts.index.to_numpy(dtype=np.float64),
+                                        aggregates.duration_counts.to_numpy(), DISTRIBUTION_QUANTILES)
+        self.duration_percentiles = pd.Series(percentiles, index=pd.Index(PERCENTILE_LABELS, name='percentile'),
+                                              name='Trip Duration')
+        self.duration_histogram = pd.Series(aggregates.duration_histogram_counts,
+                                            index=pd.Index(DURATION_HISTOGRAM_LABELS, name='Trip Duration'),
+                                            name='count')
+
+        # Every group is read from the sketch in one pass over the bucket counts of that dimension
+        self.duration_percentiles_by_month = self.duration_percentiles_by_day = None
+        self.duration_percentiles_by_hour = self.duration_percentiles_by_user_type = None
+        if aggregates.month_duration_buckets is not None:
+            self.duration_percentiles_by_month, self.duration_percentiles_by_day, \
+                self.duration_percentiles_by_hour, self.duration_percentiles_by_user_type = (
+                    make_percentiles_by_group(get_quantiles(SKETCH_VALUES, bucket_counts, DISTRIBUTION_QUANTILES),
+                                              group_labels, group_name, 'Trip Duration')
+                    for bucket_counts, group_labels, group_name in (
+                        (aggregates.month_duration_buckets, np.arange(MONTH_COUNT).astype(MONTH_NO_DTYPE),
+                         'month_no'),
+                        (aggregates.day_duration_buckets, DAY_NAMES, 'day_of_week'),
+                        (aggregates.hour_duration_buckets, np.arange(HOUR_COUNT).astype(HOUR_DTYPE), 'start_hour'),
+                        (aggregates.user_duration_buckets[1:], aggregates.user_types, 'User Type')))
+
+        self.birth_year_percentiles = self.birth_year_histogram = None
+        birth_year_counts = aggregates.birth_year_counts
+        if self.has_birth_years and not birth_year_counts.empty:
+            birth_years = birth_year_counts.index.to_numpy(dtype=np.float64)
+            self.birth_year_percentiles = pd.Series(
+                get_quantiles(birth_years, birth_year_counts.to_numpy(), DISTRIBUTION_QUANTILES),
+                index=pd.Index(PERCENTILE_LABELS, name='percentile'), name='Birth Year')
+            bars = (birth_years // BIRTH_YEAR_BAR_YEARS * BIRTH_YEAR_BAR_YEARS).astype(np.int64)
+            self.birth_year_histogram = birth_year_counts.groupby(pd.Index(bars, name='Birth Year')).sum()
+
+    @property
+    def start_station_counts(self):
+        """ The trips per start station, most common first. """
+        return self.start_station_ranking.to_series()
+
+    @property
+    def end_station_counts(self):
+        """ The trips per end station, most common first. """
+        return self.end_station_ranking.to_series()
+
+    def get_most_common(self, field_name):
+        """
+        Returns the most common value of a column
+
+        Args:
+            (str) field_name: name of the column, or start_end_dest for the start and end station pair
+        Returns:
+            The most common value
+        """
+        if field_name == 'start_end_dest':
+            return self.most_common_pair
+
+        # The stations are not ranked to find the most common one
+        rankings = {'Start Station': self.start_station_ranking,
+                    'End Station': self.end_station_ranking}
+        if field_name in rankings:
+            return rankings[field_name].get_mode()
+
+        counts = {'month': self.month_counts,
+                  'day_of_week': self.day_counts,
+                  'start_hour': self.hour_counts}
+        return get_mode(counts[field_name])
+
+
+def compute_trip_stats(df, distributions=False):
+    """
+    Computes all the statistics for a data frame
+
+    Args:
+        (Pandas DataFrame) df: data frame of bike share data with the time columns added
+        (bool) distributions: True to also compute the trip duration percentiles per month, day of week, start
+            hour and user type
+    Returns:
+        (TripStats) the statistics
+    """
+    with bikeshare_instrument.RECORDER.span('compute_trip_stats', rows=len(df)):
+        return TripStats(TripAggregates.from_frame(df, distributions=distributions))
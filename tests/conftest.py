@@ -0,0 +1,75 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# The modules are files at the top of the project rather than an installed package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bikeshare_data  # noqa: E402
+
+# Number of trips and stations in the test city
+TRIP_COUNT = 3000
+STATION_COUNT = 40
+
+
+def make_trips(trip_count=TRIP_COUNT, seed=0, first_id=0):
+    """
+    Returns random trips with the columns of the city CSV files, including missing user types, genders and
+    birth years, and a few stations that are far more popular than the rest
+
+    Args:
+        (int) trip_count: number of trips
+        (int) seed: seed of the random numbers
+        (int) first_id: number of the first trip, in the unnamed first column
+    Returns:
+        (Pandas DataFrame) the trips as they are written to a CSV file
+    """
+    rng = np.random.default_rng(seed)
+    stations = np.array([f'Station {number} & Main St' for number in range(STATION_COUNT)], dtype=object)
+    start_times = (pd.Timestamp('2017-01-01')
+                   + pd.to_timedelta(rng.integers(0, 181 * 24 * 3600, trip_count), unit='s'))
+    durations = rng.integers(60, 7200, trip_count)
+
+    user_types = rng.choice(np.array(['Subscriber', 'Customer', 'Dependent', None], dtype=object), trip_count,
+                            p=[0.7, 0.25, 0.01, 0.04])
+    genders = rng.choice(np.array(['Male', 'Female', None], dtype=object), trip_count, p=[0.6, 0.3, 0.1])
+    birth_years = np.where(rng.random(trip_count) < 0.1, np.nan, rng.integers(1940, 2002, trip_count))
+    return pd.DataFrame({'': np.arange(first_id, first_id + trip_count),
+                         'Start Time': start_times.strftime(bikeshare_data.TIMESTAMP_FORMAT),
+                         'End Time': (start_times + pd.to_timedelta(durations, unit='s')).strftime(
+                             bikeshare_data.TIMESTAMP_FORMAT),
+                         'Trip Duration': durations,
+                         'Start Station': stations[np.minimum(rng.zipf(1.6, trip_count), STATION_COUNT) - 1],
+                         'End Station': stations[np.minimum(rng.zipf(1.4, trip_count), STATION_COUNT) - 1],
+                         'User Type': user_types,
+                         'Gender': genders,
+                         'Birth Year': birth_years})
+
+
+def write_trips(path, trips):
+    """
+    Writes trips the way the city CSV files are written
+
+    Args:
+        (Path) path: the CSV file to write
+        (Pandas DataFrame) trips: the trips, as made by make_trips
+    Returns:
+        (str) the name of the file
+    """
+    trips.to_csv(path, index=False)
+    return str(path)
+
+
+@pytest.fixture
+def city_csv(tmp_path):
+    """ A city CSV file of random trips. """
+    return write_trips(tmp_path / 'chicago.csv', make_trips())
+
+
+@pytest.fixture
+def trips(city_csv):
+    """ The trips of the city CSV file, read and prepared the way the program reads them. """
+    return bikeshare_data.read_city_csv(city_csv)
@@ -0,0 +1,28 @@
+import os
+import subprocess
+import sys
+
+# The directory the modules are in
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def get_loaded_modules(code):
+    """ Runs code in a new Python process and returns which of pandas and NumPy it imported. """
+    check = "import sys; print(' '.join(name for name in ('pandas', 'numpy') if name in sys.modules))"
+    result = subprocess.run([sys.executable, '-c', f'{code}\n{check}'], cwd=PROJECT_DIR, capture_output=True,
+                            text=True, check=True)
+    return result.stdout.split()
+
+
+def test_importing_does_not_load_pandas():
+    assert get_loaded_modules('import bikeshare_2') == []
+
+    # The prompt's lookup tables work without the data modules
+    assert get_loaded_modules('import bikeshare_2\n'
+                              "assert bikeshare_2.get_key_for_value('mar', bikeshare_2.ALLOWED_MONTH_SELECTION) == 3\n"
+                              'bikeshare_2.parse_arguments([])') == []
+
+
+def test_data_modules_load_on_first_use():
+    assert get_loaded_modules('import bikeshare_2\n'
+                              'bikeshare_2.bikeshare_stats.TripStats') == ['pandas', 'numpy']
@@ -0,0 +1,132 @@
+import numpy as np
+import pandas as pd
+
+import bikeshare_cache
+import bikeshare_data
+from conftest import make_trips, write_trips
+
+
+def assert_same_frame(cached, parsed):
+    """
+    Checks a frame read from the cache against the frame parsed from the CSV file.  New text values are added to
+    the end of the cached categories, so only the values of the categories are compared, not their order.
+    """
+    pd.testing.assert_frame_equal(cached, parsed, check_categorical=False)
+
+
+def count_parses(monkeypatch):
+    """ Counts the times the whole CSV file is parsed, returning the list the parsed file names are added to. """
+    parsed = []
+    read_city_csv = bikeshare_data.read_city_csv
+
+    def counted_read_city_csv(filename):
+        parsed.append(filename)
+        return read_city_csv(filename)
+
+    monkeypatch.setattr(bikeshare_data, 'read_city_csv', counted_read_city_csv)
+    return parsed
+
+
+def read_city_csv_again(filename):
+    """ Parses the whole CSV file without going through the cache or counting the parse. """
+    return bikeshare_data.prepare_trip_data(pd.read_csv(filename, dtype=bikeshare_data.TRIP_DATA_SCHEMA))
+
+
+def test_cached_frame_equals_the_parsed_frame(city_csv, tmp_path):
+    cache_dir = str(tmp_path / 'cache')
+    cold = bikeshare_cache.load_city_frame(city_csv, cache_dir)
+    warm = bikeshare_cache.load_city_frame(city_csv, cache_dir)
+
+    assert_same_frame(cold, bikeshare_data.read_city_csv(city_csv))
+    assert_same_frame(warm, cold)
+
+
+def test_dropped_rows_give_the_same_frame_cold_and_warm(tmp_path):
+    trips = make_trips(200)
+    trips.loc[[3, 50], 'Start Time'] = 'not a time'
+    filename = write_trips(tmp_path / 'chicago.csv', trips)
+    cache_dir = str(tmp_path / 'cache')
+
+    cold = bikeshare_cache.load_city_frame(filename, cache_dir)
+    warm = bikeshare_cache.load_city_frame(filename, cache_dir)
+
+    assert len(cold) == 198
+    assert isinstance(cold.index, pd.RangeIndex)
+    assert_same_frame(warm, cold)
+
+
+def test_appended_rows_equal_a_full_parse(city_csv, tmp_path, monkeypatch):
+    cache_dir = str(tmp_path / 'cache')
+    bikeshare_cache.load_city_frame(city_csv, cache_dir)
+
+    # The new rows bring a station and a user type the cached categories do not have yet
+    new_trips = make_trips(500, seed=1, first_id=10000)
+    new_trips.loc[::7, 'Start Station'] = 'New Station & First Ave'
+    new_trips.loc[::11, 'User Type'] = 'Visitor'
+    new_filename = write_trips(tmp_path / 'new.csv', new_trips)
+    bikeshare_data.append_csv_rows(city_csv, new_filename)
+
+    parsed = count_parses(monkeypatch)
+    appended = bikeshare_cache.load_city_frame(city_csv, cache_dir)
+    assert parsed == []
+
+    expected = read_city_csv_again(city_csv)
+    assert len(appended) == 3500
+    assert_same_frame(appended, expected)
+    assert_same_frame(bikeshare_cache.load_city_frame(city_csv, cache_dir), expected)
+    assert parsed == []
+
+
+def test_appended_rows_that_fail_to_parse_are_parsed_with_the_whole_file(city_csv, tmp_path, monkeypatch):
+    cache_dir = str(tmp_path / 'cache')
+    bikeshare_cache.load_city_frame(city_csv, cache_dir)
+    bikeshare_data.append_csv_rows(city_csv, write_trips(tmp_path / 'new.csv', make_trips(500, seed=1, first_id=10000)))
+
+    def failing_read_appended_rows(filename, start, stats_columns_only=False):
+        raise pd.errors.ParserError('Error tokenizing data')
+
+    monkeypatch.setattr(bikeshare_data, 'read_appended_rows', failing_read_appended_rows)
+    parsed = count_parses(monkeypatch)
+    reloaded = bikeshare_cache.load_city_frame(city_csv, cache_dir)
+
+    assert parsed == [city_csv]
+    assert_same_frame(reloaded, read_city_csv_again(city_csv))
+    assert_same_frame(bikeshare_cache.load_city_frame(city_csv, cache_dir), reloaded)
+    assert parsed == [city_csv]
+
+
+def test_changed_rows_are_parsed_again(city_csv, tmp_path, monkeypatch):
+    cache_dir = str(tmp_path / 'cache')
+    bikeshare_cache.load_city_frame(city_csv, cache_dir)
+    write_trips(city_csv, make_trips(seed=2))
+
+    parsed = count_parses(monkeypatch)
+    reloaded = bikeshare_cache.load_city_frame(city_csv, cache_dir)
+
+    assert parsed == [city_csv]
+    assert_same_frame(reloaded, read_city_csv_again(city_csv))
+
+
+def test_appended_rows_are_added_to_the_stored_index(city_csv, tmp_path, monkeypatch):
+    cache_dir = str(tmp_path / 'cache')
+    bikeshare_cache.load_city_data(city_csv, cache_dir)
+    bikeshare_data.append_csv_rows(city_csv, write_trips(tmp_path / 'new.csv', make_trips(500, seed=1, first_id=10000)))
+
+    expected = bikeshare_data.CityData(read_city_csv_again(city_csv)).get_index()
+
+    # Only the new rows are grouped by month and day of week
+    grouped_rows = []
+    get_row_order = bikeshare_data.get_row_order
+
+    def counted_get_row_order(keys, key_count):
+        grouped_rows.append(len(keys))
+        return get_row_order(keys, key_count)
+
+    monkeypatch.setattr(bikeshare_data, 'get_row_order', counted_get_row_order)
+    city_data = bikeshare_cache.load_city_data(city_csv, cache_dir)
+    assert grouped_rows == [500, 500, 500]
+
+    for stored in (city_data.get_index(), bikeshare_cache.load_city_data(city_csv, cache_dir).get_index()):
+        for name, values in expected.items():
+            np.testing.assert_array_equal(stored[name], values)
+    assert grouped_rows == [500, 500, 500]
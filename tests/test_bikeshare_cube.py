@@ -0,0 +1,55 @@
+import numpy as np
+
+import bikeshare_cache
+import bikeshare_cube
+import bikeshare_data
+import bikeshare_report
+import bikeshare_stats
+from conftest import make_trips, write_trips
+
+# The statistics the cube does not keep the values for
+MISSING_STATISTICS = {'most_common_pair', 'earliest_birth_year', 'latest_birth_year', 'most_common_birth_year',
+                      'most_common_start_station', 'most_common_end_station', 'duration_summary',
+                      'start_station_counts', 'end_station_counts', 'round_trip_counts', 'top_station_pairs',
+                      'duration_percentiles', 'duration_histogram', 'birth_year_percentiles', 'birth_year_histogram'}
+
+SELECTIONS = ((None, None), (3, None), (None, 5), (2, 3))
+
+
+def assert_cube_answers(cube, trips):
+    """ Checks the statistics of the cube for each selection against compute_trip_stats on the same trips. """
+    for selection in SELECTIONS:
+        cube_stats = cube.get_trip_stats(*selection)
+        expected_stats = bikeshare_stats.compute_trip_stats(bikeshare_data.filter_trips(trips, *selection))
+        statistics = bikeshare_report.get_statistics(cube_stats)
+        expected = bikeshare_report.get_statistics(expected_stats)
+        for name in set(expected) - MISSING_STATISTICS:
+            assert statistics[name] == expected[name], name
+        np.testing.assert_allclose(cube_stats.duration_summary,
+                                   expected_stats.duration_summary[bikeshare_cube.CUBE_SUMMARY_INDEX])
+
+
+def test_cube_equals_compute_trip_stats(city_csv, trips, tmp_path):
+    cache_dir = str(tmp_path / 'cache')
+    assert_cube_answers(bikeshare_cube.load_cube(city_csv, cache_dir, chunk_rows=700), trips)
+
+    # The stored cube is read back the same by a store that did not build it
+    store = bikeshare_cache.SummaryStore('cube', bikeshare_cube.TripCube, bikeshare_cube.CUBE_FILE_SUFFIX,
+                                         bikeshare_cube.CUBE_FORMAT_VERSION)
+    assert_cube_answers(store.load(city_csv, cache_dir), trips)
+
+
+def test_appended_rows_are_added_to_the_cube(city_csv, tmp_path, monkeypatch):
+    cache_dir = str(tmp_path / 'cache')
+    bikeshare_cube.load_cube(city_csv, cache_dir)
+    new_trips = make_trips(500, seed=1, first_id=10000)
+    new_trips.loc[::11, 'User Type'] = 'Visitor'
+    bikeshare_data.append_csv_rows(city_csv, write_trips(tmp_path / 'new.csv', new_trips))
+
+    built = []
+    monkeypatch.setattr(bikeshare_cube.CUBE_STORE, 'build', lambda *args: built.append(args))
+    cube = bikeshare_cube.load_cube(city_csv, cache_dir)
+
+    assert built == []
+    assert cube.row_count == 3500
+    assert_cube_answers(cube, bikeshare_data.read_city_csv(city_csv))
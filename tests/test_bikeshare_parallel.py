@@ -0,0 +1,34 @@
+import bikeshare_data
+import bikeshare_parallel
+import bikeshare_report
+import bikeshare_stats
+from conftest import make_trips, write_trips
+
+# Small enough to split each test city into several parts
+PART_BYTES = 50000
+
+
+def test_ranges_start_at_lines_and_cover_the_file(city_csv):
+    header, ranges = bikeshare_parallel.split_csv_file(city_csv, 2, PART_BYTES)
+    with open(city_csv, 'rb') as csv_file:
+        data = csv_file.read()
+
+    assert header == data[:len(header)]
+    assert len(ranges) > 2
+    assert ranges[0][0] == len(header) and ranges[-1][1] == len(data)
+    for (_, end), (start, _) in zip(ranges[:-1], ranges[1:]):
+        assert end == start and data[start - 1:start] == b'\n'
+
+
+def test_parallel_parts_equal_compute_trip_stats(city_csv, trips, tmp_path):
+    other_csv = write_trips(tmp_path / 'washington.csv', make_trips(2000, seed=3))
+    other_trips = bikeshare_data.read_city_csv(other_csv)
+
+    for selection in ((None, None), (3, None), (2, 3)):
+        city_aggregates = bikeshare_parallel.aggregate_cities([city_csv, other_csv], *selection, worker_count=2,
+                                                              part_bytes=PART_BYTES, distributions=True)
+        for filename, city_trips in ((city_csv, trips), (other_csv, other_trips)):
+            trip_stats = bikeshare_stats.TripStats(city_aggregates[filename])
+            expected = bikeshare_stats.compute_trip_stats(bikeshare_data.filter_trips(city_trips, *selection),
+                                                          distributions=True)
+            assert bikeshare_report.get_statistics(trip_stats) == bikeshare_report.get_statistics(expected)
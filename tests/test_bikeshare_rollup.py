@@ -0,0 +1,77 @@
+import asyncio
+from urllib.parse import parse_qs
+
+import numpy as np
+import pytest
+
+import bikeshare_2
+import bikeshare_cache
+import bikeshare_data
+import bikeshare_rollup
+import bikeshare_service
+import bikeshare_stats
+from conftest import make_trips, write_trips
+
+
+def assert_month_totals(rollup, trips):
+    """ Checks the trips and trip duration total of every month against compute_trip_stats for the month. """
+    for month_no in range(1, 7):
+        expected = bikeshare_stats.compute_trip_stats(bikeshare_data.filter_trips(trips, month_no))
+        trip_count, total_duration = rollup.get_total(f'2017-{month_no:02}-01', f'2017-{month_no + 1:02}-01')
+        assert trip_count == expected.trip_count
+        assert total_duration == pytest.approx(expected.total_duration)
+
+
+def test_month_totals_equal_compute_trip_stats(city_csv, trips, tmp_path):
+    cache_dir = str(tmp_path / 'cache')
+    assert_month_totals(bikeshare_rollup.load_rollup(city_csv, cache_dir, chunk_rows=700), trips)
+
+    # The stored rollup is read back the same by a store that did not build it
+    store = bikeshare_cache.SummaryStore('rollup', bikeshare_rollup.TripRollup, bikeshare_rollup.ROLLUP_FILE_SUFFIX,
+                                         bikeshare_rollup.ROLLUP_FORMAT_VERSION)
+    assert_month_totals(store.load(city_csv, cache_dir), trips)
+
+
+def test_periods_equal_the_trips_of_each_period(city_csv, trips):
+    rollup = bikeshare_rollup.TripRollup.from_csv(city_csv, chunk_rows=700)
+    start, end = '2017-03-05 06:00', '2017-04-20'
+    start_times = trips['Start Time']
+    in_range = trips[(start_times >= start) & (start_times < end)]
+
+    for resolution, frequency in bikeshare_rollup.RESOLUTION_FREQUENCIES.items():
+        periods = rollup.query(start, end, resolution)
+        expected = in_range.groupby(in_range['Start Time'].dt.to_period(frequency))['Trip Duration'].agg(
+            ['size', 'sum'])
+
+        periods_with_trips = periods[periods['trips'] > 0]
+        assert list(periods_with_trips.index) == list(expected.index)
+        assert periods_with_trips['trips'].tolist() == expected['size'].tolist()
+        np.testing.assert_allclose(periods_with_trips['total_duration'], expected['sum'])
+        assert periods['trips'].sum() == len(in_range)
+
+
+def test_appended_rows_are_added_to_the_rollup(city_csv, tmp_path, monkeypatch):
+    cache_dir = str(tmp_path / 'cache')
+    bikeshare_rollup.load_rollup(city_csv, cache_dir)
+    new_csv = write_trips(tmp_path / 'new.csv', make_trips(500, seed=1, first_id=10000))
+    bikeshare_data.append_csv_rows(city_csv, new_csv)
+
+    built = []
+    monkeypatch.setattr(bikeshare_rollup.ROLLUP_STORE, 'build', lambda *args: built.append(args))
+    rollup = bikeshare_rollup.load_rollup(city_csv, cache_dir)
+
+    assert built == []
+    assert rollup.row_count == 3500
+    assert_month_totals(rollup, bikeshare_data.read_city_csv(city_csv))
+
+
+def test_service_answers_the_rollup(city_csv, trips, tmp_path, monkeypatch):
+    monkeypatch.setattr(bikeshare_2, 'CITY_DATA', {'chicago': city_csv})
+    service = bikeshare_service.StatsService(cache_dir=str(tmp_path / 'cache'))
+    query = parse_qs('city=chicago&start=2017-03-01&end=2017-04-01&resolution=week')
+    answer = asyncio.run(service.answer('/rollup', query))
+
+    expected = bikeshare_stats.compute_trip_stats(bikeshare_data.filter_trips(trips, 3))
+    assert answer['trips'] == expected.trip_count
+    assert answer['total_duration'] == pytest.approx(expected.total_duration)
+    assert sum(period['trips'] for period in answer['periods']) == expected.trip_count
@@ -0,0 +1,83 @@
+import asyncio
+import json
+
+import pytest
+
+import bikeshare_2
+import bikeshare_data
+import bikeshare_report
+import bikeshare_service
+import bikeshare_stats
+from conftest import make_trips, write_trips
+
+# Query strings of the selections asked for, and the month number and day of the week (0 for Monday) they stand for
+SELECTIONS = {'city=chicago': (None, None),
+              'city=chicago&month=march': (3, None),
+              'city=chicago&month=feb&day=wednesday': (2, 2)}
+
+
+@pytest.fixture
+def service(city_csv, tmp_path, monkeypatch):
+    """ A service answering for the test city only. """
+    monkeypatch.setattr(bikeshare_2, 'CITY_DATA', {'chicago': city_csv})
+    return bikeshare_service.StatsService(cache_dir=str(tmp_path / 'cache'))
+
+
+async def get_json(port, path):
+    """ Sends a GET request to the service and returns the status and the JSON answer. """
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(f'GET {path} HTTP/1.1\r\nConnection: close\r\n\r\n'.encode('latin-1'))
+    response = await reader.read()
+    writer.close()
+    head, _, body = response.partition(b'\r\n\r\n')
+    return int(head.split()[1]), json.loads(body)
+
+
+def request_all(service, paths):
+    """ Asks the service for every path at the same time over HTTP, returning the status and answer of each. """
+    async def request():
+        server = await asyncio.start_server(service.handle_connection, '127.0.0.1', 0)
+        async with server:
+            port = server.sockets[0].getsockname()[1]
+            return await asyncio.gather(*(get_json(port, path) for path in paths))
+
+    return asyncio.run(request())
+
+
+def get_expected_statistics(trips, month_no, weekday):
+    """ Returns the statistics of a selection as compute_trip_stats gives them, after going through JSON. """
+    trip_stats = bikeshare_stats.compute_trip_stats(bikeshare_data.filter_trips(trips, month_no, weekday),
+                                                    distributions=True)
+    return json.loads(json.dumps(bikeshare_report.get_statistics(trip_stats)))
+
+
+def assert_answers(service, trips):
+    """ Checks the answer of the service for every selection against compute_trip_stats on the same trips. """
+    answers = request_all(service, [f'/stats?{query}' for query in SELECTIONS])
+    for (status, answer), selection in zip(answers, SELECTIONS.values()):
+        assert status == 200
+        assert answer['statistics'] == get_expected_statistics(trips, *selection)
+
+
+def test_answers_equal_compute_trip_stats(service, trips):
+    assert_answers(service, trips)
+
+    # A report has the statistics its stats function shows
+    (status, answer), = request_all(service, ['/stats/user_stats?city=chicago&month=march'])
+    expected = get_expected_statistics(trips, 3, None)
+    assert status == 200
+    assert answer['statistics'] == {name: expected[name]
+                                    for name in bikeshare_service.REPORT_STATISTICS['user_stats']}
+
+
+def test_appended_rows_change_the_answers(service, city_csv, tmp_path):
+    assert_answers(service, bikeshare_data.read_city_csv(city_csv))
+    new_csv = write_trips(tmp_path / 'new.csv', make_trips(500, seed=1, first_id=10000))
+    bikeshare_data.append_csv_rows(city_csv, new_csv)
+    assert_answers(service, bikeshare_data.read_city_csv(city_csv))
+
+
+def test_bad_requests_are_answered_with_errors(service):
+    answers = request_all(service, ['/stats?city=paris', '/stats?city=chicago&month=december', '/nowhere'])
+    assert [status for status, _ in answers] == [400, 400, 404]
+    assert all('error' in answer for _, answer in answers)
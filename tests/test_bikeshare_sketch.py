@@ -0,0 +1,85 @@
+import numpy as np
+import pandas as pd
+
+import bikeshare_data
+import bikeshare_sketch
+import bikeshare_stats
+
+# Number of distinct values counted, far more than the sketches keep counters for
+VALUE_COUNT = 2000
+COUNTER_COUNT = 50
+
+
+def make_values(seed, size):
+    """ Returns labels drawn so a few of them are far more common than the rest. """
+    rng = np.random.default_rng(seed)
+    return pd.Series(np.minimum(rng.zipf(1.3, size), VALUE_COUNT)).map('value {}'.format)
+
+
+def add_values(sketch, values):
+    """ Adds the exact counts of the values of a part of the data to a sketch, the way the stations are added. """
+    counts = values.value_counts(sort=False)
+    labels = counts.index.to_numpy(dtype=object)
+    sketch.add(bikeshare_sketch.hash_labels(labels), counts.to_numpy(), lambda kept: labels[kept])
+
+
+def assert_within_bounds(sketch, exact_counts):
+    """ Checks that no count of the sketch is too low or too high by more than its error bounds. """
+    labels, counts, errors = sketch.get_counts()
+    exact = exact_counts.reindex(labels, fill_value=0).to_numpy()
+    assert (counts >= exact).all()
+    assert (counts - errors <= exact).all()
+    assert (counts - exact <= sketch.get_error_bound()).all()
+
+    # Every value more common than the error bound has a counter
+    assert set(exact_counts[exact_counts > sketch.get_error_bound()].index) <= set(labels)
+
+
+def test_counts_stay_within_the_error_bounds():
+    values = make_values(0, 20000)
+    sketch = bikeshare_sketch.HeavyHitterSketch(COUNTER_COUNT)
+    add_values(sketch, values)
+
+    assert sketch.total == len(values)
+    assert_within_bounds(sketch, values.value_counts())
+
+
+def test_merged_sketches_stay_within_the_error_bounds():
+    parts = [make_values(seed, 5000) for seed in range(4)]
+    sketch = bikeshare_sketch.HeavyHitterSketch(COUNTER_COUNT)
+    for part in parts:
+        part_sketch = bikeshare_sketch.HeavyHitterSketch(COUNTER_COUNT)
+        add_values(part_sketch, part)
+        sketch.merge(part_sketch)
+
+    assert_within_bounds(sketch, pd.concat(parts).value_counts())
+
+
+def test_count_min_estimates_are_never_too_low():
+    values = make_values(1, 20000)
+    epsilon = 0.001
+    sketch = bikeshare_sketch.HeavyHitterSketch(COUNTER_COUNT, epsilon=epsilon)
+    add_values(sketch, values)
+
+    exact_counts = values.value_counts()
+    estimates = sketch.estimate(bikeshare_sketch.hash_labels(exact_counts.index.to_numpy(dtype=object)))
+    differences = estimates - exact_counts.to_numpy()
+    assert (differences >= 0).all()
+
+    # Only a small share of the estimates may be off by more than epsilon times the number of values
+    assert (differences > epsilon * len(values)).mean() <= bikeshare_sketch.DEFAULT_DELTA
+
+
+def test_counts_are_exact_with_a_counter_for_every_station(city_csv, trips):
+    selection = (None, None)
+    aggregates = bikeshare_data.stream_selection_aggregates(
+        city_csv, [selection], chunk_rows=700, aggregates_class=bikeshare_sketch.ApproximateTripAggregates)
+    trip_stats = bikeshare_sketch.ApproximateTripStats(aggregates[selection])
+    exact_stats = bikeshare_stats.compute_trip_stats(trips)
+
+    for name in ('start_station_counts', 'end_station_counts', 'round_trip_counts'):
+        approximate_counts = getattr(trip_stats, name)
+        exact_counts = getattr(exact_stats, name)
+        pd.testing.assert_series_equal(approximate_counts.sort_index(), exact_counts.sort_index(),
+                                       check_index_type=False)
+    assert trip_stats.most_common_pair == exact_stats.most_common_pair
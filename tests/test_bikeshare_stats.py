@@ -0,0 +1,180 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import bikeshare_data
+import bikeshare_report
+import bikeshare_stats
+
+
+def value_counts(column):
+    """
+    Returns the counts of a column as value_counts gives them for the text column read without categories, with
+    the values of the same count in the order they first appear
+    """
+    return column.astype(object).value_counts()
+
+
+def assert_same_counts(counts, expected):
+    """ Checks counts against value_counts, with the same values, counts and order. """
+    assert counts.index.astype(object).tolist() == expected.index.astype(object).tolist()
+    assert counts.to_numpy().tolist() == expected.to_numpy().tolist()
+
+
+def split_trips(trips, part_count):
+    """ Returns the trips in consecutive parts, each numbered from 0 like a chunk that was read by itself. """
+    bounds = np.linspace(0, len(trips), part_count + 1).astype(int)
+    return [trips.iloc[start:end].reset_index(drop=True) for start, end in zip(bounds[:-1], bounds[1:])]
+
+
+def get_statistics(aggregates):
+    """ Returns every statistic of aggregates as plain Python values, so two sets can be compared. """
+    return bikeshare_report.get_statistics(bikeshare_stats.TripStats(aggregates))
+
+
+def test_counts_match_value_counts(trips):
+    trip_stats = bikeshare_stats.compute_trip_stats(trips)
+
+    assert trip_stats.trip_count == len(trips)
+    assert_same_counts(trip_stats.month_counts, value_counts(trips['month']))
+    assert_same_counts(trip_stats.day_counts, value_counts(trips['day_of_week']))
+    assert_same_counts(trip_stats.hour_counts, value_counts(trips['start_hour']))
+    assert_same_counts(trip_stats.user_type_counts, value_counts(trips['User Type']))
+    assert_same_counts(trip_stats.gender_counts, value_counts(trips['Gender']))
+    assert_same_counts(trip_stats.start_station_counts, value_counts(trips['Start Station']))
+    assert_same_counts(trip_stats.end_station_counts, value_counts(trips['End Station']))
+
+    round_trips = trips[trips['Start Station'] == trips['End Station']]
+    assert_same_counts(trip_stats.round_trip_counts, value_counts(round_trips['Start Station']))
+
+
+def test_most_common_values_match_mode(trips):
+    trip_stats = bikeshare_stats.compute_trip_stats(trips)
+
+    for field_name in ('month', 'day_of_week', 'start_hour', 'Start Station', 'End Station'):
+        assert trip_stats.get_most_common(field_name) == trips[field_name].mode()[0]
+    pairs = 'Start: ' + trips['Start Station'].astype(str) + '  End: ' + trips['End Station'].astype(str)
+    assert trip_stats.get_most_common('start_end_dest') == pairs.mode()[0]
+    assert trip_stats.most_common_birth_year == trips['Birth Year'].mode()[0]
+
+
+def test_durations_match_groupby(trips):
+    trip_stats = bikeshare_stats.compute_trip_stats(trips)
+    durations = trips['Trip Duration']
+
+    assert trip_stats.total_duration == durations.sum()
+    assert trip_stats.mean_duration == pytest.approx(durations.mean())
+    pd.testing.assert_series_equal(trip_stats.duration_summary, durations.describe(), check_names=False)
+    np.testing.assert_allclose(trip_stats.mean_duration_by_month,
+                               trips.groupby('month_no', observed=True)['Trip Duration'].mean())
+    expected_by_day = trips.groupby('day_of_week', observed=True)['Trip Duration'].mean()
+    np.testing.assert_allclose(trip_stats.mean_duration_by_day,
+                               expected_by_day.reindex(trip_stats.mean_duration_by_day.index))
+
+
+def test_user_types_by_group_match_groupby(trips):
+    trip_stats = bikeshare_stats.compute_trip_stats(trips)
+
+    for by_group, group_name in ((trip_stats.user_types_by_month, 'month_no'),
+                                 (trip_stats.user_types_by_day, 'day_of_week')):
+        expected = trips.groupby([group_name, 'User Type'], observed=True).size()
+        assert by_group.sum() == expected.sum()
+        for (group, user_type), count in by_group.items():
+            assert count == expected[(group, user_type)]
+
+
+def test_merged_parts_equal_the_whole(trips):
+    expected = get_statistics(bikeshare_stats.TripAggregates.from_frame(trips, distributions=True))
+
+    parts = [bikeshare_stats.TripAggregates.from_frame(part, distributions=True) for part in split_trips(trips, 3)]
+    merged = parts[0]
+    for part in parts[1:]:
+        merged.merge(part)
+
+    assert get_statistics(merged) == expected
+
+
+def test_merge_is_associative(trips):
+    def from_parts():
+        return [bikeshare_stats.TripAggregates.from_frame(part, distributions=True)
+                for part in split_trips(trips, 3)]
+
+    first, second, third = from_parts()
+    first.merge(second)
+    first.merge(third)
+
+    left, middle, right = from_parts()
+    middle.merge(right)
+    left.merge(middle)
+
+    assert get_statistics(left) == get_statistics(first)
+
+
+def test_merge_with_an_empty_part(trips):
+    expected = get_statistics(bikeshare_stats.TripAggregates.from_frame(trips))
+
+    merged = bikeshare_stats.TripAggregates()
+    merged.merge(bikeshare_stats.TripAggregates.from_frame(trips))
+
+    assert get_statistics(merged) == expected
+
+
+def test_streamed_chunks_equal_the_loaded_file(city_csv, trips):
+    expected = get_statistics(bikeshare_stats.TripAggregates.from_frame(trips, distributions=True))
+
+    assert (get_statistics(bikeshare_data.stream_trip_aggregates(city_csv, chunk_rows=700, distributions=True))
+            == expected)
+
+    march = bikeshare_data.filter_trips(trips, 3)
+    assert (get_statistics(bikeshare_data.stream_trip_aggregates(city_csv, 3, chunk_rows=700))
+            == get_statistics(bikeshare_stats.TripAggregates.from_frame(march)))
+
+
+def test_ranked_counts_pages_match_the_full_ranking(trips):
+    trip_stats = bikeshare_stats.compute_trip_stats(trips)
+    ranking = trip_stats.start_station_ranking
+    expected = value_counts(trips['Start Station'])
+
+    # The pages are asked for before the whole list is ranked
+    for start in range(0, len(ranking), 7):
+        labels, counts = ranking.get_rows(start, start + 7)
+        assert list(labels) == list(expected.index[start:start + 7])
+        assert list(counts) == list(expected.to_numpy()[start:start + 7])
+
+
+def test_empty_selection_has_no_values(trips):
+    for aggregates in (bikeshare_stats.TripAggregates.from_frame(trips.iloc[:0], distributions=True),
+                       bikeshare_stats.TripAggregates(quantile_sketch=True)):
+        trip_stats = bikeshare_stats.TripStats(aggregates)
+
+        assert trip_stats.trip_count == 0
+        assert trip_stats.get_most_common('Start Station') is None
+        assert trip_stats.duration_percentiles.isna().all()
+        assert trip_stats.duration_percentiles_by_month.empty
+        assert trip_stats.duration_summary.iloc[1:].isna().all()
+        assert trip_stats.birth_year_percentiles is None
+
+
+def test_group_percentiles_only_with_distributions(trips):
+    trip_stats = bikeshare_stats.compute_trip_stats(trips)
+    with_distributions = bikeshare_stats.compute_trip_stats(trips, distributions=True)
+
+    assert trip_stats.duration_percentiles_by_month is None
+    assert trip_stats.duration_percentiles_by_user_type is None
+    assert with_distributions.duration_percentiles_by_month is not None
+    pd.testing.assert_series_equal(trip_stats.duration_percentiles, with_distributions.duration_percentiles)
+    pd.testing.assert_series_equal(trip_stats.duration_summary, with_distributions.duration_summary)
+
+
+def test_streamed_selections_equal_compute_trip_stats(city_csv, trips):
+    # All the months and days, a month, a day and a month and day are added up in one pass over 5 chunks
+    selections = [(None, None), (3, None), (None, 5), (2, 3)]
+    streamed = bikeshare_data.stream_selection_aggregates(city_csv, selections, chunk_rows=700, distributions=True)
+
+    for selection in selections:
+        trip_stats = bikeshare_stats.TripStats(streamed[selection])
+        expected = bikeshare_stats.compute_trip_stats(bikeshare_data.filter_trips(trips, *selection),
+                                                      distributions=True)
+        assert bikeshare_report.get_statistics(trip_stats) == bikeshare_report.get_statistics(expected)
+        assert_same_counts(trip_stats.start_station_counts, expected.start_station_counts)
+        assert trip_stats.most_common_pair == expected.most_common_pair